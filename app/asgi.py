@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlencode
+
+from app import config
+from app.container import Container
+from app.models.store_token import StoreTokenException
+from app.services.tiendanube import TiendaNubeException
+from app.services.logger import Logger, set_request_id
+from app.services.shipping_options import ShippingOptionsException
+from app.services.installer import PROGRESS_PAGE
+from app.services.job_queue import Job
+from app.services.batch_quotes import read_ndjson
+from app.services.metrics import registry, REQUESTS_IN_FLIGHT, REQUEST_SECONDS, STEP_SECONDS, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from app.util import json_codec
+from app.util.cart_schema import validate_cart, CartSchemaException
+
+"""
+Async (ASGI) application.
+
+This is the async serving mode of the app, an alternative to the sync Flask app defined in app.main. Outbound calls to
+the Correios webservice and the TiendaNube API run in thread pools and are awaited, so the event loop is never blocked
+and a single process can keep up to ASYNC_MAX_WORKERS quotes in flight. The app services are built by each
+worker when it starts, and its database connection pool only on the first installation request, so quotes are still
+served while the database is unavailable. It can be served with any ASGI server, like:
+
+    uvicorn app.asgi:application --workers 4
+"""
+
+# initializing logger
+logger = Logger(config.APP_NAME)
+
+# initializing the app services, built lazily by each worker, and the installer and batch thread pools
+container = Container(config.ASYNC_MAX_WORKERS)
+installer_executor = ThreadPoolExecutor(max_workers=config.ASYNC_INSTALL_MAX_WORKERS)
+batch_executor = ThreadPoolExecutor(max_workers=config.ASYNC_BATCH_MAX_WORKERS)
+
+""" ASGI entry point """
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    elif scope['type'] != 'http':
+        return
+
+    # tagging the request, and its logs, with an id
+    headers = dict(scope.get('headers') or [])
+    set_request_id(headers.get(b'x-request-id', b'').decode('latin-1') or uuid.uuid4().hex)
+
+    # measuring the request, taking its status code from the response
+    status = {}
+    async def measured_send(message):
+        if message['type'] == 'http.response.start':
+            status['code'] = message['status']
+        await send(message)
+
+    started_at = time.perf_counter()
+    route = (scope['method'], scope['path'])
+    with REQUESTS_IN_FLIGHT.track():
+        if route == ('GET', '/'):
+            await send_response(measured_send, 200, b'Hello World!', 'text/plain; charset=utf-8')
+        elif route == ('GET', '/health/live'):
+            await send_response(measured_send, 200, json_codec.dumps({'status': 'alive'}), 'application/json')
+        elif route == ('GET', '/health/ready'):
+            await health_ready(measured_send)
+        elif route == ('GET', '/metrics'):
+            await send_response(measured_send, 200, registry.render().encode('utf-8'), METRICS_CONTENT_TYPE)
+        elif route == ('GET', '/nuvemshop/install'):
+            await install(scope, measured_send)
+        elif route == ('GET', '/nuvemshop/install/status'):
+            await install_status(scope, measured_send)
+        elif route == ('POST', '/nuvemshop/options'):
+            await options(receive, measured_send)
+        elif route == ('POST', '/nuvemshop/options/batch'):
+            await options_batch(receive, measured_send)
+        else:
+            route = ('', 'unmatched')
+            await send_response(measured_send, 404, b'Not Found', 'text/plain; charset=utf-8')
+
+    REQUEST_SECONDS.observe(time.perf_counter() - started_at, route=route[1], status=status.get('code', 500))
+
+""" Handle the ASGI lifespan protocol """
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await asyncio.get_event_loop().run_in_executor(None, container.warm_up)
+            except Exception as e:
+                logger.error('Failed to initialize the app services. An exception with message "{}" was caught'.format(str(e)))
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await asyncio.get_event_loop().run_in_executor(None, container.shutdown)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+# readiness route -> answers 503 until the quotes can be served. The database state is reported but does not affect the
+# readiness, since only the installation routes depend on it
+async def health_ready(send):
+    ready, checks = await asyncio.get_event_loop().run_in_executor(installer_executor, container.check_readiness)
+    body = {'status': 'ready' if ready else 'unavailable', 'checks': checks}
+    await send_response(send, 200 if ready else 503, json_codec.dumps(body), 'application/json')
+
+# installation route -> this route will be called during the authentication process (installation) of the app in a given store
+async def install(scope, send):
+    query = parse_qs(scope.get('query_string', b'').decode('utf-8'))
+    code = query.get('code', [None])[0]
+
+    try:
+        store_id = await asyncio.get_event_loop().run_in_executor(installer_executor, lambda: container.installer.install(code))
+        url = '/nuvemshop/install/status?' + urlencode({'store_id': store_id})
+        await send_response(send, 302, b'', 'text/html; charset=utf-8', [(b'location', url.encode('utf-8'))])
+    except StoreTokenException as e:
+        logger.error('An error occurred at try to save store access token to the database. An exception with message "{}" was caught'.format(str(e)))
+        await send_response(send, 200, b'Hello! An error occurred at try to authenticate you against Tienda Nube API. Please, contact the administrator.', 'text/html; charset=utf-8')
+    except TiendaNubeException as e:
+        logger.error('An error occurred at try to setup nuvemshop application. Exception with message "{}" was caught'.format(str(e)))
+        await send_response(send, 200, b'An error occurred at try to setup application in your store. Please, contact the administrator.', 'text/html; charset=utf-8')
+
+# installation status route -> the merchant waits here until the store provisioning finishes, and is then redirected to
+# the store admin
+async def install_status(scope, send):
+    query = parse_qs(scope.get('query_string', b'').decode('utf-8'))
+    job = await asyncio.get_event_loop().run_in_executor(installer_executor, lambda: container.installer.get_status(query.get('store_id', [None])[0]))
+
+    if job is None:
+        await send_response(send, 404, b'Not Found', 'text/plain; charset=utf-8')
+    elif job.status == Job.DONE:
+        await send_response(send, 302, b'', 'text/html; charset=utf-8', [(b'location', job.result.get('admin_url').encode('utf-8'))])
+    elif job.status == Job.FAILED:
+        await send_response(send, 200, b'An error occurred at try to setup application in your store. Please, contact the administrator.', 'text/html; charset=utf-8')
+    else:
+        await send_response(send, 200, PROGRESS_PAGE.encode('utf-8'), 'text/html; charset=utf-8')
+
+# shipping options route -> this route will be called during a purchase process (product page, cart, checkout, etc...)
+async def options(receive, send):
+    try:
+        body = await read_body(receive, config.ASYNC_MAX_BODY_SIZE)
+    except BodyTooLargeException as e:
+        logger.warn('Invalid options request. {}'.format(str(e)))
+        return await send_response(send, 413, b'Payload Too Large', 'text/plain; charset=utf-8')
+    logger.payload('Options got requested with the following body', lambda: body.decode('utf-8'))
+
+    try:
+        with STEP_SECONDS.time(step='parse'):
+            origin, destination, items = validate_cart(json_codec.loads(body))
+    except (json_codec.DecodeError, CartSchemaException) as e:
+        logger.warn('Invalid options request. {}'.format(str(e)))
+        return await send_response(send, 400, b'Bad Request', 'text/plain; charset=utf-8')
+
+    try:
+        options = await container.shipping_options.quote_async(origin, destination, items)
+    except ShippingOptionsException as e:
+        logger.error(str(e))
+        return await send_response(send, 400, b'Bad Request', 'text/plain; charset=utf-8')
+
+    with STEP_SECONDS.time(step='serialize'):
+        body = json_codec.dumps({'rates': options})
+    await send_response(send, 200, body, 'application/json')
+
+# batch shipping options route -> this route quotes many carts at once, reading one options body per line (NDJSON) and
+# streaming back one result per line, in the same order. The batch runs in the batch thread pool, reading the body
+# lazily from there, so at most ASYNC_BATCH_MAX_WORKERS batches are quoted at the same time. A line longer than
+# ASYNC_MAX_BODY_SIZE ends the batch with an error line
+async def options_batch(receive, send):
+    loop = asyncio.get_event_loop()
+    results = container.batch_quotes.quote(read_ndjson(iter_body_lines(receive, loop, config.ASYNC_MAX_BODY_SIZE)))
+
+    await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'content-type', b'application/x-ndjson')]})
+    try:
+        while True:
+            try:
+                result = await loop.run_in_executor(batch_executor, next, results, None)
+            except BodyTooLargeException as e:
+                logger.warn('Invalid batch options request. {}'.format(str(e)))
+                await send({'type': 'http.response.body', 'body': json_codec.dumps({'error': str(e)}) + b'\n', 'more_body': True})
+                break
+            if result is None:
+                break
+            await send({'type': 'http.response.body', 'body': json_codec.dumps(result) + b'\n', 'more_body': True})
+    finally:
+        await loop.run_in_executor(batch_executor, results.close)
+    await send({'type': 'http.response.body', 'body': b''})
+
+"""
+Iterate over the lines of the request body from a thread other than the one running the event loop, raising a
+BodyTooLargeException when a line is longer than max_size bytes. The chunks of a line are joined once it is complete.
+"""
+def iter_body_lines(receive, loop, max_size):
+    parts = []
+    size = 0
+    more_body = True
+    while more_body:
+        message = asyncio.run_coroutine_threadsafe(receive(), loop).result()
+        more_body = message.get('more_body', False)
+        lines = message.get('body', b'').split(b'\n')
+        for n, line in enumerate(lines):
+            size += len(line)
+            if size > max_size:
+                raise BodyTooLargeException('The body has a line longer than {} bytes'.format(max_size))
+            parts.append(line)
+
+            # the last piece of a chunk is only complete once the next chunk starts with a new line
+            if n < len(lines) - 1:
+                yield b''.join(parts)
+                parts, size = [], 0
+    if size:
+        yield b''.join(parts)
+
+""" Read the whole request body, raising a BodyTooLargeException when it is longer than max_size bytes """
+async def read_body(receive, max_size):
+    chunks = []
+    size = 0
+    more_body = True
+    while more_body:
+        message = await receive()
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > max_size:
+            raise BodyTooLargeException('The body is longer than {} bytes'.format(max_size))
+        chunks.append(chunk)
+        more_body = message.get('more_body', False)
+    return b''.join(chunks)
+
+""" Send a complete response """
+async def send_response(send, status, body, content_type, headers = None):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type.encode('utf-8')), (b'content-length', str(len(body)).encode('utf-8'))] + (headers or [])
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+class BodyTooLargeException(Exception):
+    pass
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import argparse
+import sys
+
+from app import config
+from app.database import get_pool
+from app.models.store_token import StoreTokenRepository
+from app.services.carrier_sync import CarrierSync, BulkCarrierSync
+from app.services.logger import Logger
+from app.services.tiendanube import TiendaNube, create_session
+
+"""
+Bulk carrier management.
+
+Reconciles the shipping carrier and options of every installed store with the app config, after changing the carrier
+callback URL or adding a shipping option:
+
+    python -m app.carriers [--dry-run] [--prune] [--concurrency 8] [--rate 2] [--burst 10] [--checkpoint FILE]
+    python -m app.carriers --store 123 --store 456
+
+Dry runs print the changes each store needs, without applying them.
+"""
+
+""" Format a carrier change as a diff line """
+def format_change(store_id, change):
+    fields = ' '.join('{}={}'.format(k, v) for k, v in sorted(change.fields.items()))
+    target = '' if change.target is None else ' {}'.format(change.target)
+    return 'store {}: {}{} {}'.format(store_id, change.action, target, fields).rstrip()
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Sync the shipping carrier and options of every installed store with the app config')
+    parser.add_argument('--dry-run', action='store_true', help='print the changes of each store without applying them')
+    parser.add_argument('--prune', action='store_true', help='also delete the options with unknown codes')
+    parser.add_argument('--concurrency', type=int, default=config.CARRIER_SYNC_CONCURRENCY, help='stores synced at the same time (default %(default)s)')
+    parser.add_argument('--rate', type=float, default=config.CARRIER_SYNC_RATE, help='API calls per second to each store (default %(default)s)')
+    parser.add_argument('--burst', type=int, default=config.CARRIER_SYNC_BURST, help='API calls burst to each store (default %(default)s)')
+    parser.add_argument('--page-size', type=int, default=500, help='store tokens read per database query (default %(default)s)')
+    parser.add_argument('--checkpoint', metavar='FILE', help='save the progress to FILE, resuming from it when it exists')
+    parser.add_argument('--store', type=int, action='append', metavar='ID', help='sync only the given store, may be repeated')
+    parser.add_argument('--retry-failed', action='store_true', help='sync only the stores that failed in the checkpoint')
+    args = parser.parse_args(argv)
+
+    logger = Logger('Carriers')
+    tn = TiendaNube(
+        app_id=config.TIENDANUBE_APP_ID,
+        app_secret=config.TIENDANUBE_APP_SECRET,
+        api_url=config.TIENDANUBE_API_URL,
+        authorization_url=config.TIENDANUBE_AUTHORIZATION_URL,
+        session=create_session(max(args.concurrency * 2, config.TIENDANUBE_POOL_SIZE)),
+        timeout=(config.TIENDANUBE_CONNECT_TIMEOUT, config.TIENDANUBE_READ_TIMEOUT),
+        max_retries=config.TIENDANUBE_MAX_RETRIES,
+        backoff_factor=config.TIENDANUBE_BACKOFF_FACTOR,
+        max_backoff=config.TIENDANUBE_MAX_BACKOFF
+    )
+    bulk = BulkCarrierSync(
+        tn, StoreTokenRepository(get_pool()), CarrierSync(prune=args.prune),
+        concurrency=args.concurrency, rate=args.rate, burst=args.burst, page_size=args.page_size, checkpoint=args.checkpoint
+    )
+
+    stores = args.store
+    if args.retry_failed:
+        stores = bulk.load_checkpoint().get('failed')
+
+    synced, changed, failed = 0, 0, 0
+    for store_id, changes, error in bulk.run(dry_run=args.dry_run, stores=stores):
+        synced += 1
+        changed += 1 if changes else 0
+        failed += 1 if error is not None else 0
+        if args.dry_run:
+            for change in changes:
+                print(format_change(store_id, change))
+
+    logger.info('{} {} store(s): {} with changes, {} failed'.format('Checked' if args.dry_run else 'Synced', synced, changed, failed))
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
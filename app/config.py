@@ -8,17 +8,40 @@ load_dotenv()
 # general app information
 APP_NAME = 'sample-shipping-app'
 
+# logging settings
+LOG_LEVEL = os.getenv('LOG_LEVEL','INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT','json')
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE',10000))
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE',0.01))
+
+# profiling settings, allowing requests with a X-Profile header to be profiled with cProfile
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED','false').lower() in ('1','true','yes')
+
 # database settings
 DB_HOST = os.getenv('DB_HOST','localhost')
 DB_USER = os.getenv('DB_USER','root')
 DB_PASS = os.getenv('DB_PASS')
 DB_NAME = os.getenv('DB_NAME','sample_shipping_app')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE',5))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT',5))
+DB_CONNECT_TIMEOUT = int(os.getenv('DB_CONNECT_TIMEOUT',3))
+DB_CHECK_INTERVAL = float(os.getenv('DB_CHECK_INTERVAL',10))
+
+# store token cache settings
+TOKEN_CACHE_TTL = int(os.getenv('TOKEN_CACHE_TTL',300))
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv('TOKEN_CACHE_MAX_ENTRIES',50000))
 
 # tiendanube api settings
 TIENDANUBE_API_URL = os.getenv('TIENDANUBE_API_URL')
 TIENDANUBE_AUTHORIZATION_URL = os.getenv('TIENDANUBE_AUTHORIZATION_URL')
 TIENDANUBE_APP_ID = os.getenv('TIENDANUBE_APP_ID')
 TIENDANUBE_APP_SECRET = os.getenv('TIENDANUBE_APP_SECRET')
+TIENDANUBE_POOL_SIZE = int(os.getenv('TIENDANUBE_POOL_SIZE',10))
+TIENDANUBE_CONNECT_TIMEOUT = float(os.getenv('TIENDANUBE_CONNECT_TIMEOUT',3.05))
+TIENDANUBE_READ_TIMEOUT = float(os.getenv('TIENDANUBE_READ_TIMEOUT',10))
+TIENDANUBE_MAX_RETRIES = int(os.getenv('TIENDANUBE_MAX_RETRIES',3))
+TIENDANUBE_BACKOFF_FACTOR = float(os.getenv('TIENDANUBE_BACKOFF_FACTOR',0.5))
+TIENDANUBE_MAX_BACKOFF = float(os.getenv('TIENDANUBE_MAX_BACKOFF',30))
 
 # shipping carrier settings
 CARRIER_NAME = 'Correios'
@@ -37,4 +60,64 @@ OPTION_SEDEX_SERVICE = '04014'
 OPTION_CURRENCY = 'BRL'
 OPTION_TYPE = 'ship'
 OPTION_TIMEZONE = 'America/Sao_Paulo'
+OPTION_HOLIDAYS_PATH = os.getenv('OPTION_HOLIDAYS_PATH') or None
+OPTION_DELIVERY_MARGIN_DAYS = int(os.getenv('OPTION_DELIVERY_MARGIN_DAYS',2))
+OPTION_MAX_ITEMS = int(os.getenv('OPTION_MAX_ITEMS',500))
+
+
+# correios webservice settings
+CORREIOS_MAX_WORKERS = int(os.getenv('CORREIOS_MAX_WORKERS',8))
+CORREIOS_TIMEOUT = float(os.getenv('CORREIOS_TIMEOUT',5))
+CORREIOS_QUEUE_TIMEOUT = float(os.getenv('CORREIOS_QUEUE_TIMEOUT',1))
+CORREIOS_BREAKER_THRESHOLD = int(os.getenv('CORREIOS_BREAKER_THRESHOLD',5))
+CORREIOS_BREAKER_RECOVERY = float(os.getenv('CORREIOS_BREAKER_RECOVERY',30))
+CORREIOS_HEDGE_AFTER = float(os.getenv('CORREIOS_HEDGE_AFTER',0))
+
+# degraded mode settings, used when the correios webservice fails or times out
+DEGRADED_MODE = os.getenv('DEGRADED_MODE','stale,flat')
+FLAT_RATES = os.getenv('FLAT_RATES','')
+
+# installer job queue settings, the store provisioning runs in background jobs
+JOB_QUEUE_BACKEND = os.getenv('JOB_QUEUE_BACKEND','sqlite')
+JOB_QUEUE_SQLITE_PATH = os.getenv('JOB_QUEUE_SQLITE_PATH','/tmp/sample-shipping-app-jobs.db')
+JOB_QUEUE_MAX_ATTEMPTS = int(os.getenv('JOB_QUEUE_MAX_ATTEMPTS',5))
+JOB_QUEUE_MAX_BACKOFF = int(os.getenv('JOB_QUEUE_MAX_BACKOFF',300))
+INSTALL_WORKERS = int(os.getenv('INSTALL_WORKERS',2))
+
+# bulk carrier sync settings (python -m app.carriers)
+CARRIER_SYNC_CONCURRENCY = int(os.getenv('CARRIER_SYNC_CONCURRENCY',8))
+CARRIER_SYNC_RATE = float(os.getenv('CARRIER_SYNC_RATE',2))
+CARRIER_SYNC_BURST = int(os.getenv('CARRIER_SYNC_BURST',10))
+
+# quote warm-up settings, refreshing the hottest quotes before they expire (disabled with a zero budget of webservice calls per minute)
+WARMUP_BUDGET = int(os.getenv('WARMUP_BUDGET',0))
+# number of worker processes, also read by gunicorn and uvicorn as their default, sharing the warm-up budget
+WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY',1))
+WARMUP_REFRESH_AHEAD = int(os.getenv('WARMUP_REFRESH_AHEAD',300))
+WARMUP_INTERVAL = float(os.getenv('WARMUP_INTERVAL',10))
+WARMUP_HISTORY_SIZE = int(os.getenv('WARMUP_HISTORY_SIZE',10000))
+WARMUP_HALF_LIFE = int(os.getenv('WARMUP_HALF_LIFE',3600))
+WARMUP_ZONE_DIGITS = int(os.getenv('WARMUP_ZONE_DIGITS',5))
+WARMUP_KEYS_PER_ZONE = int(os.getenv('WARMUP_KEYS_PER_ZONE',5))
+
+# batch quotes settings
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY',2))
+
+# local rate engine settings, disabled when no rate tables path is supplied
+LOCAL_RATES_PATH = os.getenv('LOCAL_RATES_PATH')
+LOCAL_RATES_VERIFY_RATIO = float(os.getenv('LOCAL_RATES_VERIFY_RATIO',0.0))
+
+# async (asgi) app settings
+ASYNC_MAX_WORKERS = int(os.getenv('ASYNC_MAX_WORKERS',256))
+ASYNC_INSTALL_MAX_WORKERS = int(os.getenv('ASYNC_INSTALL_MAX_WORKERS',16))
+ASYNC_BATCH_MAX_WORKERS = int(os.getenv('ASYNC_BATCH_MAX_WORKERS',4))
+ASYNC_MAX_BODY_SIZE = int(os.getenv('ASYNC_MAX_BODY_SIZE',1048576))
 
+# rate cache settings
+RATE_CACHE_BACKEND = os.getenv('RATE_CACHE_BACKEND','memory')
+RATE_CACHE_TTL = int(os.getenv('RATE_CACHE_TTL',3600))
+RATE_CACHE_STALE_TTL = int(os.getenv('RATE_CACHE_STALE_TTL',21600))
+RATE_CACHE_MAX_BYTES = int(os.getenv('RATE_CACHE_MAX_BYTES',16 * 1024 * 1024))
+RATE_CACHE_MAX_ENTRIES = int(os.getenv('RATE_CACHE_MAX_ENTRIES',100000))
+RATE_CACHE_REDIS_URL = os.getenv('RATE_CACHE_REDIS_URL','redis://localhost:6379/0')
+RATE_CACHE_SQLITE_PATH = os.getenv('RATE_CACHE_SQLITE_PATH','/tmp/sample-shipping-app-rates.db')
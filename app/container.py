@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+
+from app import config
+from app.database import DatabaseStatus, get_pool
+from app.models.store_token import StoreTokenCache, StoreTokenRepository
+from app.services.tiendanube import TiendaNube, create_session
+from app.services.logger import Logger
+from app.services.rate_cache import create_rate_cache
+from app.services.local_rates import LocalCorreios, load_rate_tables
+from app.services.circuit_breaker import CircuitBreaker
+from app.services.shipping_rates import ShippingRates, parse_flat_rates
+from app.services.shipping_options import ShippingOptions
+from app.services.quote_warmer import QuoteHistory, create_quote_warmer
+from app.services.installer import Installer
+from app.services.job_queue import create_job_queue
+from app.services.batch_quotes import BatchQuotes
+from app.util.correios import CorreiosClient
+
+""" App Services Container """
+class Container(object):
+
+    _max_workers = None
+    _instances = None
+    _pid = None
+    _lock = None
+    _logger = None
+
+    """
+    Container Constructor.
+
+    Builds the app services lazily, on first use, with max_workers threads for the Correios calls. Nothing is connected
+    or started when the container is created, and the services are built again after a fork, so every worker owns its
+    own database pool, HTTP sessions, thread pools and background threads instead of sharing the ones of its parent.
+
+    The quote services do not depend on the database, so quotes are still served while the database is unavailable.
+    """
+    def __init__(self, max_workers = None):
+        self._logger = Logger(self.__class__.__name__)
+        self._max_workers = config.CORREIOS_MAX_WORKERS if max_workers is None else max_workers
+        self._instances = {}
+        self._lock = threading.RLock()
+
+    @property
+    def tn(self):
+        return self.__get('tn', self.__create_tiendanube)
+
+    @property
+    def shipping_rates(self):
+        return self.__get('shipping_rates', self.__create_shipping_rates)
+
+    @property
+    def shipping_options(self):
+        return self.__get('shipping_options', lambda: ShippingOptions(self.shipping_rates))
+
+    @property
+    def batch_quotes(self):
+        # a cart can take two quoting threads, so batches are kept to at most half of them and checkout keeps the rest
+        concurrency = max(1, min(config.BATCH_CONCURRENCY, self._max_workers // 4))
+        return self.__get('batch_quotes', lambda: BatchQuotes(self.shipping_options, concurrency=concurrency))
+
+    @property
+    def store_token_repository(self):
+        return self.__get('store_token_repository', lambda: StoreTokenRepository(
+            get_pool(), StoreTokenCache(ttl=config.TOKEN_CACHE_TTL, max_entries=config.TOKEN_CACHE_MAX_ENTRIES)
+        ))
+
+    @property
+    def install_queue(self):
+        return self.__get('install_queue', create_job_queue)
+
+    @property
+    def installer(self):
+        return self.__get('installer', self.__create_installer)
+
+    """ Build the quote services and start the background workers of the current process """
+    def warm_up(self):
+        self.batch_quotes
+        self.installer
+
+    """
+    Check if the current process is ready to serve requests, warming it up if needed.
+
+    Returns whether it is ready, which only requires the quote services, and the state of each dependency. The database
+    state is the last one checked in background, so the check never waits for the database.
+    """
+    def check_readiness(self):
+        checks = {}
+        try:
+            self.warm_up()
+            checks['quotes'] = 'ok'
+        except Exception as e:
+            self._logger.error('Failed to initialize the quote services. An exception with message "{}" was caught'.format(str(e)))
+            checks['quotes'] = 'failed'
+
+        checks['database'] = self.__get('database_status', lambda: DatabaseStatus(get_pool(), config.DB_CHECK_INTERVAL)).get()
+
+        return checks['quotes'] == 'ok', checks
+
+    """ Stop the background workers started by the current process """
+    def shutdown(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            instances = dict(self._instances)
+
+        if 'quote_warmer' in instances:
+            instances['quote_warmer'].stop()
+        if 'install_queue' in instances:
+            instances['install_queue'].stop()
+
+    """ Get a service of the current process, building it if needed """
+    def __get(self, name, factory):
+        if self._pid == os.getpid():
+            instance = self._instances.get(name)
+            if instance is not None:
+                return instance
+
+        with self._lock:
+            if self._pid != os.getpid():
+                self._instances = {}
+                self._pid = os.getpid()
+
+            if name not in self._instances:
+                self._instances[name] = factory()
+            return self._instances[name]
+
+    def __create_tiendanube(self):
+        return TiendaNube(
+            app_id=config.TIENDANUBE_APP_ID,
+            app_secret=config.TIENDANUBE_APP_SECRET,
+            api_url=config.TIENDANUBE_API_URL,
+            authorization_url=config.TIENDANUBE_AUTHORIZATION_URL,
+            session=create_session(config.TIENDANUBE_POOL_SIZE),
+            timeout=(config.TIENDANUBE_CONNECT_TIMEOUT, config.TIENDANUBE_READ_TIMEOUT),
+            max_retries=config.TIENDANUBE_MAX_RETRIES,
+            backoff_factor=config.TIENDANUBE_BACKOFF_FACTOR,
+            max_backoff=config.TIENDANUBE_MAX_BACKOFF
+        )
+
+    """ Build the shipping rates service, with the local rate engine and the quote warm-up when enabled """
+    def __create_shipping_rates(self):
+        local_correios = LocalCorreios(load_rate_tables(config.LOCAL_RATES_PATH)) if config.LOCAL_RATES_PATH else None
+        quote_history = QuoteHistory(config.WARMUP_HISTORY_SIZE, config.WARMUP_HALF_LIFE, config.WARMUP_ZONE_DIGITS) if config.WARMUP_BUDGET > 0 else None
+
+        shipping_rates = ShippingRates(
+            CorreiosClient(timeout=config.CORREIOS_TIMEOUT, pool_size=self._max_workers), create_rate_cache(), local=local_correios, verify_ratio=config.LOCAL_RATES_VERIFY_RATIO,
+            max_workers=self._max_workers, timeout=config.CORREIOS_TIMEOUT, queue_timeout=config.CORREIOS_QUEUE_TIMEOUT or None,
+            breaker=CircuitBreaker(config.CORREIOS_BREAKER_THRESHOLD, config.CORREIOS_BREAKER_RECOVERY),
+            hedge_after=config.CORREIOS_HEDGE_AFTER or None, stale_ttl=config.RATE_CACHE_STALE_TTL,
+            degraded_modes=[mode.strip() for mode in config.DEGRADED_MODE.split(',') if mode.strip()],
+            flat_rates=parse_flat_rates(config.FLAT_RATES), history=quote_history
+        )
+
+        if quote_history is not None:
+            quote_warmer = create_quote_warmer(shipping_rates, quote_history)
+            quote_warmer.start()
+            self._instances['quote_warmer'] = quote_warmer
+
+        return shipping_rates
+
+    """ Build the installer service, starting its job queue workers once its jobs handler is registered """
+    def __create_installer(self):
+        installer = Installer(self.tn, self.store_token_repository, self.install_queue)
+        self.install_queue.start(config.INSTALL_WORKERS)
+        return installer
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+import time
+from contextlib import contextmanager
+from mysql.connector.pooling import MySQLConnectionPool
+from mysql.connector.errors import PoolError
+
+from app import config
+
+""" Database Connection Pool """
+class ConnectionPool(object):
+
+    _size = None
+    _timeout = None
+    _connection_args = None
+    _pool = None
+    _pid = None
+    _semaphore = None
+    _lock = None
+
+    """
+    ConnectionPool Constructor.
+
+    Wraps a MySQL connection pool of a fixed size. Connections are checked out with the connection() context manager
+    and returned to the pool right after use, and callers wait up to timeout seconds for a free connection when every
+    connection of the pool is in use, instead of failing right away.
+
+    The connections are opened lazily on the first check out, and opened again after a fork, so every worker owns its
+    own connections instead of sharing the ones opened by its parent process.
+    """
+    def __init__(self, size, timeout, **connection_args):
+        self._size = size
+        self._timeout = timeout
+        self._connection_args = connection_args
+        self._lock = threading.Lock()
+
+    """ Check out a connection from the pool, giving it back when the context exits """
+    @contextmanager
+    def connection(self):
+        pool, semaphore = self.__get_pool()
+        if not semaphore.acquire(timeout=self._timeout):
+            raise PoolError('Failed getting connection; pool exhausted for more than {} seconds'.format(self._timeout))
+
+        try:
+            conn = pool.get_connection()
+            try:
+                yield conn
+            finally:
+                conn.close()
+        finally:
+            semaphore.release()
+
+    """ Get the MySQL connection pool of the current process, creating it if needed """
+    def __get_pool(self):
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = MySQLConnectionPool(pool_name='{}-{}'.format(config.APP_NAME, os.getpid()), pool_size=self._size, **self._connection_args)
+                self._semaphore = threading.BoundedSemaphore(self._size)
+                self._pid = os.getpid()
+            return self._pool, self._semaphore
+
+"""
+Database Status.
+
+Reports the last known state of the database of a connection pool: 'ok', 'unavailable', or 'unknown' until the first
+check finishes. The state is checked again in a background thread when it is older than interval seconds, so callers
+never wait for the database, even when its host does not answer or the pool is exhausted.
+"""
+class DatabaseStatus(object):
+
+    _pool = None
+    _interval = None
+    _status = None
+    _checked_at = None
+    _checking = False
+    _lock = None
+
+    def __init__(self, pool, interval):
+        self._pool = pool
+        self._interval = interval
+        self._status = 'unknown'
+        self._checking = False
+        self._lock = threading.Lock()
+
+    """ Get the last known state of the database, starting a new check if it is outdated """
+    def get(self):
+        with self._lock:
+            outdated = self._checked_at is None or time.monotonic() - self._checked_at >= self._interval
+            if outdated and not self._checking:
+                self._checking = True
+                threading.Thread(target=self.__check, name='database-status', daemon=True).start()
+            return self._status
+
+    def __check(self):
+        try:
+            with self._pool.connection() as conn:
+                status = 'ok' if conn.is_connected() else 'unavailable'
+        except Exception:
+            status = 'unavailable'
+
+        with self._lock:
+            self._status = status
+            self._checked_at = time.monotonic()
+            self._checking = False
+
+_pool = None
+
+""" Get the application database connection pool """
+def get_pool():
+    global _pool
+
+    if _pool is None:
+        _pool = ConnectionPool(
+            size=config.DB_POOL_SIZE,
+            timeout=config.DB_POOL_TIMEOUT,
+            host=config.DB_HOST,
+            user=config.DB_USER,
+            passwd=config.DB_PASS,
+            database=config.DB_NAME,
+            connection_timeout=config.DB_CONNECT_TIMEOUT
+        )
+
+    return _pool
@@ -1,149 +1,159 @@
 # -*- coding: utf-8 -*-
-from flask import Flask, request, redirect, json
-
-import mysql.connector
-from correios import Correios
-from correios.package import BoxPackage
-from functools import reduce
+import cProfile
+import io
+import pstats
+import time
+import uuid
+from flask import Blueprint, Flask, Response, current_app, g, request, redirect, abort, stream_with_context, url_for
 
 from app import config
-from app.models.store_token import StoreToken, StoreTokenRepository, StoreTokenException
-from app.services.tiendanube import TiendaNube, TiendaNubeException
-from app.services.logger import Logger
-from app.util.correios import item_to_package_item, rate_to_shipping_option
-
-# initializing app instance
-app = Flask(config.APP_NAME)
+from app.container import Container
+from app.models.store_token import StoreTokenException
+from app.services.tiendanube import TiendaNubeException
+from app.services.logger import Logger, set_request_id
+from app.services.shipping_options import ShippingOptionsException
+from app.services.installer import PROGRESS_PAGE
+from app.services.job_queue import Job
+from app.services.batch_quotes import read_ndjson
+from app.services.metrics import registry, REQUESTS_IN_FLIGHT, REQUEST_SECONDS, STEP_SECONDS, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from app.util import json_codec
+from app.util.cart_schema import validate_cart, CartSchemaException
 
 # initializing logger
 logger = Logger(config.APP_NAME)
 
-# initializing database connection
-conn = mysql.connector.connect(
-    host=config.DB_HOST, 
-    user=config.DB_USER, 
-    passwd=config.DB_PASS,
-    database=config.DB_NAME
-)
-conn.ping(reconnect=True, attempts=3)
-
-logger.info('Checking database connection... ')
-if conn.is_connected():
-    logger.info('Success!')
-else:
-    logger.error('Failed to connect to database!')
-    exit()
-
-# initializing tiendanube client
-tn = TiendaNube(app_id=config.TIENDANUBE_APP_ID,app_secret=config.TIENDANUBE_APP_SECRET,api_url=config.TIENDANUBE_API_URL,authorization_url=config.TIENDANUBE_AUTHORIZATION_URL)
+# app routes, registered in the apps built by create_app()
+routes = Blueprint('nuvemshop', __name__)
+
+"""
+Create the Flask app.
+
+Nothing is connected at creation: the services of the given Container (or of a new one) are built lazily, by each
+worker, on their first use. Importing and creating the app is then cheap, workers can be forked safely, and the routes
+that do not need the database keep working while it is unavailable.
+"""
+def create_app(container = None):
+    app = Flask(config.APP_NAME)
+    app.extensions['container'] = Container(config.CORREIOS_MAX_WORKERS) if container is None else container
+    app.register_blueprint(routes)
+    return app
+
+""" Get the services container of the current app """
+def get_container():
+    return current_app.extensions['container']
+
+# tagging every request, and its logs, with an id, and measuring it
+@routes.before_app_request
+def before_request():
+    g.request_id = request.headers.get('X-Request-Id') or uuid.uuid4().hex
+    set_request_id(g.request_id)
+
+    g.started_at = time.perf_counter()
+    REQUESTS_IN_FLIGHT.inc()
+
+    # profiling the request when asked to, and allowed by the settings
+    if config.PROFILING_ENABLED and request.headers.get('X-Profile'):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@routes.after_app_request
+def after_request(response):
+    response.headers['X-Request-Id'] = g.request_id
+
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    REQUEST_SECONDS.observe(time.perf_counter() - g.started_at, route=route, status=response.status_code)
+
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        stats = io.StringIO()
+        pstats.Stats(profiler, stream=stats).sort_stats('cumulative').print_stats(30)
+        logger.info('Profile of request to {}'.format(route), profile=stats.getvalue())
+
+    return response
+
+@routes.teardown_app_request
+def teardown_request(exception):
+    if 'started_at' in g:
+        REQUESTS_IN_FLIGHT.dec()
+
+# metrics route -> this route exposes the app metrics in the Prometheus text format
+@routes.route('/metrics')
+def metrics():
+    return Response(registry.render(), content_type=METRICS_CONTENT_TYPE)
 
 # default route
-@app.route('/')
+@routes.route('/')
 def hello():
     return 'Hello World!'
 
+# liveness route -> answers as long as the worker is able to handle requests
+@routes.route('/health/live')
+def health_live():
+    return Response(json_codec.dumps({'status': 'alive'}), mimetype='application/json')
+
+# readiness route -> warms up the worker services, and answers 503 until the quotes can be served. The database state is
+# reported but does not affect the readiness, since only the installation routes depend on it
+@routes.route('/health/ready')
+def health_ready():
+    ready, checks = get_container().check_readiness()
+    body = {'status': 'ready' if ready else 'unavailable', 'checks': checks}
+    return Response(json_codec.dumps(body), status=200 if ready else 503, mimetype='application/json')
+
 # installation route -> this route will be called during the authentication process (installation) of the app in a given store
-@app.route('/nuvemshop/install')
+@routes.route('/nuvemshop/install')
 def install():
     try:
-        # authenticating against tiendanube api
-        access_token, store_id = tn.authorize_with_code(request.args.get('code'))
-        logger.info('Successfully authenticated against Tiendanube API, the store ID is {} and the access token is {}'.format(store_id,access_token))
-
-        # saving store access token to database
-        st = StoreToken(store_id,access_token)
-        repo = StoreTokenRepository(conn)
-        repo.save_token(st)
-        logger.info('Successfully persisted store_id and access token to the database')
-
-        # setting up tn instance
-        tn.set_access_token(st.access_token)
-        tn.set_store_id(st.store)
-
-        # creating the shipping carrier
-        carrier = tn.create_shipping_carrier(name = config.CARRIER_NAME,callback_url = config.CARRIER_CALLBACK_URL,supports = config.CARRIER_SUPPORTS)
-
-        # creating shipping carrier options
-        pac_option = tn.create_shipping_carrier_option(carrier.get('id'), code=config.OPTION_PAC_CODE, name=config.OPTION_PAC_NAME)
-        sedex_option = tn.create_shipping_carrier_option(carrier.get('id'), code=config.OPTION_SEDEX_CODE, name=config.OPTION_SEDEX_NAME)
-
-        store = tn.get_store()
-        return redirect('https://' + store.get('original_domain') + '/admin/shipping')
+        return redirect(url_for('.install_status', store_id=get_container().installer.install(request.args.get('code'))))
     except StoreTokenException as e:
         logger.error('An error occurred at try to save store access token to the database. An exception with message "{}" was caught'.format(str(e)))
         return "Hello! An error occurred at try to authenticate you against Tienda Nube API. Please, contact the administrator."
     except TiendaNubeException as e:
-        logger.error('An error occurred at try to setup nuvemshop application for store {}. Exception with message "{}" was caught'.format(st.store,str(e)))
+        logger.error('An error occurred at try to setup nuvemshop application. Exception with message "{}" was caught'.format(str(e)))
         return "An error occurred at try to setup application in your store. Please, contact the administrator."
 
+# installation status route -> the merchant waits here until the store provisioning finishes, and is then redirected to
+# the store admin
+@routes.route('/nuvemshop/install/status')
+def install_status():
+    job = get_container().installer.get_status(request.args.get('store_id'))
+    if job is None:
+        return abort(404)
+    elif job.status == Job.DONE:
+        return redirect(job.result.get('admin_url'))
+    elif job.status == Job.FAILED:
+        return "An error occurred at try to setup application in your store. Please, contact the administrator."
+    return PROGRESS_PAGE
+
 # shipping options route -> this route will be called during a purchase process (product page, cart, checkout, etc...)
-@app.route('/nuvemshop/options', methods=["POST"])
+@routes.route('/nuvemshop/options', methods=["POST"])
 def options():
-    # getting current request body
-    logger.info("Options got requested with the following body")
-    logger.info(request.get_data(as_text=True))
-    req = request.get_json()
-
-    # initializing correios client
-    correios = Correios()
-    available_services = [config.OPTION_PAC_SERVICE, config.OPTION_SEDEX_SERVICE]
-
-    # getting cart specs for shipping costs calculation
-    origin = req.get('origin').get('postal_code')
-    destination = req.get('destination').get('postal_code')
-    items = req.get('items')
-
-    # getting base shipping costs
-    # creating a correios package
-    package = reduce(item_to_package_item,items,BoxPackage())
-    logger.info('CORREIOS PACKAGE')
-    logger.info(package.api_format())
-
-    # requesting rates from webservice
-    rates = correios.get_shipping_rates(origin=origin, destination=destination, package=package, services=available_services)
-
-    # checking for errors
-    if rates.has_errors():
-        # logging errors and returning result early
-        for service in rates.services:
-            code = service.code
-            error = service.error_code
-            message = service.error_message
-            logger.warn('The service {} returned the error {} with message: {}'.format(code,error,message))
+    # getting current request body, parsed and validated only once
+    body = request.get_data()
+    logger.payload('Options got requested with the following body', lambda: body.decode('utf-8'))
+
+    try:
+        with STEP_SECONDS.time(step='parse'):
+            origin, destination, items = validate_cart(json_codec.loads(body))
+    except (json_codec.DecodeError, CartSchemaException) as e:
+        logger.warn('Invalid options request. {}'.format(str(e)))
         return abort(400)
 
-    # checking for free shipping items in cart
-    free_shipping_items_qty = reduce(lambda c, i: c + 1 if i.get('free_shipping') else 0, items, 0)
-    free_shipping_cart = free_shipping_items_qty == len(items)
-
-    if free_shipping_items_qty > 0 and not free_shipping_cart:
-        # performing another shipping costs calculation in order to get the consumer prices
-        non_free_shipping_items = [item for item in items if item.get('free_shipping') is not True]
-        non_free_shipping_package = reduce(item_to_package_item,non_free_shipping_items,BoxPackage())
-
-        # requesting rates from webservice
-        non_free_shipping_rates = correios.get_shipping_rates(
-            origin=origin,
-            destination=destination,
-            package=non_free_shipping_package,
-            services=available_services
-        )
-
-        if non_free_shipping_rates.has_errors():
-            for service in non_free_shipping_rates.services:
-                code = service.code
-                error = service.error_code
-                message = service.error_message
-                logger.warn('The service {} returned the error {} with message: {}'.format(code,error,message))
-            non_free_shipping_rates = rates
-    else:
-        non_free_shipping_rates = rates
-
-    # parsing service rates to the shipping option format
-    options = list(map(lambda s: rate_to_shipping_option(s, free_shipping_cart), zip(rates.services,non_free_shipping_rates.services)))
-
-    return json.jsonify({'rates': options})
+    try:
+        options = get_container().shipping_options.quote(origin, destination, items)
+    except ShippingOptionsException as e:
+        logger.error(str(e))
+        return abort(400)
 
-if __name__ == '__main__':
-    app.run()
+    with STEP_SECONDS.time(step='serialize'):
+        return Response(json_codec.dumps({'rates': options}), mimetype='application/json')
 
+# batch shipping options route -> this route quotes many carts at once, reading one options body per line (NDJSON) and
+# streaming back one result per line, in the same order
+@routes.route('/nuvemshop/options/batch', methods=["POST"])
+def options_batch():
+    results = get_container().batch_quotes.quote(read_ndjson(request.stream))
+    return Response(stream_with_context(json_codec.dumps(result) + b'\n' for result in results), mimetype='application/x-ndjson')
+
+if __name__ == '__main__':
+    create_app().run()
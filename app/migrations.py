@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+from mysql.connector import Error
+
+from app.database import get_pool
+from app.services.logger import Logger
+
+MIGRATIONS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'resources', 'migrations')
+
+""" Database Migrations Runner """
+class Migrations(object):
+
+    _pool = None
+    _path = None
+    _logger = None
+
+    """
+    Migrations Constructor.
+
+    Migrations are the SQL files found in the given path, named as <version>_<description>.sql, and applied in version
+    order. Applied versions are recorded in the schema_migrations table, so each migration runs only once.
+    """
+    def __init__(self, pool, path = None):
+        self._logger = Logger(self.__class__.__name__)
+        self._pool = pool
+        self._path = MIGRATIONS_PATH if path is None else path
+
+    """ Get the available migrations as a sorted list of (version, filename) tuples """
+    def get_available(self):
+        migrations = []
+        for filename in os.listdir(self._path):
+            match = re.match(r'^(\d+)_.+\.sql$', filename)
+            if match:
+                migrations.append((match.group(1), filename))
+        return sorted(migrations)
+
+    """ Get the versions already applied to the database """
+    def get_applied(self):
+        with self._pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("CREATE TABLE IF NOT EXISTS `schema_migrations` (`version` varchar(32) NOT NULL, `applied_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY (`version`)) ENGINE=InnoDB DEFAULT CHARSET=utf8")
+            cursor.execute("SELECT `version` FROM `schema_migrations`")
+            applied = set(row[0] for row in cursor.fetchall())
+            cursor.close()
+        return applied
+
+    """ Apply every pending migration, returning the list of applied versions """
+    def run(self):
+        applied = self.get_applied()
+        versions = []
+
+        for version, filename in self.get_available():
+            if version in applied:
+                continue
+
+            self._logger.info('Applying migration {}'.format(filename))
+            with open(os.path.join(self._path, filename)) as f:
+                statements = split_statements(f.read())
+
+            try:
+                with self._pool.connection() as conn:
+                    cursor = conn.cursor()
+                    for statement in statements:
+                        cursor.execute(statement)
+                    cursor.execute("INSERT INTO `schema_migrations` (`version`) VALUES (%s)", (version,))
+                    conn.commit()
+                    cursor.close()
+            except Error as e:
+                raise MigrationException('An error occurred at try to apply migration {}. An exception with message "{}" was caught'.format(filename,e))
+
+            versions.append(version)
+
+        return versions
+
+""" Split a SQL script into its statements, ignoring comments """
+def split_statements(sql):
+    sql = re.sub(r'/\*.*?\*/', '', sql, flags=re.S)
+    sql = re.sub(r'^\s*--.*$', '', sql, flags=re.M)
+    return [statement.strip() for statement in sql.split(';') if statement.strip()]
+
+class MigrationException(Exception):
+    pass
+
+if __name__ == '__main__':
+    versions = Migrations(get_pool()).run()
+    Logger('Migrations').info('Applied {} migration(s): {}'.format(len(versions), ', '.join(versions) or 'none'))
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import re
+import struct
+from collections import namedtuple
+
+"""
+Compact quote models.
+
+These are immutable tuples without an instance dict, so they are cheap to build, take a fraction of the memory of
+regular objects, and are hashable: two equal carts, package shapes or quote keys can be used directly as dict keys.
+"""
+
+""" Cart Item, with its dimensions in cm and its weight in grams """
+class CartItem(namedtuple('CartItem', ['height', 'width', 'depth', 'grams', 'quantity', 'free_shipping'])):
+
+    __slots__ = ()
+
+    """ Build a cart item from an item of the options route body """
+    @classmethod
+    def from_dict(cls, item):
+        dimensions = item.get('dimensions')
+        return cls(
+            float(dimensions.get('height')),
+            float(dimensions.get('width')),
+            float(dimensions.get('depth')),
+            float(item.get('grams')),
+            int(item.get('quantity')),
+            item.get('free_shipping') is True
+        )
+
+""" Cart, with origin and destination postal codes and a tuple of CartItem """
+class Cart(namedtuple('Cart', ['origin', 'destination', 'items'])):
+
+    __slots__ = ()
+
+""" Package Shape, the normalized package sent to the Correios webservice (dimensions in cm and weight in kg) """
+class PackageShape(namedtuple('PackageShape', ['format', 'height', 'width', 'depth', 'weight'])):
+
+    __slots__ = ()
+
+    """ Build the shape of a package from its Correios API format """
+    @classmethod
+    def from_package(cls, package):
+        shape = package.api_format()
+        return cls(shape['nCdFormato'], round(shape['nVlAltura'], 3), round(shape['nVlLargura'], 3), round(shape['nVlComprimento'], 3), round(shape['nVlPeso'], 3))
+
+    """ Get the shape in the Correios API format, so it can be quoted in place of the package it was built from """
+    def api_format(self):
+        return {'nCdFormato': self.format, 'nVlAltura': self.height, 'nVlLargura': self.width, 'nVlComprimento': self.depth, 'nVlPeso': self.weight}
+
+"""
+Quote Key, identifying the quotes of a package shape between two postal codes for a set of services.
+
+Carts with the same route and the same package shape share the same key. It is hashable, to be used as the key of
+in-process caches, and str() gives its string form, used by the shared caches.
+"""
+class QuoteKey(namedtuple('QuoteKey', ['origin', 'destination', 'shape', 'services'])):
+
+    __slots__ = ()
+
+    @classmethod
+    def build(cls, origin, destination, package, services):
+        shape = package if isinstance(package, PackageShape) else PackageShape.from_package(package)
+        return cls(re.sub(r'\D', '', origin), re.sub(r'\D', '', destination), shape, tuple(sorted(services)))
+
+    def __str__(self):
+        return 'rate:{}:{}:{}:{}'.format(self.origin, self.destination, ','.join(str(v) for v in self.shape), ','.join(self.services))
+
+"""
+Rate Quote, the quote of a single service.
+
+It has the same code, days, price, error_code and error_message attributes and is_success() method of the Correios
+ShippingRateResultService, so it can be used in its place, and it is packed to a few bytes by pack_quotes().
+"""
+class RateQuote(namedtuple('RateQuote', ['code', 'price', 'days', 'error_code', 'error_message'])):
+
+    __slots__ = ()
+
+    def __new__(cls, code, price, days, error_code = 0, error_message = ''):
+        return super(RateQuote, cls).__new__(cls, code, float(price), int(days), int(error_code), error_message or '')
+
+    """ Build a rate quote from a Correios ShippingRateResultService """
+    @classmethod
+    def from_service(cls, service):
+        return service if isinstance(service, cls) else cls(service.code, service.price, service.days, service.error_code, service.error_message)
+
+    def is_success(self):
+        return self.error_code == 0
+
+# price, days, error code, code length and error message length of a packed quote
+_QUOTE_HEADER = struct.Struct('<dhiBH')
+
+""" Pack a sequence of RateQuote into bytes """
+def pack_quotes(quotes):
+    chunks = [struct.pack('<B', len(quotes))]
+    for quote in quotes:
+        code = quote.code.encode('utf-8')
+        message = quote.error_message.encode('utf-8')
+        chunks.append(_QUOTE_HEADER.pack(quote.price, quote.days, quote.error_code, len(code), len(message)))
+        chunks.append(code)
+        chunks.append(message)
+    return b''.join(chunks)
+
+""" Unpack the bytes built by pack_quotes() into a tuple of RateQuote """
+def unpack_quotes(data, offset = 0):
+    (count,) = struct.unpack_from('<B', data, offset)
+    offset += 1
+    quotes = []
+    for n in range(count):
+        price, days, error_code, code_size, message_size = _QUOTE_HEADER.unpack_from(data, offset)
+        offset += _QUOTE_HEADER.size
+        code = data[offset:offset + code_size].decode('utf-8')
+        offset += code_size
+        message = data[offset:offset + message_size].decode('utf-8')
+        offset += message_size
+        quotes.append(RateQuote(code, price, days, error_code, message))
+    return tuple(quotes)
@@ -1,12 +1,24 @@
 # -*- coding: utf-8 -*-
-from mysql.connector.connection import MySQLConnection
+import threading
+import time
+from collections import OrderedDict
 from mysql.connector import Error
 
-""" StoreToken Aggregate """
+from app.database import ConnectionPool
+from app.services.metrics import registry
+
+QUERY_SECONDS = registry.histogram('store_token_query_seconds', 'Time spent in store token database queries', ['query'])
+CACHE_REQUESTS = registry.counter('store_token_cache_requests_total', 'Store token cache lookups by result (hit or miss)', ['result'])
+
+"""
+StoreToken Aggregate.
+
+Slotted, so the tokens of tens of thousands of stores held by the StoreTokenCache take a fraction of the memory of
+regular objects, and hashable by value.
+"""
 class StoreToken(object):
 
-    store = None
-    access_token = None
+    __slots__ = ('store', 'access_token')
 
     def __init__(self, store, access_token):
         self.store = store
@@ -15,52 +27,163 @@ class StoreToken(object):
     def is_valid(self):
         return True if self.store is not None and self.access_token is not None else False
 
+    def __eq__(self, other):
+        return isinstance(other, StoreToken) and (self.store, self.access_token) == (other.store, other.access_token)
+
+    def __hash__(self):
+        return hash((self.store, self.access_token))
+
+    def __repr__(self):
+        return 'StoreToken(store={!r})'.format(self.store)
+
+"""
+StoreTokenCache
+
+In-memory cache of store tokens, keyed by store ID. Entries expire after ttl seconds and the least recently used ones
+are evicted when max_entries is reached.
+"""
+class StoreTokenCache(object):
+
+    _entries = None
+    _ttl = None
+    _max_entries = None
+    _lock = None
+
+    def __init__(self, ttl, max_entries):
+        self._entries = OrderedDict()
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+
+    """ Get the cached StoreToken of a given store, returns None on misses or expired entries """
+    def get(self, store_id):
+        key = str(store_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, store_token = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return store_token
+
+    """ Store a StoreToken in the cache """
+    def set(self, store_token):
+        key = str(store_token.store)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self._ttl, store_token)
+
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    """ Remove the cached StoreToken of a given store """
+    def invalidate(self, store_id):
+        with self._lock:
+            self._entries.pop(str(store_id), None)
+
+    """ Remove every StoreToken from the cache """
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
 """ StoreTokenRepository """
 class StoreTokenRepository(object):
 
-    __conn = None
+    __pool = None
+    __cache = None
+
+    """
+    StoreTokenRepository Constructor.
 
-    def __init__(self, connection):
-        if isinstance(connection, MySQLConnection):
-            self.__conn = connection
-            self.__conn.ping(reconnect=True, attempts=3)
+    Queries run on connections checked out from the given connection pool. When a StoreTokenCache is supplied, tokens
+    are read through it and replaced by the new token every time a token is saved.
+    """
+    def __init__(self, pool, cache = None):
+        if isinstance(pool, ConnectionPool):
+            self.__pool = pool
+            self.__cache = cache
         else:
-            raise StoreTokenException('Attempting to create store token instance without a database cursor')
+            raise StoreTokenException('Attempting to create store token instance without a database connection pool')
 
-    """ Save a given StoreToken object into the database """
+    """ Save a given StoreToken object into the database, replacing the current token of its store """
     def save_token(self, store_token):
         if not isinstance(store_token, StoreToken) or not store_token.is_valid():
             raise StoreTokenException('An error occurred at trying to save store token, storeToken parameter is not a valid instance of storeToken')
 
         try:
-            cursor = self.__conn.cursor()
-            cursor.execute("INSERT INTO `stores` (`store_id`,`access_token`) VALUES (%s, %s)", (str(store_token.store), store_token.access_token))
-            self.__conn.commit()
-
-            if cursor.rowcount > 0:
-                return True
-            else:
-                raise StoreTokenException('An error occurred at try to save access token for store {} in database. No exception was raised by mysql library'.format(store_token.store))
+            with QUERY_SECONDS.time(query='save_token'), self.__pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("INSERT INTO `stores` (`store_id`,`access_token`) VALUES (%s, %s) ON DUPLICATE KEY UPDATE `access_token`=VALUES(`access_token`)", (str(store_token.store), store_token.access_token))
+                conn.commit()
+                cursor.close()
         except Error as e:
+            if self.__cache is not None:
+                self.__cache.invalidate(store_token.store)
             raise StoreTokenException('An error occurred at try to save access token for store {} in database. An exception with message "{}" was caught'.format(store_token.store,e))
 
-    """ Get the StoreToken of a given store from the database """
+        # caching the new token once committed, replacing any old token cached by a concurrent read while the upsert ran
+        if self.__cache is not None:
+            self.__cache.set(store_token)
+        return True
+
+    """ Get the StoreToken of a given store from the cache, or from the database on cache misses """
     def get_token(self, store_id):
         if store_id is None:
             raise StoreTokenException('An error occurred at try to get access token for store, store parameter is None')
-        
+
+        if self.__cache is not None:
+            store_token = self.__cache.get(store_id)
+            CACHE_REQUESTS.inc(result='miss' if store_token is None else 'hit')
+            if store_token is not None:
+                return store_token
+
         try:
-            cursor = self.__conn.cursor()
-            cursor.execute("SELECT `store_id`, `access_token` FROM `stores` WHERE `store_id`=%s ORDER BY `id` DESC", (str(store_id)))
+            with QUERY_SECONDS.time(query='get_token'), self.__pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT `store_id`, `access_token` FROM `stores` WHERE `store_id`=%s", (str(store_id),))
+                row = cursor.fetchone()
+                cursor.close()
 
-            if cursor.rowcount > 0:
-                (store, access_token) = cursor.fetchone()
-                return StoreToken(store,access_token)
+            if row is not None:
+                (store, access_token) = row
+                store_token = StoreToken(store,access_token)
+                if self.__cache is not None:
+                    self.__cache.set(store_token)
+                return store_token
             else:
                 return False
         except Error as e:
             raise StoreTokenException('An error occurred at try to get access token for store {} from database. An exception with message "{}" was caught'.format(store_id,e))
 
+    """
+    Iterate over the StoreToken of every store, in store ID order, starting after a given store ID.
+
+    Tokens are read in pages of page_size rows with keyset pagination, so only a page is held in memory at any time and
+    each page is a single indexed range query, whatever the number of stores. Tokens read here are not cached.
+    """
+    def iter_tokens(self, page_size = 500, after = None):
+        after = -1 if after is None else int(after)
+        while True:
+            try:
+                with QUERY_SECONDS.time(query='iter_tokens'), self.__pool.connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute("SELECT `store_id`, `access_token` FROM `stores` WHERE `store_id`>%s ORDER BY `store_id` LIMIT %s", (after, page_size))
+                    rows = cursor.fetchall()
+                    cursor.close()
+            except Error as e:
+                raise StoreTokenException('An error occurred at try to read store access tokens after store {} from database. An exception with message "{}" was caught'.format(after,e))
+
+            for store, access_token in rows:
+                yield StoreToken(store, access_token)
+
+            if len(rows) < page_size:
+                return
+            after = int(rows[-1][0])
+
 class StoreTokenException(Exception):
     pass
-
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import contextvars
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from app.services.logger import Logger
+from app.services.shipping_options import ShippingOptionsException
+from app.util import json_codec
+from app.util.cart_schema import validate_cart, CartSchemaException
+
+""" Batch Quotes Service """
+class BatchQuotes(object):
+
+    # identical carts are quoted once among the last MAX_REMEMBERED_CARTS distinct carts of a batch
+    MAX_REMEMBERED_CARTS = 1000
+
+    _shipping_options = None
+    _concurrency = None
+    _slots = None
+    _logger = None
+
+    """
+    BatchQuotes Constructor.
+
+    Quotes many carts at once with a ShippingOptions instance, keeping at most concurrency quotes in flight across
+    every batch being quoted, so batches never take more of the ShippingOptions threads than that.
+    """
+    def __init__(self, shipping_options, concurrency = 8):
+        self._logger = Logger(self.__class__.__name__)
+        self._shipping_options = shipping_options
+        self._concurrency = concurrency
+        self._slots = threading.BoundedSemaphore(concurrency)
+
+    """
+    Quote an iterable of payloads, in the same format of the options route body, yielding one result per payload in
+    the same order. Each result has the payload id (or its position when the payload has none) and either its rates or
+    an error message.
+
+    Payloads are consumed lazily, so only a window of concurrency payloads is held in memory at any time, and identical
+    carts (same origin, destination and items) among the last MAX_REMEMBERED_CARTS ones share a single quote. Different
+    carts with the same route and package shape share their webservice calls in ShippingRates. Invalid payloads are
+    answered with their validation error, without being quoted.
+    """
+    def quote(self, payloads):
+        pending = deque()
+        quoted = OrderedDict()
+
+        with ThreadPoolExecutor(max_workers=self._concurrency) as executor:
+            for position, payload in enumerate(payloads):
+                try:
+                    cart = validate_cart(payload)
+                except CartSchemaException as e:
+                    cart = None
+                    future = Future()
+                    future.set_result({'error': str(e)})
+                else:
+                    # carts are hashable, so identical ones are deduplicated by the cart itself
+                    future = quoted.get(cart)
+                    if future is None:
+                        future = executor.submit(contextvars.copy_context().run, self.__quote, cart)
+                        quoted[cart] = future
+                        if len(quoted) > self.MAX_REMEMBERED_CARTS:
+                            quoted.popitem(last=False)
+                    else:
+                        quoted.move_to_end(cart)
+
+                pending.append((self.__get_id(payload, position), future))
+
+                if len(pending) >= self._concurrency:
+                    yield self.__pop(pending)
+
+            while pending:
+                yield self.__pop(pending)
+
+    """ Quote a single cart, returning its rates or its error message """
+    def __quote(self, cart):
+        try:
+            with self._slots:
+                return {'rates': self._shipping_options.quote(cart.origin, cart.destination, cart.items)}
+        except ShippingOptionsException as e:
+            return {'error': str(e)}
+        except Exception as e:
+            return {'error': 'Invalid payload. An exception with message "{}" was caught'.format(str(e))}
+
+    """ Wait for the oldest pending quote and build its result """
+    def __pop(self, pending):
+        id, future = pending.popleft()
+        result = {'id': id}
+        result.update(future.result())
+        return result
+
+    """ Get the id of a payload, defaulting to its position in the batch """
+    def __get_id(self, payload, position):
+        id = payload.get('id') if isinstance(payload, dict) else None
+        return position if id is None else id
+
+""" Parse the lines of a NDJSON stream lazily, yielding None for lines that are not valid JSON """
+def read_ndjson(lines):
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            yield json_codec.loads(line)
+        except json_codec.DecodeError:
+            yield None
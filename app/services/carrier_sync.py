@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from app import config
+from app.services.logger import Logger
+from app.services.rate_limiter import TokenBucket
+
+""" A change needed to bring a store in line with the configured carrier: an action, its target and its fields """
+CarrierChange = namedtuple('CarrierChange', ['action', 'target', 'fields'])
+
+""" Carrier Sync Service """
+class CarrierSync(object):
+
+    CREATE_CARRIER = 'create_carrier'
+    UPDATE_CARRIER = 'update_carrier'
+    CREATE_OPTION = 'create_option'
+    DELETE_OPTION = 'delete_option'
+
+    _prune = None
+    _executor = None
+    _logger = None
+
+    """
+    CarrierSync Constructor.
+
+    Reconciles the shipping carrier of a store, and its options, with the app config: the carrier is created if missing
+    and its name, callback URL and types are updated when they changed, and the missing options are created by up to
+    max_workers threads at the same time. Options with unknown codes are only deleted when prune is set.
+
+    The app carrier is the one with the configured callback URL or, when the callback URL changed, the configured name.
+    """
+    def __init__(self, prune = False, max_workers = 4):
+        self._logger = Logger(self.__class__.__name__)
+        self._prune = prune
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    """ Get the changes needed in the store of a given client, as a (carrier, changes) tuple """
+    def diff(self, tn):
+        carriers = tn.get_shipping_carriers()
+        carrier = next((c for c in carriers if c.get('callback_url') == config.CARRIER_CALLBACK_URL), None) \
+            or next((c for c in carriers if c.get('name') == config.CARRIER_NAME), None)
+
+        desired = {'name': config.CARRIER_NAME, 'callback_url': config.CARRIER_CALLBACK_URL, 'types': ','.join(config.CARRIER_SUPPORTS)}
+        options = self.__get_desired_options()
+
+        if carrier is None:
+            changes = [CarrierChange(self.CREATE_CARRIER, None, desired)]
+            changes.extend(CarrierChange(self.CREATE_OPTION, code, {'name': name}) for code, name in options)
+            return None, changes
+
+        changes = []
+        fields = dict((k, v) for k, v in desired.items() if not self.__same(k, carrier.get(k), v))
+        if fields:
+            changes.append(CarrierChange(self.UPDATE_CARRIER, carrier.get('id'), fields))
+
+        existing = tn.get_shipping_carrier_options(carrier.get('id'))
+        codes = set(option.get('code') for option in existing)
+        changes.extend(CarrierChange(self.CREATE_OPTION, code, {'name': name}) for code, name in options if code not in codes)
+        if self._prune:
+            desired_codes = set(code for code, name in options)
+            changes.extend(CarrierChange(self.DELETE_OPTION, option.get('id'), {'code': option.get('code')}) for option in existing if option.get('code') not in desired_codes)
+
+        return carrier, changes
+
+    """
+    Sync the store of a given client, returning the applied changes (or the changes that would be applied, on dry runs).
+
+    Syncing is idempotent, running it again after a failure only applies the changes that are still missing.
+    """
+    def sync(self, tn, dry_run = False):
+        carrier, changes = self.diff(tn)
+        if dry_run or not changes:
+            return changes
+
+        carrier_id = carrier.get('id') if carrier is not None else None
+        for change in changes:
+            if change.action == self.CREATE_CARRIER:
+                carrier_id = tn.create_shipping_carrier(name=change.fields['name'], callback_url=change.fields['callback_url'], supports=config.CARRIER_SUPPORTS).get('id')
+            elif change.action == self.UPDATE_CARRIER:
+                tn.update_shipping_carrier(change.target, **change.fields)
+
+        # creating and deleting the options at the same time
+        futures = []
+        for change in changes:
+            if change.action == self.CREATE_OPTION:
+                futures.append(self._executor.submit(tn.create_shipping_carrier_option, carrier_id, code=change.target, name=change.fields['name']))
+            elif change.action == self.DELETE_OPTION:
+                futures.append(self._executor.submit(tn.delete_shipping_carrier_option, carrier_id, change.target))
+        for future in futures:
+            future.result()
+
+        return changes
+
+    def __get_desired_options(self):
+        return ((config.OPTION_PAC_CODE, config.OPTION_PAC_NAME), (config.OPTION_SEDEX_CODE, config.OPTION_SEDEX_NAME))
+
+    def __same(self, field, current, desired):
+        if field == 'types':
+            return set((current or '').split(',')) == set(desired.split(','))
+        return current == desired
+
+"""
+Bulk Carrier Sync.
+
+Syncs the carrier of every installed store, streaming the store tokens from a StoreTokenRepository in pages. At most
+concurrency stores are synced at the same time, and the API calls to each store are limited to rate calls per second,
+with bursts of up to burst calls.
+
+Progress is saved to a checkpoint file, if any, as the highest store ID up to which every store was processed and the
+IDs of the failed stores, so an interrupted run resumes where it stopped.
+"""
+class BulkCarrierSync(object):
+
+    _tn = None
+    _repository = None
+    _sync = None
+    _concurrency = None
+    _rate = None
+    _burst = None
+    _page_size = None
+    _checkpoint = None
+    _logger = None
+
+    def __init__(self, tn, repository, sync, concurrency = 8, rate = 2.0, burst = 10, page_size = 500, checkpoint = None):
+        self._logger = Logger(self.__class__.__name__)
+        self._tn = tn
+        self._repository = repository
+        self._sync = sync
+        self._concurrency = concurrency
+        self._rate = rate
+        self._burst = burst
+        self._page_size = page_size
+        self._checkpoint = checkpoint
+
+    """
+    Sync every store, or only the given store IDs, yielding a (store_id, changes, error) tuple per store in order, where
+    error is None for the stores synced successfully.
+
+    Dry runs only compute the changes, and neither read nor write the checkpoint. Syncing the given store IDs, like the
+    failed ones of a previous run, does not move the checkpoint.
+    """
+    def run(self, dry_run = False, stores = None):
+        state = self.load_checkpoint() if not dry_run else {'after': None, 'failed': []}
+        tokens = self._repository.iter_tokens(self._page_size, after=state.get('after')) if stores is None else self.__get_tokens(stores)
+        pending = deque()
+        processed = 0
+
+        with ThreadPoolExecutor(max_workers=self._concurrency) as executor:
+            for st in tokens:
+                pending.append((st.store, executor.submit(self.__sync_store, st, dry_run)))
+
+                if len(pending) >= self._concurrency:
+                    yield self.__pop(pending, state, stores is None)
+                    processed += 1
+                    if not dry_run and processed % self._page_size == 0:
+                        self.save_checkpoint(state)
+
+            while pending:
+                yield self.__pop(pending, state, stores is None)
+
+        if not dry_run:
+            self.save_checkpoint(state)
+
+    """ Load the checkpoint, or an empty one if there is no checkpoint file """
+    def load_checkpoint(self):
+        if self._checkpoint is None or not os.path.exists(self._checkpoint):
+            return {'after': None, 'failed': []}
+        with open(self._checkpoint) as f:
+            return json.load(f)
+
+    """ Save the checkpoint, replacing the checkpoint file atomically """
+    def save_checkpoint(self, state):
+        if self._checkpoint is None:
+            return
+        tmp = self._checkpoint + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, self._checkpoint)
+
+    def __sync_store(self, st, dry_run):
+        tn = self._tn.for_store(st.store, st.access_token, TokenBucket(self._rate, self._burst))
+        return self._sync.sync(tn, dry_run)
+
+    """ Get the tokens of the given store IDs, skipping the stores without a token """
+    def __get_tokens(self, stores):
+        for store_id in stores:
+            st = self._repository.get_token(store_id)
+            if st:
+                yield st
+            else:
+                self._logger.warn('There is no access token for store {}'.format(store_id), store_id=store_id)
+
+    """ Wait for the oldest pending store, recording its outcome in the checkpoint state """
+    def __pop(self, pending, state, advance):
+        store_id, future = pending.popleft()
+        try:
+            changes, error = future.result(), None
+        except Exception as e:
+            changes, error = [], str(e)
+            self._logger.error('Failed to sync the carrier of store {}. An exception with message "{}" was caught'.format(store_id, error), store_id=store_id)
+
+        failed = set(state['failed'])
+        if error is None:
+            failed.discard(store_id)
+        else:
+            failed.add(store_id)
+        state['failed'] = sorted(failed)
+
+        if advance:
+            state['after'] = store_id
+        return store_id, changes, error
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+""" Circuit Breaker """
+class CircuitBreaker(object):
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    _failure_threshold = None
+    _recovery_timeout = None
+    _state = None
+    _failures = 0
+    _opened_at = None
+    _probing = False
+    _lock = None
+
+    """
+    CircuitBreaker Constructor.
+
+    The circuit opens after failure_threshold consecutive failures, making calls fail fast. After recovery_timeout
+    seconds it becomes half open, letting a single probe call through: the circuit closes again if the probe succeeds,
+    and opens for another recovery_timeout seconds if it fails.
+    """
+    def __init__(self, failure_threshold = 5, recovery_timeout = 30):
+        self._failure_threshold = failure_threshold
+        self._recovery_timeout = recovery_timeout
+        self._state = self.CLOSED
+        self._lock = threading.Lock()
+
+    """ Get the current state of the circuit """
+    def get_state(self):
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self._recovery_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    """ Check if a call is allowed, claiming the probe call when the circuit is half open """
+    def allow(self):
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self._recovery_timeout:
+                    return False
+                self._state = self.HALF_OPEN
+                self._probing = False
+
+            if self._probing:
+                return False
+
+            self._probing = True
+            return True
+
+    """ Record a successful call, closing the circuit """
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    """ Record a failed call, opening the circuit when the threshold is reached or the probe call failed """
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self._failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+from app.models.store_token import StoreToken, StoreTokenException
+from app.services.carrier_sync import CarrierSync
+from app.services.logger import Logger
+
+# page shown while the store provisioning is running, reloaded until it finishes
+PROGRESS_PAGE = '<html><head><meta http-equiv="refresh" content="2"></head><body>Setting up the application in your store, please wait...</body></html>'
+
+""" App Installer Service """
+class Installer(object):
+
+    PROVISION_JOB = 'provision_store'
+
+    _tn = None
+    _repository = None
+    _queue = None
+    _sync = None
+    _logger = None
+
+    """
+    Installer Constructor.
+
+    Runs the installation of the app in a store, using a TiendaNube client and the StoreTokenRepository where the store
+    access tokens are persisted. This is the framework independent implementation of the
+    install route, used by both the sync (Flask) and async (ASGI) apps.
+
+    The store provisioning (shipping carrier and options) runs in background, as a job of the given JobQueue, and is
+    done by a CarrierSync, or a default one if none is supplied.
+    """
+    def __init__(self, tn, repository, queue, sync = None):
+        self._logger = Logger(self.__class__.__name__)
+        self._tn = tn
+        self._repository = repository
+        self._queue = queue
+        self._sync = CarrierSync() if sync is None else sync
+        self._queue.register(self.PROVISION_JOB, self.provision)
+
+    """
+    Install the app in the store that supplied a given authorization code, returning the store ID.
+
+    Only the authorization code exchange and the access token persistence are done here, the store provisioning is
+    enqueued and its progress can be followed with get_status(). Raises a StoreTokenException or a TiendaNubeException
+    if the authorization fails.
+    """
+    def install(self, code):
+        # authenticating against tiendanube api
+        access_token, store_id = self._tn.authorize_with_code(code)
+        self._logger.info('Successfully authenticated against Tiendanube API, the store ID is {}'.format(store_id), store_id=store_id)
+
+        # saving store access token to database
+        st = StoreToken(store_id,access_token)
+        self._repository.save_token(st)
+        self._logger.info('Successfully persisted store_id and access token to the database', store_id=store_id)
+
+        # provisioning the store in background, the access token is read from the database by the job
+        self._queue.enqueue(self.PROVISION_JOB, self.__get_job_key(store_id), {'store_id': store_id})
+        return store_id
+
+    """
+    Provision a store, creating the app shipping carrier and its options, and returning the store admin shipping URL.
+
+    This is the handler of the provisioning jobs, and it is idempotent: the carrier and the options that already exist
+    in the store are reused (see CarrierSync), so a retried job never creates them twice.
+    """
+    def provision(self, payload):
+        store_id = payload.get('store_id')
+        st = self._repository.get_token(store_id)
+        if not st:
+            raise StoreTokenException('There is no access token for store {}'.format(store_id))
+
+        # every job uses its own client, so concurrent provisionings never share credentials
+        tn = self._tn.for_store(st.store, st.access_token)
+
+        # creating the shipping carrier and its options, unless they already exist
+        self._sync.sync(tn)
+
+        store = tn.get_store()
+        self._logger.info('Successfully provisioned the shipping carrier and options', store_id=store_id)
+        return {'admin_url': 'https://' + store.get('original_domain') + '/admin/shipping'}
+
+    """ Get the provisioning Job of a store, or None if the store was not installed by this app """
+    def get_status(self, store_id):
+        return self._queue.get(self.__get_job_key(store_id))
+
+    def __get_job_key(self, store_id):
+        return '{}:{}'.format(self.PROVISION_JOB, store_id)
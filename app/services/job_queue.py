@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+import heapq
+import json
+import random
+import sqlite3
+import threading
+import time
+
+from app import config
+from app.services.logger import Logger
+from app.services.metrics import registry
+
+JOBS = registry.counter('jobs_total', 'Jobs run by kind and outcome (done, retry or failed)', ['kind', 'outcome'])
+
+""" Background Job """
+class Job(object):
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, key, kind, payload, status = PENDING, attempts = 0, run_at = 0.0, result = None, error = None):
+        self.key = key
+        self.kind = kind
+        self.payload = payload
+        self.status = status
+        self.attempts = attempts
+        self.run_at = run_at
+        self.result = result
+        self.error = error
+
+"""
+Job Queue Interface.
+
+Runs registered handlers in background worker threads. Jobs are identified by a key, so enqueuing a job that is already
+pending or running is a no-op, and enqueuing a finished one runs it again: handlers must be idempotent. Failed jobs are
+retried up to max_attempts times, waiting an exponential backoff with jitter (capped to max_backoff seconds) between
+attempts, and running jobs whose worker died are retried after lease_timeout seconds, each of these counting as a failed
+attempt too.
+"""
+class JobQueue(object):
+
+    _handlers = None
+    _max_attempts = None
+    _backoff_factor = None
+    _max_backoff = None
+    _lease_timeout = None
+    _poll_interval = None
+    _workers = None
+    _stopping = None
+    _logger = None
+
+    def __init__(self, max_attempts = 5, backoff_factor = 2.0, max_backoff = 300, lease_timeout = 300, poll_interval = 1.0):
+        self._logger = Logger(self.__class__.__name__)
+        self._handlers = {}
+        self._max_attempts = max_attempts
+        self._backoff_factor = backoff_factor
+        self._max_backoff = max_backoff
+        self._lease_timeout = lease_timeout
+        self._poll_interval = poll_interval
+        self._workers = []
+        self._stopping = threading.Event()
+
+    """ Register the handler of a kind of job, called with the job payload and returning the job result """
+    def register(self, kind, handler):
+        self._handlers[kind] = handler
+
+    """ Enqueue a job, returning False if a job with the same key is already pending or running """
+    def enqueue(self, kind, key, payload):
+        raise NotImplementedError
+
+    """ Get a job by its key, or None if there is no such job """
+    def get(self, key):
+        raise NotImplementedError
+
+    """ Start a given number of worker threads """
+    def start(self, workers = 1):
+        self._stopping.clear()
+        for n in range(workers):
+            worker = threading.Thread(target=self.__work, name='{}-{}'.format(self.__class__.__name__, n), daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    """ Stop the worker threads, waiting for the running jobs to finish """
+    def stop(self):
+        self._stopping.set()
+        self._wake()
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+    """ Run the next due job, if any, returning whether a job was run """
+    def run_once(self):
+        job = self._claim(time.time(), self._lease_timeout)
+        if job is None:
+            return False
+
+        # the lease of a reclaimed job counted as an attempt, so jobs crashing their workers are not retried forever
+        if job.attempts >= self._max_attempts:
+            JOBS.inc(kind=job.kind, outcome='failed')
+            self._logger.error('Job {} failed after {} attempts. Its worker did not finish it within {} seconds'.format(job.key, job.attempts, self._lease_timeout), job=job.key)
+            self._finish(job.key, Job.FAILED, job.attempts, time.time(), None, 'The job was not finished within {} seconds'.format(self._lease_timeout))
+            return True
+
+        handler = self._handlers.get(job.kind)
+        try:
+            if handler is None:
+                raise JobQueueException('There is no handler registered for jobs of kind "{}"'.format(job.kind))
+            result = handler(job.payload)
+        except Exception as e:
+            attempts = job.attempts + 1
+            if attempts >= self._max_attempts:
+                JOBS.inc(kind=job.kind, outcome='failed')
+                self._logger.error('Job {} failed after {} attempts. An exception with message "{}" was caught'.format(job.key, attempts, str(e)), job=job.key)
+                self._finish(job.key, Job.FAILED, attempts, time.time(), None, str(e))
+            else:
+                delay = random.uniform(0, min(self._backoff_factor * (2 ** attempts), self._max_backoff))
+                JOBS.inc(kind=job.kind, outcome='retry')
+                self._logger.warn('Job {} failed, retrying in {:.2f} seconds ({}/{}). An exception with message "{}" was caught'.format(job.key, delay, attempts, self._max_attempts, str(e)), job=job.key)
+                self._finish(job.key, Job.PENDING, attempts, time.time() + delay, None, str(e))
+            return True
+
+        JOBS.inc(kind=job.kind, outcome='done')
+        self._finish(job.key, Job.DONE, job.attempts + 1, time.time(), result, None)
+        return True
+
+    """
+    Claim the next due job, marking it as running until the lease timeout, or return None if there is none. Claiming a
+    running job whose lease expired counts its last attempt.
+    """
+    def _claim(self, now, lease_timeout):
+        raise NotImplementedError
+
+    """ Store the outcome of a job attempt """
+    def _finish(self, key, status, attempts, run_at, result, error):
+        raise NotImplementedError
+
+    """ Wait for new jobs, for at most a given number of seconds """
+    def _wait(self, timeout):
+        self._stopping.wait(timeout)
+
+    """ Wake up the workers waiting for new jobs """
+    def _wake(self):
+        pass
+
+    def __work(self):
+        while not self._stopping.is_set():
+            try:
+                if not self.run_once():
+                    self._wait(self._poll_interval)
+            except Exception as e:
+                self._logger.error('Job worker failed. An exception with message "{}" was caught'.format(str(e)))
+                self._stopping.wait(self._poll_interval)
+
+"""
+In-process Job Queue.
+
+Jobs are kept in memory, so they are lost on restarts and are only visible to the process that enqueued them. Suitable
+for a single process deployment, or for development.
+"""
+class MemoryJobQueue(JobQueue):
+
+    _jobs = None
+    _due = None
+    _condition = None
+
+    def __init__(self, **kwargs):
+        JobQueue.__init__(self, **kwargs)
+        self._jobs = {}
+        self._due = []
+        self._condition = threading.Condition()
+
+    def enqueue(self, kind, key, payload):
+        with self._condition:
+            job = self._jobs.get(key)
+            if job is not None and job.status in (Job.PENDING, Job.RUNNING):
+                return False
+
+            self._jobs[key] = Job(key, kind, payload)
+            heapq.heappush(self._due, (0.0, key))
+            self._condition.notify()
+            return True
+
+    def get(self, key):
+        with self._condition:
+            return self._jobs.get(key)
+
+    def _claim(self, now, lease_timeout):
+        with self._condition:
+            while self._due and self._due[0][0] <= now:
+                run_at, key = heapq.heappop(self._due)
+                job = self._jobs.get(key)
+                # skipping stale heap entries of jobs that were re-enqueued or already finished
+                if job is None or job.status not in (Job.PENDING, Job.RUNNING) or job.run_at != run_at:
+                    continue
+
+                if job.status == Job.RUNNING:
+                    job.attempts += 1
+                job.status = Job.RUNNING
+                job.run_at = now + lease_timeout
+                heapq.heappush(self._due, (job.run_at, key))
+                return job
+        return None
+
+    def _finish(self, key, status, attempts, run_at, result, error):
+        with self._condition:
+            job = self._jobs[key]
+            job.status, job.attempts, job.run_at, job.result, job.error = status, attempts, run_at, result, error
+            if status == Job.PENDING:
+                heapq.heappush(self._due, (run_at, key))
+                self._condition.notify()
+
+    def _wait(self, timeout):
+        with self._condition:
+            if self._due:
+                timeout = max(min(timeout, self._due[0][0] - time.time()), 0)
+            self._condition.wait(timeout)
+
+    def _wake(self):
+        with self._condition:
+            self._condition.notify_all()
+
+"""
+SQLite Job Queue.
+
+Jobs are persisted in a local database file, so they survive restarts and are shared by every worker process running in
+the same host. Jobs are claimed inside an immediate transaction, so each one is run by a single worker at a time.
+Payloads and results must be JSON serializable.
+"""
+class SQLiteJobQueue(JobQueue):
+
+    _path = None
+    _local = None
+    _wakeup = None
+
+    def __init__(self, path, **kwargs):
+        JobQueue.__init__(self, **kwargs)
+        self._path = path
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+
+        conn = self.__get_connection()
+        conn.execute('CREATE TABLE IF NOT EXISTS `jobs` (`key` TEXT PRIMARY KEY, `kind` TEXT NOT NULL, `payload` TEXT NOT NULL, `status` TEXT NOT NULL, `attempts` INTEGER NOT NULL, `run_at` REAL NOT NULL, `result` TEXT, `error` TEXT)')
+        conn.execute('CREATE INDEX IF NOT EXISTS `jobs_status_run_at` ON `jobs` (`status`, `run_at`)')
+        conn.commit()
+
+    def enqueue(self, kind, key, payload):
+        conn = self.__get_connection()
+        with conn:
+            cursor = conn.execute(
+                'INSERT INTO `jobs` (`key`,`kind`,`payload`,`status`,`attempts`,`run_at`) VALUES (?, ?, ?, ?, 0, 0) '
+                'ON CONFLICT (`key`) DO UPDATE SET `kind`=excluded.`kind`, `payload`=excluded.`payload`, `status`=excluded.`status`, '
+                '`attempts`=0, `run_at`=0, `result`=NULL, `error`=NULL WHERE `jobs`.`status` NOT IN (?, ?)',
+                (key, kind, json.dumps(payload), Job.PENDING, Job.PENDING, Job.RUNNING)
+            )
+
+        # waking up the workers of this process, the other ones find the job on their next poll
+        self._wake()
+        return cursor.rowcount > 0
+
+    def get(self, key):
+        row = self.__get_connection().execute(
+            'SELECT `key`,`kind`,`payload`,`status`,`attempts`,`run_at`,`result`,`error` FROM `jobs` WHERE `key`=?', (key,)
+        ).fetchone()
+        return self.__to_job(row) if row is not None else None
+
+    def _claim(self, now, lease_timeout):
+        conn = self.__get_connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT `key`,`kind`,`payload`,`status`,`attempts`,`run_at`,`result`,`error` FROM `jobs` '
+                'WHERE `status` IN (?, ?) AND `run_at`<=? ORDER BY `run_at` LIMIT 1',
+                (Job.PENDING, Job.RUNNING, now)
+            ).fetchone()
+            if row is not None:
+                reclaimed = 1 if row[3] == Job.RUNNING else 0
+                conn.execute('UPDATE `jobs` SET `status`=?, `run_at`=?, `attempts`=`attempts`+? WHERE `key`=?', (Job.RUNNING, now + lease_timeout, reclaimed, row[0]))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        if row is None:
+            return None
+
+        job = self.__to_job(row)
+        job.attempts += reclaimed
+        job.status = Job.RUNNING
+        return job
+
+    def _finish(self, key, status, attempts, run_at, result, error):
+        conn = self.__get_connection()
+        with conn:
+            conn.execute(
+                'UPDATE `jobs` SET `status`=?, `attempts`=?, `run_at`=?, `result`=?, `error`=? WHERE `key`=?',
+                (status, attempts, run_at, json.dumps(result) if result is not None else None, error, key)
+            )
+
+    def _wait(self, timeout):
+        self._wakeup.wait(timeout)
+        self._wakeup.clear()
+
+    def _wake(self):
+        self._wakeup.set()
+
+    def __to_job(self, row):
+        key, kind, payload, status, attempts, run_at, result, error = row
+        return Job(key, kind, json.loads(payload), status, attempts, run_at, json.loads(result) if result is not None else None, error)
+
+    """ Get the connection of the current thread, opening it if needed """
+    def __get_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self._path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+""" Create a job queue instance for the configured backend """
+def create_job_queue(backend = None):
+    backend = config.JOB_QUEUE_BACKEND if backend is None else backend
+    options = {'max_attempts': config.JOB_QUEUE_MAX_ATTEMPTS, 'max_backoff': config.JOB_QUEUE_MAX_BACKOFF}
+
+    if backend == 'sqlite':
+        return SQLiteJobQueue(config.JOB_QUEUE_SQLITE_PATH, **options)
+    elif backend == 'memory':
+        return MemoryJobQueue(**options)
+    else:
+        raise JobQueueException('Unknown job queue backend "{}"'.format(backend))
+
+class JobQueueException(Exception):
+    pass
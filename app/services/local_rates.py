@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+import csv
+import os
+import re
+from bisect import bisect_left, bisect_right
+from correios import ShippingRateResult
+
+from app.models.quote import RateQuote
+
+"""
+Local Rate Tables.
+
+In-memory index of the Correios price tables, made of:
+
+- regions: sorted, non overlapping CEP ranges mapped to a region name, looked up with bisect
+- zones: the zone of each (origin region, destination region) pair
+- prices: for each (service, zone), the sorted weight brackets (max weight in kg) and their prices
+- deadlines: the delivery days of each (service, zone)
+"""
+class RateTables(object):
+
+    _region_starts = None
+    _region_ends = None
+    _region_names = None
+    _zones = None
+    _prices = None
+    _deadlines = None
+
+    def __init__(self, regions, zones, prices, deadlines):
+        regions = sorted(regions)
+        self._region_starts = [start for start, end, name in regions]
+        self._region_ends = [end for start, end, name in regions]
+        self._region_names = [name for start, end, name in regions]
+        self._zones = dict(((origin, destination), zone) for origin, destination, zone in zones)
+
+        brackets = {}
+        for service, zone, max_weight, price in sorted(prices):
+            weights, values = brackets.setdefault((service, zone), ([], []))
+            weights.append(max_weight)
+            values.append(price)
+        self._prices = brackets
+
+        self._deadlines = dict(((service, zone), days) for service, zone, days in deadlines)
+
+    """ Get the region of a given postal code, or None if it is not covered by the tables """
+    def get_region(self, postal_code):
+        cep = int(re.sub(r'\D', '', postal_code) or 0)
+        i = bisect_right(self._region_starts, cep) - 1
+        if i >= 0 and cep <= self._region_ends[i]:
+            return self._region_names[i]
+        return None
+
+    """ Get the zone between two postal codes, or None if it is not covered by the tables """
+    def get_zone(self, origin, destination):
+        return self._zones.get((self.get_region(origin), self.get_region(destination)))
+
+    """ Get the price of a service in a zone for a given weight, or None if it is not covered by the tables """
+    def get_price(self, service, zone, weight):
+        brackets = self._prices.get((service, zone))
+        if brackets is None:
+            return None
+
+        weights, values = brackets
+        i = bisect_left(weights, weight)
+        return values[i] if i < len(values) else None
+
+    """ Get the delivery days of a service in a zone, or None if it is not covered by the tables """
+    def get_deadline(self, service, zone):
+        return self._deadlines.get((service, zone))
+
+"""
+Load the rate tables from a directory of CSV files with a header row:
+
+- regions.csv: cep_start,cep_end,region
+- zones.csv: origin_region,destination_region,zone
+- prices.csv: service,zone,max_weight,price
+- deadlines.csv: service,zone,days
+"""
+def load_rate_tables(path):
+    def rows(filename):
+        with open(os.path.join(path, filename), newline='') as f:
+            return list(csv.DictReader(f))
+
+    try:
+        regions = [(int(r['cep_start']), int(r['cep_end']), r['region']) for r in rows('regions.csv')]
+        zones = [(r['origin_region'], r['destination_region'], r['zone']) for r in rows('zones.csv')]
+        prices = [(r['service'], r['zone'], float(r['max_weight']), float(r['price'])) for r in rows('prices.csv')]
+        deadlines = [(r['service'], r['zone'], int(r['days'])) for r in rows('deadlines.csv')]
+    except (IOError, KeyError, ValueError) as e:
+        raise LocalRatesException('An error occurred at try to load rate tables from {}. An exception with message "{}" was caught'.format(path,str(e)))
+
+    return RateTables(regions, zones, prices, deadlines)
+
+""" Local Correios Rate Engine """
+class LocalCorreios(object):
+
+    CUBIC_FACTOR = 6000.0
+    CUBIC_MIN_WEIGHT = 5.0
+
+    _tables = None
+
+    """
+    LocalCorreios Constructor.
+
+    Computes shipping rates from locally stored rate tables, with the same interface of the Correios client. The charged
+    weight is the package weight, or its cubic weight (height x width x depth / 6000) when that is greater and above 5kg.
+    """
+    def __init__(self, tables):
+        self._tables = tables
+
+    """ Get the shipping rates of a package, or None if any of the services is not covered by the tables """
+    def get_shipping_rates(self, origin, destination, package, services):
+        zone = self._tables.get_zone(origin, destination)
+        if zone is None:
+            return None
+
+        dimensions = package.api_format()
+        weight = dimensions.get('nVlPeso')
+        cubic_weight = dimensions.get('nVlAltura') * dimensions.get('nVlLargura') * dimensions.get('nVlComprimento') / self.CUBIC_FACTOR
+        if cubic_weight > self.CUBIC_MIN_WEIGHT and cubic_weight > weight:
+            weight = cubic_weight
+
+        results = []
+        for service in services:
+            price = self._tables.get_price(service, zone, weight)
+            days = self._tables.get_deadline(service, zone)
+            if price is None or days is None:
+                return None
+            results.append(RateQuote(service, price, days))
+
+        return ShippingRateResult(origin, destination, package, results)
+
+class LocalRatesException(Exception):
+    pass
@@ -1,6 +1,101 @@
 # -*- coding: utf-8 -*-
+import atexit
+import contextvars
+import json
 import logging
+import os
+import queue
+import random
 import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from app import config
+
+# id of the request being handled in the current context, added to every log record
+request_id = contextvars.ContextVar('request_id', default=None)
+
+""" Set the id of the request being handled in the current context """
+def set_request_id(value):
+    return request_id.set(value)
+
+""" JSON Log Formatter, emitting one structured record per line """
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        if getattr(record, 'request_id', None) is not None:
+            entry['request_id'] = record.request_id
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+"""
+Queue Log Handler.
+
+Enqueues records without blocking, to be written by a background listener thread, dropping them when the queue is full
+instead of making the caller wait for stdout. The current request id is captured at enqueue time, since the listener
+thread runs outside the request context.
+"""
+class BackgroundHandler(QueueHandler):
+
+    dropped = 0
+
+    def prepare(self, record):
+        record.request_id = request_id.get()
+        return QueueHandler.prepare(self, record)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            BackgroundHandler.dropped += 1
+
+_handler = None
+_listener = None
+
+""" Get the handler shared by every logger, starting its background listener if needed """
+def _get_handler():
+    global _handler, _listener
+
+    if _handler is None:
+        log_queue = queue.Queue(config.LOG_QUEUE_SIZE)
+        _handler = BackgroundHandler(log_queue)
+
+        stream = logging.StreamHandler(sys.stdout)
+        stream.setFormatter(JsonFormatter() if config.LOG_FORMAT == 'json' else logging.Formatter('%(message)s'))
+        _listener = QueueListener(log_queue, stream)
+        _listener.start()
+        atexit.register(_stop_listener)
+
+    return _handler
+
+""" Stop the current background listener, writing the records left in its queue """
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop()
+
+"""
+Start a new background listener in forked children, since threads do not survive a fork. It gets a new queue too, as
+the inherited one may hold records the parent writes, or a lock held by the parent listener thread at fork time.
+"""
+def _restart_listener():
+    global _listener
+
+    if _listener is not None:
+        log_queue = queue.Queue(config.LOG_QUEUE_SIZE)
+        _handler.queue = log_queue
+        _listener = QueueListener(log_queue, *_listener.handlers)
+        _listener.start()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_listener)
 
 """ Logger Wrapper """
 class Logger(object):
@@ -11,25 +106,40 @@ class Logger(object):
         name = 'default' if name is None else name
 
         self._logger = logging.getLogger(name)
-        self._logger.setLevel(logging.INFO if level is None else level)
+        self._logger.setLevel(logging.getLevelName(config.LOG_LEVEL) if level is None else level)
+
+        # every logger shares the same background handler, added only once
+        if not self._logger.handlers:
+            self._logger.addHandler(_get_handler())
+            self._logger.propagate = False
+
+    def debug(self, message, **fields):
+        self._logger.debug(message, extra={'fields': fields})
 
-        handler = logging.StreamHandler(sys.stdout)
-        handler.setLevel(logging.INFO)
+    def info(self, message, **fields):
+        self._logger.info(message, extra={'fields': fields})
 
-        self._logger.addHandler(handler)
+    def warn(self, message, **fields):
+        self._logger.warning(message, extra={'fields': fields})
 
-    def debug(self, message):
-        self._logger.debug(message)
+    def error(self, message, **fields):
+        self._logger.error(message, extra={'fields': fields})
 
-    def info(self, message):
-        self._logger.info(message)
+    def critic(self, message, **fields):
+        self._logger.critical(message, extra={'fields': fields})
 
-    def warn(self, message):
-        self._logger.warning(message)
+    """
+    Log a request or response payload at DEBUG level, for a sample of LOG_PAYLOAD_SAMPLE_RATE of the calls.
 
-    def error(self, message):
-        self._logger.error(message)
+    The payload may be a callable, which is only called when the record is going to be logged, so payloads are not
+    even built on the hot path when DEBUG is disabled or the call is not sampled.
+    """
+    def payload(self, message, payload, sample_rate = None):
+        if not self._logger.isEnabledFor(logging.DEBUG):
+            return
 
-    def critic(self, message):
-        self._logger.critical(message)
+        sample_rate = config.LOG_PAYLOAD_SAMPLE_RATE if sample_rate is None else sample_rate
+        if sample_rate < 1 and random.random() >= sample_rate:
+            return
 
+        self._logger.debug(message, extra={'fields': {'payload': payload() if callable(payload) else payload}})
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+"""
+In-process metrics, exposed in the Prometheus text format.
+
+Metrics are kept per process, so when running several workers each one reports its own values, and the scraper (or a
+PromQL sum) aggregates them.
+"""
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+""" Metric Base Class """
+class Metric(object):
+
+    TYPE = None
+
+    name = None
+    description = None
+    labels = None
+    _values = None
+    _lock = None
+
+    def __init__(self, name, description, labels = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    """ Get the key of a set of label values """
+    def _key(self, labels):
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+    """ Format a set of label values, plus extra labels, in the Prometheus format """
+    def _format_labels(self, key, extra = ()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs) + '}'
+
+    """ Render the metric in the Prometheus text format """
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.description), '# TYPE {} {}'.format(self.name, self.TYPE)]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return ['{}{} {}'.format(self.name, self._format_labels(key), value)]
+
+""" Counter Metric, a value that only goes up """
+class Counter(Metric):
+
+    TYPE = 'counter'
+
+    def inc(self, amount = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+""" Gauge Metric, a value that goes up and down """
+class Gauge(Metric):
+
+    TYPE = 'gauge'
+
+    def inc(self, amount = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    """ Track the number of calls in progress inside the context """
+    @contextmanager
+    def track(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+""" Histogram Metric, counting observations in latency buckets """
+class Histogram(Metric):
+
+    TYPE = 'histogram'
+
+    buckets = None
+
+    def __init__(self, name, description, labels = (), buckets = DEFAULT_BUCKETS):
+        Metric.__init__(self, name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    """ Observe the time spent, in seconds, inside the context """
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_value(self, key, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bucket, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            le = '+Inf' if bucket == float('inf') else repr(bucket)
+            lines.append('{}_bucket{} {}'.format(self.name, self._format_labels(key, [('le', le)]), cumulative))
+        lines.append('{}_sum{} {}'.format(self.name, self._format_labels(key), total))
+        lines.append('{}_count{} {}'.format(self.name, self._format_labels(key), cumulative))
+        return lines
+
+""" Metrics Registry """
+class MetricsRegistry(object):
+
+    _metrics = None
+    _lock = None
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, description, labels = ()):
+        return self.__register(Counter, name, description, labels)
+
+    def gauge(self, name, description, labels = ()):
+        return self.__register(Gauge, name, description, labels)
+
+    def histogram(self, name, description, labels = (), buckets = DEFAULT_BUCKETS):
+        return self.__register(Histogram, name, description, labels, buckets=buckets)
+
+    """ Render every registered metric in the Prometheus text format """
+    def render(self):
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    """ Register a metric, returning the already registered one when the name is taken """
+    def __register(self, cls, name, description, labels, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, description, labels, **kwargs)
+            return self._metrics[name]
+
+# default registry, shared by the whole app
+registry = MetricsRegistry()
+
+# request metrics, shared by the sync (Flask) and async (ASGI) apps
+REQUESTS_IN_FLIGHT = registry.gauge('http_requests_in_flight', 'Requests being handled')
+REQUEST_SECONDS = registry.histogram('http_request_seconds', 'Time spent handling requests by route and status code', ['route', 'status'])
+STEP_SECONDS = registry.histogram('shipping_options_step_seconds', 'Time spent in each step of a shipping options quote', ['step'])
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+from app import config
+from app.services.logger import Logger
+from app.services.metrics import registry
+from app.services.rate_limiter import TokenBucket
+from app.services.shipping_rates import ShippingRatesException
+
+WARMUP = registry.counter('quote_warmup_total', 'Quote warm-up attempts by result (refreshed, failed, leased or budget)', ['result'])
+WARMUP_TRACKED = registry.gauge('quote_warmup_tracked_keys', 'Quote keys tracked by the warm-up request history')
+
+"""
+Quote History.
+
+Counts the quote keys requested to a ShippingRates instance, with scores that decay by half every half_life seconds, so
+recent requests weigh more than old ones. At most max_keys keys are tracked, and the coldest half is dropped when the
+limit is reached. Keys are grouped in zones, made of their origin, the first zone_digits digits of their destination,
+their package shape and their services, so the hottest routes are found even when shoppers are spread over many CEPs.
+"""
+class QuoteHistory(object):
+
+    _max_keys = None
+    _half_life = None
+    _zone_digits = None
+    _scores = None
+    _lock = None
+
+    def __init__(self, max_keys = 10000, half_life = 3600, zone_digits = 5):
+        self._max_keys = max_keys
+        self._half_life = float(half_life)
+        self._zone_digits = zone_digits
+        self._scores = {}
+        self._lock = threading.Lock()
+
+    """ Record a request of a quote key """
+    def record(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._scores.get(key)
+            if entry is not None:
+                entry[0] = self.__decay(entry[0], entry[1], now) + 1
+                entry[1] = now
+                return
+
+            if len(self._scores) >= self._max_keys:
+                self.__prune(now)
+            self._scores[key] = [1.0, now]
+
+    """
+    Get the hottest quote keys, hottest first.
+
+    Zones are ranked by the sum of the scores of their keys, and up to per_zone keys of each zone are returned, ranked
+    by their own scores, until limit keys are returned.
+    """
+    def hottest(self, limit, per_zone = 5):
+        now = time.monotonic()
+        with self._lock:
+            scores = [(key, self.__decay(score, updated_at, now)) for key, (score, updated_at) in self._scores.items()]
+
+        zones = {}
+        for key, score in scores:
+            zone = zones.setdefault(self.get_zone(key), [0.0, []])
+            zone[0] += score
+            zone[1].append((score, key))
+
+        keys = []
+        for total, zone_keys in sorted(zones.values(), key=lambda zone: zone[0], reverse=True):
+            zone_keys.sort(key=lambda entry: entry[0], reverse=True)
+            for score, key in zone_keys[:per_zone]:
+                keys.append(key)
+                if len(keys) >= limit:
+                    return keys
+        return keys
+
+    """ Get the zone of a quote key """
+    def get_zone(self, key):
+        return (key.origin, key.destination[:self._zone_digits], key.shape, key.services)
+
+    def __len__(self):
+        return len(self._scores)
+
+    """ Decay a score last updated at updated_at to now """
+    def __decay(self, score, updated_at, now):
+        return score * 0.5 ** ((now - updated_at) / self._half_life)
+
+    """ Drop the coldest half of the tracked keys, must be called with the lock held """
+    def __prune(self, now):
+        ranked = sorted(self._scores.items(), key=lambda item: self.__decay(item[1][0], item[1][1], now))
+        for key, entry in ranked[:len(ranked) // 2 + 1]:
+            del self._scores[key]
+
+""" Quote Warmer """
+class QuoteWarmer(object):
+
+    _shipping_rates = None
+    _history = None
+    _bucket = None
+    _refresh_ahead = None
+    _max_keys = None
+    _per_zone = None
+    _interval = None
+    _stopped = None
+    _thread = None
+    _logger = None
+
+    """
+    QuoteWarmer Constructor.
+
+    Every interval seconds, refreshes the cached quotes of the hottest keys of the QuoteHistory that are missing or
+    expire in less than refresh_ahead seconds, so shoppers on popular routes are answered from the cache. At most
+    max_keys keys, of at most per_zone keys per zone, are kept warm, and at most budget webservice calls are made per
+    minute: when the budget runs out, the coldest keys wait for the next round.
+
+    Every refresh is leased for interval seconds in the rate cache, so warmers of workers sharing the cache skip the
+    keys another one is refreshing, instead of calling the webservice for them again.
+    """
+    def __init__(self, shipping_rates, history, budget = 60, refresh_ahead = 300, max_keys = 1000, per_zone = 5, interval = 10):
+        self._logger = Logger(self.__class__.__name__)
+        self._shipping_rates = shipping_rates
+        self._history = history
+        self._bucket = TokenBucket(budget / 60.0, max(1.0, budget / 60.0 * interval))
+        self._refresh_ahead = refresh_ahead
+        self._max_keys = max_keys
+        self._per_zone = per_zone
+        self._interval = interval
+        self._stopped = threading.Event()
+
+    """ Start the warm-up in a background thread """
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self.__run, name='quote-warmer', daemon=True)
+        self._thread.start()
+
+    """ Stop the warm-up, waiting for the current round to finish """
+    def stop(self, timeout = None):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    """ Run a single warm-up round, returning the number of refreshed quotes """
+    def run_once(self):
+        WARMUP_TRACKED.set(len(self._history))
+
+        refreshed = 0
+        for key in self._history.hottest(self._max_keys, self._per_zone):
+            if self._stopped.is_set():
+                break
+
+            remaining = self._shipping_rates.get_freshness(key)
+            if remaining is not None and remaining > self._refresh_ahead:
+                continue
+
+            if not self._shipping_rates.lease(key, self._interval):
+                WARMUP.inc(result='leased')
+                continue
+
+            if not self._bucket.try_acquire():
+                WARMUP.inc(result='budget')
+                break
+
+            try:
+                self._shipping_rates.refresh(key)
+            except ShippingRatesException as e:
+                WARMUP.inc(result='failed')
+                self._logger.warn('Failed to warm up the quote {}. {}'.format(str(key), str(e)))
+                continue
+
+            WARMUP.inc(result='refreshed')
+            refreshed += 1
+
+        return refreshed
+
+    def __run(self):
+        while not self._stopped.wait(self._interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                self._logger.error('The quote warm-up round failed. An exception with message "{}" was caught'.format(str(e)))
+
+"""
+Create a quote warmer for the given shipping rates and history from the app config.
+
+The budget is split between the WEB_CONCURRENCY worker processes, each running its own warmer, and the number of keys
+kept warm is the number of quotes the budget of the worker can refresh within the rate cache ttl.
+"""
+def create_quote_warmer(shipping_rates, history):
+    budget = config.WARMUP_BUDGET / max(1, config.WEB_CONCURRENCY)
+    return QuoteWarmer(
+        shipping_rates, history, budget=budget, refresh_ahead=config.WARMUP_REFRESH_AHEAD,
+        max_keys=max(1, int(budget * config.RATE_CACHE_TTL // 60)), per_zone=config.WARMUP_KEYS_PER_ZONE,
+        interval=config.WARMUP_INTERVAL
+    )
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from app import config
+from app.models.quote import QuoteKey
+
+"""
+Build the cache key of a shipping rate quote.
+
+The key is a QuoteKey made of the origin and destination postal codes (digits only), the normalized package shape as
+sent to the Correios webservice and the sorted list of requested services, so two carts with the same route and the same
+package shape share the same quote. The in-process cache uses it as is, and the shared caches use its string form.
+"""
+def rate_cache_key(origin, destination, package, services):
+    return QuoteKey.build(origin, destination, package, services)
+
+""" Rate Cache Interface, whose values are bytes """
+class RateCache(object):
+
+    _ttl = None
+
+    def __init__(self, ttl):
+        self._ttl = ttl
+
+    """ Get the default ttl, in seconds, of the cache entries """
+    def get_ttl(self):
+        return self._ttl
+
+    """ Get the cached value of a given key, returns None on misses or expired entries """
+    def get(self, key):
+        raise NotImplementedError
+
+    """ Store a value with the given key, using the default ttl if none is supplied """
+    def set(self, key, value, ttl = None):
+        raise NotImplementedError
+
+    """ Store a value with the given key only if it is missing or expired, returning whether it was stored """
+    def add(self, key, value, ttl = None):
+        raise NotImplementedError
+
+    """ Remove every entry from the cache """
+    def clear(self):
+        raise NotImplementedError
+
+""" Null Rate Cache, used when caching is disabled """
+class NullRateCache(RateCache):
+
+    def __init__(self):
+        RateCache.__init__(self, 0)
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl = None):
+        return False
+
+    def add(self, key, value, ttl = None):
+        return True
+
+    def clear(self):
+        pass
+
+"""
+In-process Rate Cache.
+
+Entries are kept in an LRU ordered dict with a memory cap (in bytes of the values, plus an estimate of the
+key and bookkeeping overhead), so the least recently used quotes are evicted first when the cap is reached. Every worker
+process has its own copy of this cache.
+"""
+class MemoryRateCache(RateCache):
+
+    ENTRY_OVERHEAD = 256
+
+    _entries = None
+    _max_bytes = None
+    _size = 0
+    _lock = None
+
+    def __init__(self, ttl, max_bytes):
+        RateCache.__init__(self, ttl)
+        self._entries = OrderedDict()
+        self._max_bytes = max_bytes
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, value = entry
+            if expires_at < time.time():
+                self.__remove(key)
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl = None):
+        if len(value) + self.ENTRY_OVERHEAD > self._max_bytes:
+            return False
+
+        expires_at = time.time() + (self._ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._entries:
+                self.__remove(key)
+
+            self._entries[key] = (expires_at, value)
+            self._size += len(value) + self.ENTRY_OVERHEAD
+
+            while self._size > self._max_bytes:
+                self.__remove(next(iter(self._entries)))
+
+        return True
+
+    def add(self, key, value, ttl = None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] >= time.time():
+                return False
+        return self.set(key, value, ttl)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    """ Remove an entry and update the memory accounting, must be called with the lock held """
+    def __remove(self, key):
+        expires_at, value = self._entries.pop(key)
+        self._size -= len(value) + self.ENTRY_OVERHEAD
+
+"""
+Redis Rate Cache.
+
+Shared between every worker and every process connected to the same Redis-compatible server. Expiration is delegated
+to the server, and eviction should be configured there through the maxmemory and maxmemory-policy (allkeys-lru) settings.
+Values are stored as is, so nothing read from a shared server is ever unpickled.
+"""
+class RedisRateCache(RateCache):
+
+    _client = None
+
+    def __init__(self, ttl, url):
+        RateCache.__init__(self, ttl)
+        try:
+            import redis
+        except ImportError:
+            raise RateCacheException('The redis rate cache backend requires the redis package to be installed')
+
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        return self._client.get(str(key))
+
+    def set(self, key, value, ttl = None):
+        return bool(self._client.set(str(key), value, ex=int(self._ttl if ttl is None else ttl)))
+
+    def add(self, key, value, ttl = None):
+        return bool(self._client.set(str(key), value, ex=int(self._ttl if ttl is None else ttl), nx=True))
+
+    def clear(self):
+        for key in self._client.scan_iter('rate:*'):
+            self._client.delete(key)
+
+"""
+SQLite Rate Cache.
+
+Shared between every worker running in the same host through a local database file. Each thread holds its own
+connection, and expired entries are ignored on read. Writes purge the expired entries and evict the least recently
+used ones beyond the max_entries limit at most once every PURGE_INTERVAL seconds per instance, so a cache miss does not
+scan the table, and the table may briefly hold more than max_entries rows. The access time of an entry is only written
+on reads when it is older than ACCESS_RESOLUTION seconds, so cache hits do not write to the database most of the time.
+"""
+class SQLiteRateCache(RateCache):
+
+    ACCESS_RESOLUTION = 60
+    PURGE_INTERVAL = 30
+
+    _path = None
+    _max_entries = None
+    _local = None
+    _purged_at = 0
+
+    def __init__(self, ttl, path, max_entries):
+        RateCache.__init__(self, ttl)
+        self._path = path
+        self._max_entries = max_entries
+        self._local = threading.local()
+
+        conn = self.__get_connection()
+        conn.execute('CREATE TABLE IF NOT EXISTS `rate_cache` (`key` TEXT PRIMARY KEY, `value` BLOB NOT NULL, `expires_at` REAL NOT NULL, `accessed_at` REAL NOT NULL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS `rate_cache_accessed_at` ON `rate_cache` (`accessed_at`)')
+        conn.execute('CREATE INDEX IF NOT EXISTS `rate_cache_expires_at` ON `rate_cache` (`expires_at`)')
+        conn.commit()
+
+    def get(self, key):
+        key = str(key)
+        now = time.time()
+        conn = self.__get_connection()
+        row = conn.execute('SELECT `value`, `accessed_at` FROM `rate_cache` WHERE `key`=? AND `expires_at`>=?', (key, now)).fetchone()
+        if row is None:
+            return None
+
+        value, accessed_at = row
+        if now - accessed_at > self.ACCESS_RESOLUTION:
+            conn.execute('UPDATE `rate_cache` SET `accessed_at`=? WHERE `key`=?', (now, key))
+            conn.commit()
+        return value
+
+    def set(self, key, value, ttl = None):
+        now = time.time()
+        conn = self.__get_connection()
+        conn.execute(
+            'INSERT OR REPLACE INTO `rate_cache` (`key`,`value`,`expires_at`,`accessed_at`) VALUES (?, ?, ?, ?)',
+            (str(key), value, now + (self._ttl if ttl is None else ttl), now)
+        )
+        if now - self._purged_at > self.PURGE_INTERVAL:
+            self._purged_at = now
+            self.__purge(conn, now)
+        conn.commit()
+        return True
+
+    def add(self, key, value, ttl = None):
+        now = time.time()
+        conn = self.__get_connection()
+        cursor = conn.execute(
+            'INSERT INTO `rate_cache` (`key`,`value`,`expires_at`,`accessed_at`) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (`key`) DO UPDATE SET `value`=excluded.`value`, `expires_at`=excluded.`expires_at`, `accessed_at`=excluded.`accessed_at` '
+            'WHERE `rate_cache`.`expires_at`<?',
+            (str(key), value, now + (self._ttl if ttl is None else ttl), now, now)
+        )
+        conn.commit()
+        return cursor.rowcount == 1
+
+    def clear(self):
+        conn = self.__get_connection()
+        conn.execute('DELETE FROM `rate_cache`')
+        conn.commit()
+
+    """ Delete the expired entries, then the least recently used ones beyond the max_entries limit """
+    def __purge(self, conn, now):
+        conn.execute('DELETE FROM `rate_cache` WHERE `expires_at`<?', (now,))
+        conn.execute(
+            'DELETE FROM `rate_cache` WHERE `key` IN (SELECT `key` FROM `rate_cache` ORDER BY `accessed_at` DESC LIMIT -1 OFFSET ?)',
+            (self._max_entries,)
+        )
+
+    """ Get the connection of the current thread, opening it if needed """
+    def __get_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self._path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+""" Create a rate cache instance for the configured backend """
+def create_rate_cache(backend = None):
+    backend = config.RATE_CACHE_BACKEND if backend is None else backend
+
+    if backend == 'memory':
+        return MemoryRateCache(ttl=config.RATE_CACHE_TTL, max_bytes=config.RATE_CACHE_MAX_BYTES)
+    elif backend == 'redis':
+        return RedisRateCache(ttl=config.RATE_CACHE_TTL, url=config.RATE_CACHE_REDIS_URL)
+    elif backend == 'sqlite':
+        return SQLiteRateCache(ttl=config.RATE_CACHE_TTL, path=config.RATE_CACHE_SQLITE_PATH, max_entries=config.RATE_CACHE_MAX_ENTRIES)
+    elif backend == 'none':
+        return NullRateCache()
+    else:
+        raise RateCacheException('Unknown rate cache backend "{}"'.format(backend))
+
+class RateCacheException(Exception):
+    pass
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+"""
+Token Bucket Rate Limiter.
+
+Allows bursts of up to capacity calls, refilled at rate tokens per second. Thread safe, so a single bucket can limit the
+calls made by many threads.
+"""
+class TokenBucket(object):
+
+    _rate = None
+    _capacity = None
+    _tokens = None
+    _updated_at = None
+    _lock = None
+
+    def __init__(self, rate, capacity = None):
+        self._rate = float(rate)
+        self._capacity = float(rate if capacity is None else capacity)
+        self._tokens = self._capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    """ Take a token if one is available, without waiting """
+    def try_acquire(self):
+        return self.__take() == 0
+
+    """ Take a token, waiting for at most timeout seconds (forever if None), returning whether a token was taken """
+    def acquire(self, timeout = None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.__take()
+            if wait == 0:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    """ Take a token, returning 0 on success or the number of seconds until the next token otherwise """
+    def __take(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated_at) * self._rate)
+            self._updated_at = now
+
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self._rate
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+from functools import reduce
+
+from app import config
+from app.services.logger import Logger
+from app.services.metrics import STEP_SECONDS
+from app.services.shipping_rates import ShippingRatesException
+from app.util.correios import BulkBoxPackage, item_to_package_item, create_shipping_option_formatter
+
+""" Shipping Options Service """
+class ShippingOptions(object):
+
+    _shipping_rates = None
+    _services = None
+    _formatter = None
+    _logger = None
+
+    """
+    ShippingOptions Constructor.
+
+    Builds the TiendaNube shipping options of a cart from the Correios rates given by a ShippingRates instance. This is
+    the framework independent implementation of the options route, used by both the sync (Flask) and async (ASGI) apps.
+    Options are formatted by the given ShippingOptionFormatter, or by one built from the app config.
+    """
+    def __init__(self, shipping_rates, services = None, formatter = None):
+        self._logger = Logger(self.__class__.__name__)
+        self._shipping_rates = shipping_rates
+        self._services = [config.OPTION_PAC_SERVICE, config.OPTION_SEDEX_SERVICE] if services is None else services
+        self._formatter = create_shipping_option_formatter() if formatter is None else formatter
+
+    """
+    Get the shipping options of a cart, blocking until the Correios rates are available. The items are CartItem
+    instances, as built by validate_cart().
+
+    Raises a ShippingOptionsException if the rates for the whole cart could not be obtained.
+    """
+    def quote(self, origin, destination, items):
+        package, non_free_shipping_package, free_shipping_cart = self.__build_packages(items)
+
+        # requesting merchant and consumer rates from webservice at the same time
+        rates_future = self._shipping_rates.submit(origin, destination, package, self._services)
+        non_free_shipping_rates_future = None
+        if non_free_shipping_package is not None:
+            non_free_shipping_rates_future = self._shipping_rates.submit(origin, destination, non_free_shipping_package, self._services)
+
+        try:
+            with STEP_SECONDS.time(step='get_shipping_rates'):
+                rates = self._shipping_rates.result(rates_future)
+        except ShippingRatesException as e:
+            raise ShippingOptionsException(str(e))
+
+        non_free_shipping_rates = None
+        if non_free_shipping_rates_future is not None:
+            try:
+                non_free_shipping_rates = self._shipping_rates.result(non_free_shipping_rates_future)
+            except ShippingRatesException as e:
+                self._logger.warn(str(e))
+
+        return self.__build_options(rates, non_free_shipping_rates, free_shipping_cart)
+
+    """
+    Get the shipping options of a cart without blocking the running event loop.
+
+    The Correios calls run in the ShippingRates thread pool and are awaited here, so a single process can keep as many
+    quotes in flight as there are threads in that pool.
+    """
+    async def quote_async(self, origin, destination, items):
+        package, non_free_shipping_package, free_shipping_cart = self.__build_packages(items)
+
+        rates_future = self._shipping_rates.submit(origin, destination, package, self._services)
+        non_free_shipping_rates_future = None
+        if non_free_shipping_package is not None:
+            non_free_shipping_rates_future = self._shipping_rates.submit(origin, destination, non_free_shipping_package, self._services)
+
+        try:
+            with STEP_SECONDS.time(step='get_shipping_rates'):
+                rates = await self._shipping_rates.result_async(rates_future)
+        except Exception as e:
+            raise ShippingOptionsException('An error occurred at try to get shipping rates from Correios webservice. An exception with message "{}" was caught'.format(str(e) or e.__class__.__name__))
+
+        non_free_shipping_rates = None
+        if non_free_shipping_rates_future is not None:
+            try:
+                non_free_shipping_rates = await self._shipping_rates.result_async(non_free_shipping_rates_future)
+            except Exception as e:
+                self._logger.warn('An error occurred at try to get consumer shipping rates. An exception with message "{}" was caught'.format(str(e) or e.__class__.__name__))
+
+        return self.__build_options(rates, non_free_shipping_rates, free_shipping_cart)
+
+    """ Build the cart package, and the package without free shipping items when the cart mixes both kinds of items """
+    def __build_packages(self, items):
+        with STEP_SECONDS.time(step='build_package'):
+            package = reduce(item_to_package_item,items,BulkBoxPackage())
+        self._logger.payload('Correios package', package.api_format)
+
+        # checking for free shipping items in cart
+        free_shipping_items_qty = sum(1 for item in items if item.free_shipping)
+        free_shipping_cart = free_shipping_items_qty == len(items)
+
+        non_free_shipping_package = None
+        if free_shipping_items_qty > 0 and not free_shipping_cart:
+            # performing another shipping costs calculation in order to get the consumer prices
+            non_free_shipping_items = [item for item in items if not item.free_shipping]
+            with STEP_SECONDS.time(step='build_package'):
+                non_free_shipping_package = reduce(item_to_package_item,non_free_shipping_items,BulkBoxPackage())
+
+        return package, non_free_shipping_package, free_shipping_cart
+
+    """ Convert the merchant and consumer rates to the shipping option format, falling back to the merchant rates """
+    def __build_options(self, rates, non_free_shipping_rates, free_shipping_cart):
+        # checking for errors
+        if rates.has_errors():
+            self.__log_errors(rates)
+            raise ShippingOptionsException('The Correios webservice returned errors for the requested services')
+
+        if non_free_shipping_rates is None:
+            non_free_shipping_rates = rates
+        elif non_free_shipping_rates.has_errors():
+            self.__log_errors(non_free_shipping_rates)
+            non_free_shipping_rates = rates
+
+        # parsing service rates to the shipping option format
+        with STEP_SECONDS.time(step='rate_to_shipping_option'):
+            return self._formatter.format(zip(rates.services,non_free_shipping_rates.services), free_shipping_cart)
+
+    """ Log the errors returned by each service """
+    def __log_errors(self, rates):
+        for service in rates.services:
+            code = service.code
+            error = service.error_code
+            message = service.error_message
+            self._logger.warn('The service {} returned the error {} with message: {}'.format(code,error,message), service=code, error_code=error)
+
+class ShippingOptionsException(Exception):
+    pass
@@ -0,0 +1,449 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import contextvars
+import random
+import struct
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError, FIRST_COMPLETED, wait
+import requests
+from correios import ShippingRateResult
+from app.models.quote import RateQuote, pack_quotes, unpack_quotes
+from app.services.circuit_breaker import CircuitBreaker
+from app.services.logger import Logger
+from app.services.metrics import registry
+from app.services.rate_cache import NullRateCache, rate_cache_key
+from app.util.correios import CorreiosClient
+
+QUOTES = registry.counter('shipping_rates_quotes_total', 'Shipping rate quotes by source (local, cache, webservice, coalesced, stale or flat)', ['source'])
+CORREIOS_SECONDS = registry.histogram('correios_request_seconds', 'Time spent in Correios webservice calls')
+CORREIOS_ERRORS = registry.counter('correios_errors_total', 'Errors returned by the Correios webservice by service and error code', ['service', 'error_code'])
+CORREIOS_FAILURES = registry.counter('correios_failures_total', 'Failed Correios webservice calls by reason', ['reason'])
+CORREIOS_HEDGES = registry.counter('correios_hedged_requests_total', 'Duplicate Correios webservice calls sent after the hedge delay')
+QUEUE_TIMEOUTS = registry.counter('shipping_rates_queue_timeouts_total', 'Quotes that did not get a free thread within the queue timeout')
+CORREIOS_CIRCUIT_OPEN = registry.gauge('correios_circuit_open', 'Whether the circuit breaker of the Correios webservice is open (1) or closed (0)')
+
+# fresh until timestamp of a cached quote, followed by its packed quotes
+_FRESH_UNTIL = struct.Struct('<d')
+
+"""
+Parse flat rates in the SERVICE:PRICE:DAYS[,SERVICE:PRICE:DAYS...] format, like "04510:25.00:10,04014:45.00:5", into a
+dict of service code to (price, days).
+"""
+def parse_flat_rates(value):
+    rates = {}
+    for entry in (value or '').split(','):
+        if entry.strip():
+            service, price, days = entry.strip().split(':')
+            rates[service] = (float(price), int(days))
+    return rates
+
+""" Shipping Rates Service """
+class ShippingRates(object):
+
+    # correios error codes meaning that the webservice itself is unavailable, and not that the quote is invalid
+    UNAVAILABLE_ERROR_CODES = (-888, -33, 7, 99)
+
+    _client = None
+    _cache = None
+    _local = None
+    _verify_ratio = None
+    _executor = None
+    _upstream = None
+    _timeout = None
+    _queue_timeout = None
+    _breaker = None
+    _hedge_after = None
+    _stale_ttl = None
+    _degraded_modes = None
+    _flat_rates = None
+    _history = None
+    _in_flight = None
+    _lock = None
+    _logger = None
+
+    """
+    ShippingRates Constructor.
+
+    Wraps a Correios client with a rate cache, so repeated quotes for the same route and package shape are answered
+    without a webservice round trip. If no client or cache is supplied, a CorreiosClient and no cache are used.
+
+    Concurrent quotes run in a bounded thread pool of max_workers threads, each one calling the webservice from its own
+    thread. The client must bound its calls to timeout seconds, as the CorreiosClient does, and the timeout only starts
+    when the quote starts running. Waiting for a free thread is bounded apart by queue_timeout seconds, counted from
+    submit(): quotes that did not start by then are cancelled and answered from the cache or in degraded mode.
+
+    When a local rate engine (LocalCorreios) is supplied, quotes covered by its tables are computed locally, and a
+    verify_ratio fraction of them is also requested from the webservice in the background to detect outdated tables.
+
+    Webservice calls go through a circuit breaker, failing fast while the webservice is down. When hedge_after is set, the
+    calls run in a second pool of max_workers threads, and a duplicate call is sent if the first one did not answer
+    after hedge_after seconds, the first answer winning. When a call fails, the degraded_modes are tried in order:
+    'stale' serves cached quotes up to stale_ttl seconds after they expired, and 'flat' serves the flat_rates, a dict
+    of service code to (price, days).
+
+    Concurrent quotes with the same key (route, package shape and services) share a single webservice call, even when
+    they come from different carts, so only the first one waits for the webservice and the others wait for its result.
+
+    When a QuoteHistory is supplied, the key of every quote not computed locally is recorded in it, to find the quotes
+    worth warming up.
+    """
+    def __init__(self, client = None, cache = None, max_workers = 4, timeout = None, queue_timeout = None, local = None, verify_ratio = 0.0,
+                 breaker = None, hedge_after = None, stale_ttl = 0, degraded_modes = (), flat_rates = None, history = None):
+        self._logger = Logger(self.__class__.__name__)
+        self._client = CorreiosClient(timeout=timeout, pool_size=max_workers) if client is None else client
+        self._cache = NullRateCache() if cache is None else cache
+        self._local = local
+        self._verify_ratio = verify_ratio
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._upstream = ThreadPoolExecutor(max_workers=max_workers) if hedge_after is not None else None
+        self._timeout = timeout
+        self._queue_timeout = queue_timeout
+        self._breaker = CircuitBreaker() if breaker is None else breaker
+        self._hedge_after = hedge_after
+        self._stale_ttl = stale_ttl
+        self._degraded_modes = tuple(degraded_modes)
+        self._flat_rates = flat_rates or {}
+        self._history = history
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    """
+    Get the shipping rates of a package between origin and destination for the given services.
+
+    Results are computed by the local rate engine first, then looked up in the rate cache, and only successful results
+    from the webservice are stored back in the cache. Cache entries are kept for stale_ttl seconds after they expire,
+    to be served in degraded mode. Cache misses of a key already being quoted wait for that quote instead of calling the
+    webservice again.
+    """
+    def get_shipping_rates(self, origin, destination, package, services):
+        if self._local is not None:
+            rates = self._local.get_shipping_rates(origin, destination, package, services)
+            if rates is not None:
+                if self._verify_ratio > 0 and random.random() < self._verify_ratio:
+                    self._executor.submit(self.__verify, rates, origin, destination, package, services)
+                QUOTES.inc(source='local')
+                return rates
+
+        key = rate_cache_key(origin, destination, package, services)
+        if self._history is not None:
+            self._history.record(key)
+
+        cached = self.__read(key)
+        if cached is not None:
+            fresh_until, cached_services = cached
+            if fresh_until >= time.time():
+                QUOTES.inc(source='cache')
+                return ShippingRateResult(origin, destination, package, cached_services)
+
+        with self._lock:
+            flight = self._in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._in_flight[key] = Future()
+
+        if not leader:
+            QUOTES.inc(source='coalesced')
+            return ShippingRateResult(origin, destination, package, flight.result().services)
+
+        try:
+            rates = self.__request(key, origin, destination, package, services, cached)
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        else:
+            flight.set_result(rates)
+            return rates
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    """
+    Request the shipping rates of a key missing from the cache to the webservice, storing successful results in the
+    cache, or get them in degraded mode when the webservice fails.
+    """
+    def __request(self, key, origin, destination, package, services, cached):
+        try:
+            rates = self.__fetch(origin, destination, package, services)
+        except ShippingRatesException as e:
+            degraded = self.__degrade(origin, destination, package, services, cached)
+            if degraded is None:
+                raise
+            self._logger.warn('Serving degraded shipping rates. {}'.format(str(e)))
+            return degraded
+
+        QUOTES.inc(source='webservice')
+        if rates.has_errors():
+            for service in rates.services:
+                if not service.is_success():
+                    CORREIOS_ERRORS.inc(service=service.code, error_code=service.error_code)
+        else:
+            self.__store(key, rates)
+
+        return rates
+
+    """ Get the number of seconds the cached quote of a key is still fresh for (negative once stale), or None if not cached """
+    def get_freshness(self, key):
+        cached = self.__read(key)
+        return None if cached is None else cached[0] - time.time()
+
+    """
+    Claim the refresh of a quote key for ttl seconds, through a lease entry in the rate cache, so the workers sharing the
+    cache do not refresh the same key at the same time. Returns whether the refresh was claimed, and claims it when
+    the cache fails.
+    """
+    def lease(self, key, ttl):
+        try:
+            return self._cache.add('lease:{}'.format(key), b'', ttl=ttl)
+        except Exception as e:
+            self._logger.warn('Failed to lease a shipping rates refresh. An exception with message "{}" was caught'.format(str(e)))
+            return True
+
+    """
+    Get the shipping rates of a quote key from the webservice, bypassing the cache, and store them in the cache if
+    successful. The key package shape is quoted in place of the original package.
+
+    Raises a ShippingRatesException if the webservice call fails.
+    """
+    def refresh(self, key):
+        rates = self.__fetch(key.origin, key.destination, key.shape, list(key.services))
+        if not rates.has_errors():
+            self.__store(key, rates)
+        return rates
+
+    """
+    Request the shipping rates in the background, returning a QuoteFuture that should be resolved with result(), or
+    with result_async() from an event loop.
+    """
+    def submit(self, origin, destination, package, services):
+        deadline = None if self._queue_timeout is None else time.monotonic() + self._queue_timeout
+        future = QuoteFuture((origin, destination, package, services), deadline)
+        self._executor.submit(contextvars.copy_context().run, self.__run, future)
+        return future
+
+    """
+    Wait for the shipping rates of a submitted quote, raising a ShippingRatesException on failures.
+
+    Running quotes are bounded by the timeout, and quotes still waiting for a free thread when their queue deadline
+    expires are cancelled and answered by expire().
+    """
+    def result(self, future):
+        try:
+            try:
+                return future.result(timeout=future.get_queue_wait())
+            except TimeoutError:
+                if not future.cancel():
+                    return future.result()
+            return self.__expire(future)
+        except ShippingRatesException:
+            raise
+        except Exception as e:
+            raise ShippingRatesException('An error occurred at try to get shipping rates from Correios webservice. An exception with message "{}" was caught'.format(str(e)))
+
+    """ Wait for the shipping rates of a submitted quote without blocking the running event loop, like result() """
+    async def result_async(self, future):
+        wrapped = asyncio.wrap_future(future)
+        try:
+            try:
+                return await asyncio.wait_for(asyncio.shield(wrapped), future.get_queue_wait())
+            except asyncio.TimeoutError:
+                if not future.cancel():
+                    return await wrapped
+            return self.__expire(future)
+        except ShippingRatesException:
+            raise
+        except Exception as e:
+            raise ShippingRatesException('An error occurred at try to get shipping rates from Correios webservice. An exception with message "{}" was caught'.format(str(e)))
+
+    """ Run a submitted quote in a pool thread, unless it was cancelled while waiting for it """
+    def __run(self, future):
+        if not future.set_running_or_notify_cancel():
+            return
+
+        try:
+            future.set_result(self.get_shipping_rates(*future.quote))
+        except BaseException as e:
+            future.set_exception(e)
+
+    """
+    Answer a quote that did not get a free thread within the queue timeout, from the cache when fresh, or else in
+    degraded mode, raising a ShippingRatesException if none of them can answer.
+    """
+    def __expire(self, future):
+        QUEUE_TIMEOUTS.inc()
+        origin, destination, package, services = future.quote
+
+        cached = self.__read(rate_cache_key(origin, destination, package, services))
+        if cached is not None and cached[0] >= time.time():
+            QUOTES.inc(source='cache')
+            return ShippingRateResult(origin, destination, package, cached[1])
+
+        message = 'No thread was free to get the shipping rates within {} seconds'.format(self._queue_timeout)
+        degraded = self.__degrade(origin, destination, package, services, cached)
+        if degraded is None:
+            raise ShippingRatesException(message)
+        self._logger.warn('Serving degraded shipping rates. {}'.format(message))
+        return degraded
+
+    """
+    Get the shipping rates from the webservice, through the circuit breaker.
+
+    The call runs in the current thread, or when hedging in the upstream thread pool, bounded by the timeout and hedged
+    with a duplicate call after hedge_after seconds. Exceptions, timeouts and responses with webservice unavailability
+    errors count as failures.
+    """
+    def __fetch(self, origin, destination, package, services):
+        if not self._breaker.allow():
+            CORREIOS_FAILURES.inc(reason='circuit_open')
+            raise ShippingRatesException('The circuit breaker of the Correios webservice is open')
+
+        def call():
+            with CORREIOS_SECONDS.time():
+                return self._client.get_shipping_rates(origin=origin, destination=destination, package=package, services=services)
+
+        if self._upstream is None:
+            try:
+                rates = call()
+            except requests.Timeout:
+                self.__record(False)
+                CORREIOS_FAILURES.inc(reason='timeout')
+                raise ShippingRatesException('The Correios webservice did not answer within {} seconds'.format(self._timeout))
+            except Exception as e:
+                self.__record(False)
+                CORREIOS_FAILURES.inc(reason='error')
+                raise ShippingRatesException('An error occurred at try to get shipping rates from Correios webservice. An exception with message "{}" was caught'.format(str(e)))
+            return self.__check(origin, destination, package, rates)
+
+        deadline = None if self._timeout is None else time.monotonic() + self._timeout
+        pending = set([self._upstream.submit(call)])
+        hedged = self._hedge_after is None
+        error = None
+
+        while pending:
+            wait_for = None if deadline is None else max(deadline - time.monotonic(), 0)
+            if not hedged:
+                wait_for = self._hedge_after if wait_for is None else min(wait_for, self._hedge_after)
+
+            done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    rates = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+
+                return self.__check(origin, destination, package, rates)
+
+            if not done and not hedged:
+                hedged = True
+                CORREIOS_HEDGES.inc()
+                pending.add(self._upstream.submit(call))
+            elif not done:
+                self.__record(False)
+                CORREIOS_FAILURES.inc(reason='timeout')
+                raise ShippingRatesException('The Correios webservice did not answer within {} seconds'.format(self._timeout))
+
+        self.__record(False)
+        CORREIOS_FAILURES.inc(reason='error')
+        raise ShippingRatesException('An error occurred at try to get shipping rates from Correios webservice. An exception with message "{}" was caught'.format(str(error)))
+
+    """ Check the rates of a webservice call for unavailability errors, recording its outcome in the circuit breaker """
+    def __check(self, origin, destination, package, rates):
+        if any(service.error_code in self.UNAVAILABLE_ERROR_CODES for service in rates.services):
+            self.__record(False)
+            CORREIOS_FAILURES.inc(reason='unavailable')
+            raise ShippingRatesException('The Correios webservice is unavailable')
+
+        self.__record(True)
+        return ShippingRateResult(origin, destination, package, tuple(RateQuote.from_service(service) for service in rates.services))
+
+    """ Record the outcome of a webservice call in the circuit breaker """
+    def __record(self, success):
+        if success:
+            self._breaker.record_success()
+        else:
+            self._breaker.record_failure()
+        CORREIOS_CIRCUIT_OPEN.set(0 if self._breaker.get_state() == CircuitBreaker.CLOSED else 1)
+
+    """ Get degraded shipping rates according to the degraded modes, or None if none of them can answer """
+    def __degrade(self, origin, destination, package, services, cached):
+        for mode in self._degraded_modes:
+            if mode == 'stale' and cached is not None:
+                QUOTES.inc(source='stale')
+                return ShippingRateResult(origin, destination, package, cached[1])
+            elif mode == 'flat' and all(service in self._flat_rates for service in services):
+                QUOTES.inc(source='flat')
+                return ShippingRateResult(origin, destination, package, tuple(
+                    RateQuote(service, self._flat_rates[service][0], self._flat_rates[service][1]) for service in services
+                ))
+        return None
+
+    """ Read the cache entry of a key, returning its fresh until timestamp and quotes, or None on misses """
+    def __read(self, key):
+        try:
+            cached = self._cache.get(key)
+        except Exception as e:
+            self._logger.warn('Failed to read shipping rates from cache. An exception with message "{}" was caught'.format(str(e)))
+            return None
+
+        return self.__decode(cached) if cached is not None else None
+
+    """ Store successful rates in the cache, kept for stale_ttl seconds after they expire """
+    def __store(self, key, rates):
+        try:
+            ttl = self._cache.get_ttl()
+            self._cache.set(key, self.__encode(time.time() + ttl, rates.services), ttl=ttl + self._stale_ttl)
+        except Exception as e:
+            self._logger.warn('Failed to write shipping rates to cache. An exception with message "{}" was caught'.format(str(e)))
+
+    """ Encode the quotes of a cache entry to its compact binary form """
+    def __encode(self, fresh_until, quotes):
+        return _FRESH_UNTIL.pack(fresh_until) + pack_quotes(quotes)
+
+    """ Decode a cache entry to its fresh until timestamp and quotes, or None if it is not in the binary form """
+    def __decode(self, value):
+        try:
+            return _FRESH_UNTIL.unpack_from(value)[0], unpack_quotes(value, _FRESH_UNTIL.size)
+        except (TypeError, struct.error, UnicodeDecodeError):
+            return None
+
+    """ Compare local rates with the webservice ones, logging any difference """
+    def __verify(self, rates, origin, destination, package, services):
+        try:
+            live_rates = self._client.get_shipping_rates(origin=origin, destination=destination, package=package, services=services)
+        except Exception as e:
+            self._logger.warn('Failed to verify local shipping rates. An exception with message "{}" was caught'.format(str(e)))
+            return
+
+        if live_rates.has_errors():
+            return
+
+        live_services = dict((service.code, service) for service in live_rates.services)
+        for service in rates.services:
+            live_service = live_services.get(service.code)
+            if live_service is not None and (abs(live_service.price - service.price) > 0.005 or live_service.days != service.days):
+                self._logger.warn('Local rate for service {} from {} to {} differs from the webservice: {} in {} days, expected {} in {} days'.format(
+                    service.code, origin, destination, service.price, service.days, live_service.price, live_service.days))
+
+"""
+Quote Future.
+
+The future of a quote submitted to ShippingRates, holding its (origin, destination, package, services) arguments and
+the monotonic deadline to start running, or None to wait for a free thread without limit.
+"""
+class QuoteFuture(Future):
+
+    quote = None
+    deadline = None
+
+    def __init__(self, quote, deadline = None):
+        Future.__init__(self)
+        self.quote = quote
+        self.deadline = deadline
+
+    """ Get the number of seconds left to wait for the quote to start running, or None without a deadline """
+    def get_queue_wait(self):
+        return None if self.deadline is None else max(self.deadline - time.monotonic(), 0)
+
+class ShippingRatesException(Exception):
+    pass
@@ -1,7 +1,24 @@
 # -*- coding: utf-8 -*-
+import copy
 import requests
 import json
+import random
+import time
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError
 from app.services.logger import Logger
+from app.services.metrics import registry
+
+REQUEST_SECONDS = registry.histogram('tiendanube_request_seconds', 'Time spent in TiendaNube API calls by operation', ['operation'])
+REQUEST_ERRORS = registry.counter('tiendanube_errors_total', 'Failed TiendaNube API calls by operation and status code', ['operation', 'status'])
+
+""" Create a keep-alive HTTP session with a connection pool of the given size, to be shared by TiendaNube instances """
+def create_session(pool_size = 10):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
 
 """ TiendaNube API Client """
 class TiendaNube(object):
@@ -15,6 +32,16 @@ class TiendaNube(object):
     _ACCESS_TOKEN = None
     _STORE_ID = None
 
+    RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+    IDEMPOTENT_METHODS = ('GET', 'PUT', 'DELETE')
+
+    _session = None
+    _timeout = None
+    _max_retries = None
+    _backoff_factor = None
+    _max_backoff = None
+    _rate_limiter = None
+
     _logger = None
 
     """
@@ -26,10 +53,15 @@ class TiendaNube(object):
     Also, you can specify a given access token and store ID to consume the API endpoints.
 
     The api_url and authorization_url parameters are optional, if nothing is supplied, it will use the default production values.
+
+    Requests are sent through a keep-alive session, that should be created with create_session() and shared by every
+    instance, so connections are reused between API calls. The timeout is a (connect, read) tuple in seconds, and failed
+    requests are retried up to max_retries times with exponential backoff and jitter, see __request() for details.
     """
-    def __init__(self, app_id, app_secret, access_token=None, store_id=None, api_url=None, authorization_url=None):
+    def __init__(self, app_id, app_secret, access_token=None, store_id=None, api_url=None, authorization_url=None,
+                 session=None, timeout=(3.05, 10), max_retries=3, backoff_factor=0.5, max_backoff=30):
         self._logger = Logger(self.__class__.__name__)
-        self._logger.info('TiendaNube instance was initiated with app_id %s and app_secret %s' % (app_id, app_secret))
+        self._logger.debug('TiendaNube instance was initiated with app_id %s' % (app_id))
         
         # setting up api urls
         self._API_URL = (self.PRODUCTION_API_URL if api_url is None else api_url) + '{}/{}'
@@ -43,6 +75,27 @@ class TiendaNube(object):
         self._ACCESS_TOKEN = access_token
         self._STORE_ID = store_id
 
+        # setting up http session and retry policy
+        self._session = create_session() if session is None else session
+        self._timeout = timeout
+        self._max_retries = max_retries
+        self._backoff_factor = backoff_factor
+        self._max_backoff = max_backoff
+
+    """
+    Get a client for a given store, sharing the credentials, session and retry policy of the current instance.
+
+    Store specific calls should be made through these instances instead of setting the access token and store ID of a
+    shared one, which would race with the other requests using it. When a rate_limiter (a TokenBucket) is supplied, every
+    request of the returned client waits for a token, keeping the calls to the store within its API rate limit.
+    """
+    def for_store(self, store_id, access_token, rate_limiter = None):
+        client = copy.copy(self)
+        client._STORE_ID = store_id
+        client._ACCESS_TOKEN = access_token
+        client._rate_limiter = rate_limiter
+        return client
+
     """ Set an access token to the current instance """
     def set_access_token(self, accessToken):
         self._ACCESS_TOKEN = accessToken
@@ -64,7 +117,7 @@ class TiendaNube(object):
             'code': authorization_code
         }
 
-        r = requests.post(self._AUTHORIZATION_URL,data=payload)
+        r = self.__request('authorize_with_code', 'POST', self._AUTHORIZATION_URL, data=payload)
 
         if r.status_code == requests.codes.ok:
             try:
@@ -81,7 +134,7 @@ class TiendaNube(object):
     def get_store(self):
         if not self.__is_ready():
             raise TiendaNubeException("An error occurred. Current TiendaNube instance does not have any valid access token and store ID")
-        r = requests.get(self.__get_url('store'), headers=self.__get_headers())
+        r = self.__request('get_store', 'GET', self.__get_url('store'), headers=self.__get_headers())
         if r.status_code == requests.codes.ok:
             return r.json()
         else:
@@ -95,7 +148,7 @@ class TiendaNube(object):
             raise TiendaNubeException("An error occurred. Current TiendaNube instance does not have any valid access token and store ID")
 
         payload = {'name': name, 'callback_url': callback_url, 'types': ','.join(supports)}
-        r = requests.post(self.__get_url('shipping_carriers'), json=payload, headers=self.__get_headers())
+        r = self.__request('create_shipping_carrier', 'POST', self.__get_url('shipping_carriers'), json=payload, headers=self.__get_headers())
 
         if r.status_code == requests.codes.created:
             j = r.json()
@@ -104,6 +157,35 @@ class TiendaNube(object):
         else:
             raise TiendaNubeException('An error occurre at try to create shipping carrier. Request got a response with {} code and "{}" body'.format(r.status_code,r.text))
 
+    """
+    Get the shipping carriers of the current store
+    """
+    def get_shipping_carriers(self):
+        if not self.__is_ready():
+            raise TiendaNubeException("An error occurred. Current TiendaNube instance does not have any valid access token and store ID")
+
+        r = self.__request('get_shipping_carriers', 'GET', self.__get_url('shipping_carriers'), headers=self.__get_headers())
+
+        if r.status_code == requests.codes.ok:
+            return r.json()
+        else:
+            raise TiendaNubeException('An error occurred at try to fetch the shipping carriers of store {}. Request got a response with {} status code and "{}" body'.format(self._STORE_ID,r.status_code,r.text))
+
+    """
+    Update the given fields (name, callback_url, types or active) of a shipping carrier in the current store
+    """
+    def update_shipping_carrier(self, carrier_id, **fields):
+        if not self.__is_ready():
+            raise TiendaNubeException("An error occurred. Current TiendaNube instance does not have any valid access token and store ID")
+
+        r = self.__request('update_shipping_carrier', 'PUT', self.__get_url('shipping_carriers/{}'.format(carrier_id)), json=fields, headers=self.__get_headers())
+
+        if r.status_code == requests.codes.ok:
+            self._logger.info('The shipping carrier with id {} was updated'.format(carrier_id))
+            return r.json()
+        else:
+            raise TiendaNubeException('An error occurred at try to update shipping carrier [{}]. Request got a response with {} status code and "{}" body'.format(carrier_id,r.status_code,r.text))
+
     """
     Delete a given shipping carrier from the current store
     """
@@ -111,7 +193,7 @@ class TiendaNube(object):
         if not self.__is_ready():
             raise TiendaNubeException("An error occurred. Current TiendaNube instance does not have any valid access token and store ID")
 
-        r = requests.delete(self.__get_url('shipping_carriers/{}'.format(carrier_id)), headers=self.__get_headers())
+        r = self.__request('delete_shipping_carrier', 'DELETE', self.__get_url('shipping_carriers/{}'.format(carrier_id)), headers=self.__get_headers())
         
         if r.status_code == requests.codes.ok:
             return True
@@ -126,7 +208,7 @@ class TiendaNube(object):
             raise TiendaNubeException("An error occurred. Current TiendaNube instance does not have any valid access token and store ID")
 
         payload = {'code': code, 'name': name, 'additional_days': additional_days, 'additional_cost': additional_cost, 'allow_free_shipping': allow_free_shipping}
-        r = requests.post(self.__get_url('shipping_carriers/{}/options'.format(carrier_id)), json=payload, headers=self.__get_headers())
+        r = self.__request('create_shipping_carrier_option', 'POST', self.__get_url('shipping_carriers/{}/options'.format(carrier_id)), json=payload, headers=self.__get_headers())
 
         if r.status_code == requests.codes.created:
             j = r.json()
@@ -135,6 +217,20 @@ class TiendaNube(object):
         else:
             raise TiendaNubeException('An error occurred at try to create shipping carrier option. Request result in a {} status code with a "{}" body'.format(r.status_code,r.text))
 
+    """
+    Get the options of a given shipping carrier in the current store
+    """
+    def get_shipping_carrier_options(self, carrier_id):
+        if not self.__is_ready():
+            raise TiendaNubeException("An error occurred. Current TiendaNube instance does not have any valid access token and store ID")
+
+        r = self.__request('get_shipping_carrier_options', 'GET', self.__get_url('shipping_carriers/{}/options'.format(carrier_id)), headers=self.__get_headers())
+
+        if r.status_code == requests.codes.ok:
+            return r.json()
+        else:
+            raise TiendaNubeException('An error occurred at try to fetch the options of shipping carrier [{}]. Request got a response with {} status code and "{}" body'.format(carrier_id,r.status_code,r.text))
+
     """
     Delete a given shipping carrier option from a shipping carrier in the current store
     """
@@ -142,13 +238,81 @@ class TiendaNube(object):
         if not self.__is_ready():
             raise TiendaNubeException("An error occurred. Current TiendaNube instance does not have any valid access token and store ID")
 
-        r = requests.delete(self.__get_url('shipping_carriers/{}/options/{}'.format(carrier_id, option_id)), headers=self.__get_headers())
+        r = self.__request('delete_shipping_carrier_option', 'DELETE', self.__get_url('shipping_carriers/{}/options/{}'.format(carrier_id, option_id)), headers=self.__get_headers())
 
         if r.status_code == requests.codes.ok:
             return True
         else:
             raise TiendaNubeException('An error occurred at try to delete shipping carrier option [{}]. Request got a response with {} status code and "{}" body'.format(option_id,r.status_code,r.text))
 
+    """ Send a request of a given API operation, recording its latency and errors """
+    def __request(self, operation, method, url, **kwargs):
+        with REQUEST_SECONDS.time(operation=operation):
+            try:
+                r = self.__send(method, url, **kwargs)
+            except TiendaNubeException:
+                REQUEST_ERRORS.inc(operation=operation, status='error')
+                raise
+
+        if r.status_code >= 400:
+            REQUEST_ERRORS.inc(operation=operation, status=r.status_code)
+        return r
+
+    """
+    Send a request through the shared session, retrying on failures.
+
+    Failures to connect and 429 responses are retried for every method, while other connection errors (like read
+    timeouts or resets, when the request may have reached the API) and 5xx responses are only retried for idempotent
+    methods, so a carrier or an option is never created twice and an authorization code is never sent twice. The wait
+    before each retry honors the Retry-After and x-rate-limit-reset headers when present, otherwise it grows
+    exponentially with full jitter.
+    """
+    def __send(self, method, url, **kwargs):
+        attempt = 0
+        while True:
+            if self._rate_limiter is not None:
+                self._rate_limiter.acquire()
+
+            try:
+                r = self._session.request(method, url, timeout=self._timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self._max_retries or (method not in self.IDEMPOTENT_METHODS and not self.__is_connect_error(e)):
+                    raise TiendaNubeException('An error occurred at try to send a {} request to {}. An exception with message "{}" was caught'.format(method,url,str(e)))
+                r = None
+
+            if r is not None:
+                retryable = r.status_code == 429 or (r.status_code in self.RETRY_STATUS_CODES and method in self.IDEMPOTENT_METHODS)
+                if not retryable or attempt >= self._max_retries:
+                    return r
+
+            delay = self.__get_retry_delay(r, attempt)
+            self._logger.warn('Retrying {} request to {} in {:.2f} seconds ({}/{})'.format(method,url,delay,attempt + 1,self._max_retries))
+            time.sleep(delay)
+            attempt += 1
+
+    """ Check if a request failed while establishing the connection, so it surely did not reach the API """
+    def __is_connect_error(self, error):
+        if isinstance(error, requests.ConnectTimeout):
+            return True
+
+        # requests wraps the urllib3 error, whose reason is the connection error (NewConnectionError is a ConnectTimeoutError)
+        reason = getattr(error.args[0], 'reason', None) if error.args else None
+        return isinstance(reason, ConnectTimeoutError)
+
+    """ Get the number of seconds to wait before retrying a request """
+    def __get_retry_delay(self, response, attempt):
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after is not None and retry_after.isdigit():
+                return min(float(retry_after), self._max_backoff)
+
+            # the rate limit reset header is expressed in milliseconds
+            reset = response.headers.get('x-rate-limit-reset')
+            if reset is not None and reset.isdigit():
+                return min(float(reset) / 1000, self._max_backoff)
+
+        return random.uniform(0, min(self._backoff_factor * (2 ** attempt), self._max_backoff))
+
     """ Check if the current instance is ready to consume the API"""
     def __is_ready(self):
         return True if self._ACCESS_TOKEN is not None and self._STORE_ID is not None else False
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import csv
+import os
+from datetime import date, timedelta
+
+HOLIDAYS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'resources', 'holidays.csv')
+
+"""
+Business Days Calendar.
+
+Counts business days skipping weekends (Saturday and Sunday by default) and the given holidays, so delivery dates
+match the business days deadlines returned by the Correios webservice.
+"""
+class BusinessCalendar(object):
+
+    _holidays = None
+    _weekend = None
+
+    def __init__(self, holidays = (), weekend = (5, 6)):
+        self._holidays = frozenset(holidays)
+        self._weekend = frozenset(weekend)
+
+    """ Check if a date is a business day """
+    def is_business_day(self, day):
+        return day.weekday() not in self._weekend and day not in self._holidays
+
+    """ Get the date after a given number of business days, counted from the next day on """
+    def add_business_days(self, day, days):
+        while days > 0:
+            day += timedelta(1)
+            if self.is_business_day(day):
+                days -= 1
+        return day
+
+"""
+Load the holidays from a CSV file with a date,description row per holiday, with dates in the YYYY-MM-DD format.
+
+Lines starting with # are ignored, and the bundled holidays are loaded when no path (or an empty one) is given.
+"""
+def load_holidays(path = None):
+    path = path or HOLIDAYS_PATH
+    with open(path, newline='') as f:
+        return [date.fromisoformat(row[0].strip()) for row in csv.reader(f) if row and row[0].strip() and not row[0].startswith('#')]
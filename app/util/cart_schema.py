@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import math
+import re
+
+from app import config
+from app.models.quote import Cart, CartItem
+
+POSTAL_CODE = re.compile(r'^\d{5}-?\d{3}$')
+
+"""
+Validate a shipping options body against the cart schema:
+
+    {
+        "origin": {"postal_code": str},
+        "destination": {"postal_code": str},
+        "items": [
+            {
+                "quantity": int >= 0,
+                "grams": number > 0,
+                "dimensions": {"height": number > 0, "width": number > 0, "depth": number > 0},
+                "free_shipping": bool (optional)
+            },
+            ...
+        ]
+    }
+
+Returns the Cart of a valid body, with its items as CartItem instances, raising a CartSchemaException with the path of
+the first invalid field otherwise. Weights are kept as given, so fractional grams are never truncated to zero. This only
+checks types and ranges, so it is cheap enough to run before any package is built or any webservice is called. Other
+fields are ignored.
+"""
+def validate_cart(body):
+    if not isinstance(body, dict):
+        raise CartSchemaException('The body must be a JSON object')
+
+    origin = _validate_postal_code(body, 'origin')
+    destination = _validate_postal_code(body, 'destination')
+
+    items = body.get('items')
+    if not isinstance(items, list) or not items:
+        raise CartSchemaException('The items field must be a non empty list')
+    if len(items) > config.OPTION_MAX_ITEMS:
+        raise CartSchemaException('The cart cannot have more than {} items'.format(config.OPTION_MAX_ITEMS))
+
+    return Cart(origin, destination, tuple(_validate_item(item, index) for index, item in enumerate(items)))
+
+def _validate_postal_code(body, field):
+    address = body.get(field)
+    postal_code = address.get('postal_code') if isinstance(address, dict) else None
+    if not isinstance(postal_code, str) or not POSTAL_CODE.match(postal_code):
+        raise CartSchemaException('The {}.postal_code field must be a postal code with 8 digits'.format(field))
+    return postal_code
+
+def _validate_item(item, index):
+    if not isinstance(item, dict):
+        raise CartSchemaException('The items[{}] field must be an object'.format(index))
+
+    quantity = item.get('quantity')
+    if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 0:
+        raise CartSchemaException('The items[{}].quantity field must be a non negative integer'.format(index))
+
+    grams = item.get('grams')
+    if not _is_positive(grams):
+        raise CartSchemaException('The items[{}].grams field must be a positive number'.format(index))
+
+    dimensions = item.get('dimensions')
+    if not isinstance(dimensions, dict):
+        raise CartSchemaException('The items[{}].dimensions field must be an object'.format(index))
+
+    height, width, depth = dimensions.get('height'), dimensions.get('width'), dimensions.get('depth')
+    for dimension, value in (('height', height), ('width', width), ('depth', depth)):
+        if not _is_positive(value):
+            raise CartSchemaException('The items[{}].dimensions.{} field must be a positive number'.format(index, dimension))
+
+    free_shipping = item.get('free_shipping')
+    if free_shipping is not None and not isinstance(free_shipping, bool):
+        raise CartSchemaException('The items[{}].free_shipping field must be a boolean'.format(index))
+
+    return CartItem(float(height), float(width), float(depth), float(grams), quantity, free_shipping is True)
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _is_positive(value):
+    return _is_number(value) and 0 < value < math.inf
+
+class CartSchemaException(Exception):
+    pass
@@ -1,44 +1,222 @@
 # -*- coding: utf-8 -*-
-from correios import Correios
+import re
+import requests
+import xml.etree.ElementTree
+from correios import Correios, ShippingRateResult
+from correios.package import BoxPackage
+from requests.adapters import HTTPAdapter
 from app import config
+from app.models.quote import CartItem, RateQuote
+from app.util.business_days import BusinessCalendar, load_holidays
 from datetime import datetime, timedelta
 from pytz import timezone
 
-# map from service code to label
-service_code_to_label = {}
-service_code_to_label[config.OPTION_PAC_SERVICE] = config.OPTION_PAC_NAME
-service_code_to_label[config.OPTION_SEDEX_SERVICE] = config.OPTION_SEDEX_NAME
+"""
+Box package that aggregates its items by line instead of by unit.
 
-# map from service code to code
-service_code_to_code = {}
-service_code_to_code[config.OPTION_PAC_SERVICE] = config.OPTION_PAC_CODE
-service_code_to_code[config.OPTION_SEDEX_SERVICE] = config.OPTION_SEDEX_CODE
+Each add_item call stores a single line with the item dimensions (already sorted), weight and quantity, so building the
+package and computing its dimensions, weight and validity costs proportionally to the number of distinct line items
+instead of the total number of units. The api_format() result is the same of a BoxPackage with every unit added one by
+one, and it is memoized until another item is added.
+"""
+class BulkBoxPackage(BoxPackage):
 
-# reduce a request item to a package item
+    def __init__(self):
+        BoxPackage.__init__(self)
+        self.lines = []
+        self._api_format = None
+
+    def add_item(self, height, width, depth, weight, quantity = 1):
+        if quantity <= 0:
+            return
+        elif (height <= 0.0):
+            raise Exception('The height parameter cannot be zero, please specify a value greater than zero')
+        elif (width <= 0.0):
+            raise Exception('The width parameter cannot be zero, please specify a value greater than zero')
+        elif (depth <= 0.0):
+            raise Exception('The depth parameter cannot be zero, please specify a value greater than zero')
+        elif (weight <= 0.0):
+            raise Exception('The weight parameter cannot be zero, please specify a value greater than zero')
+
+        height, width, depth = sorted([float(height), float(width), float(depth)])
+        self.lines.append((height, width, depth, float(weight), int(quantity)))
+        self._api_format = None
+
+    def has_items(self):
+        return True if len(self.lines) > 0 else False
+
+    def get_weight(self):
+        weight = sum(line[3] * line[4] for line in self.lines)
+        return weight if weight >= self.MIN_WEIGHT else self.MIN_WEIGHT
+
+    def get_dimensions(self):
+        shadow = {
+            'height': max([line[0] for line in self.lines] + [self.MIN_HEIGHT]),
+            'width': max([line[1] for line in self.lines] + [self.MIN_WIDTH]),
+            'depth': max([line[2] for line in self.lines] + [self.MIN_DEPTH])
+        }
+
+        # stacking every unit over the smallest side of the shadow
+        dimension = [k for k,v in shadow.items() if v==min(shadow.values())][0]
+        index = ('height', 'width', 'depth').index(dimension)
+        accumulator = sum(line[index] * line[4] for line in self.lines)
+        shadow[dimension] = accumulator if accumulator > shadow[dimension] else shadow[dimension]
+
+        return (shadow['height'],shadow['width'],shadow['depth'])
+
+    def api_format(self):
+        if self._api_format is None:
+            self._api_format = BoxPackage.api_format(self)
+        return dict(self._api_format)
+
+# reduce a request item (a CartItem or an item of the request body) to a package item
 def item_to_package_item(package, item):
-    dimensions = item.get('dimensions')
-    quantity = item.get('quantity')
-    for n in range(quantity):
-        package.add_item(float(dimensions.get('height')),float(dimensions.get('width')),float(dimensions.get('depth')), int(item.get('grams')) / 1000)
+    if isinstance(item, CartItem):
+        height, width, depth, weight, quantity = item.height, item.width, item.depth, item.grams / 1000, item.quantity
+    else:
+        dimensions = item.get('dimensions')
+        quantity = item.get('quantity')
+        height, width, depth = float(dimensions.get('height')), float(dimensions.get('width')), float(dimensions.get('depth'))
+        weight = float(item.get('grams')) / 1000
+
+    if isinstance(package, BulkBoxPackage):
+        package.add_item(height, width, depth, weight, quantity)
+    else:
+        for n in range(quantity):
+            package.add_item(height, width, depth, weight)
     return package
 
-# convert a correios result service to the shipping option format
-def rate_to_shipping_option(rates, free_shipping_cart = False):
-    merchant_rate, consumer_rate = rates
-    print('PRICE MERCHANT => {}'.format(merchant_rate.price))
-    print('PRICE CONSUMER => {}'.format(consumer_rate.price))
-    name = 'CorreiosApp - {}'.format(service_code_to_label.get(merchant_rate.code, 'Unknown Option'))
-    code = service_code_to_code.get(merchant_rate.code,'unknown')
-    tz = timezone(config.OPTION_TIMEZONE)
-    eta = datetime.now(tz) + timedelta(merchant_rate.days)
-    return {
-        'name': name,
-        'code': code,
-        'price': float(consumer_rate.price) if not free_shipping_cart else 0.0,
-        'price_merchant': float(merchant_rate.price),
-        'type': config.OPTION_TYPE,
-        'currency': config.OPTION_CURRENCY,
-        'min_delivery_date': eta.isoformat(timespec='seconds'),
-        'max_delivery_date': eta.isoformat(timespec='seconds')
-    }
+"""
+Correios Client.
+
+Sends the shipping rate requests of the Correios SDK client through a pooled session, bounded by timeout seconds to
+connect and to read the response, so a call can run in the thread asking for it without risking to hang it. The results
+have RateQuote services.
+"""
+class CorreiosClient(Correios):
+
+    _session = None
+    _timeout = None
+
+    def __init__(self, timeout = None, pool_size = 10):
+        Correios.__init__(self)
+        self._timeout = timeout
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+
+    def get_shipping_rates(self, origin, destination, package, services, in_hands = False, declared_value = False, delivery_notification = False):
+        payload = {
+            'sCepOrigem': re.sub(r'\D', '', origin),
+            'sCepDestino': re.sub(r'\D', '', destination),
+            'nCdServico': ','.join(services),
+            'sCdMaoPropria': 'S' if in_hands else 'N',
+            'nVlValorDeclarado': float(declared_value) if declared_value else 0.0,
+            'sCdAvisoRecebimento': 'S' if delivery_notification else 'N',
+            'StrRetorno': 'XML'
+        }
+        if self.credentials is not None:
+            payload.update({'nCdEmpresa': self.credentials.user, 'sDsSenha': self.credentials.password})
+        payload.update(package.api_format())
+
+        response = self._session.get(self.API_SHIPPING_RATE_ENDPOINT, params=payload, timeout=self._timeout)
+        root = xml.etree.ElementTree.fromstring(response.text)
+        return ShippingRateResult(origin, destination, package, [RateQuote(
+            service.findtext('Codigo'),
+            parse_decimal(service.findtext('Valor') or '0'),
+            int(service.findtext('PrazoEntrega') or 0),
+            int(service.findtext('Erro') or 0),
+            service.findtext('MsgErro')
+        ) for service in root.findall('cServico')])
+
+""" Parse a decimal in the Correios format, like "1.234,56" """
+def parse_decimal(value):
+    return float(value.replace('.', '').replace(',', '.'))
+
+"""
+Shipping Option Formatter.
+
+Converts Correios result services to the TiendaNube shipping option format. The fields that only depend on the service
+(name, code, type and currency) are built once per service in the constructor, and the current time is taken once per
+quote, so formatting a response costs a dict copy and two lookups per service.
+
+Delivery dates are counted in business days of the given calendar, as the Correios deadlines are: the minimum delivery
+date is the Correios deadline, and the maximum one is margin_days business days later.
+"""
+class ShippingOptionFormatter(object):
+
+    _timezone = None
+    _calendar = None
+    _margin_days = None
+    _services = None
+    _unknown = None
+    _offsets = None
+
+    def __init__(self, calendar = None, margin_days = 0, tz = None):
+        self._timezone = timezone(config.OPTION_TIMEZONE if tz is None else tz)
+        self._calendar = BusinessCalendar() if calendar is None else calendar
+        self._margin_days = margin_days
+        self._services = {
+            config.OPTION_PAC_SERVICE: self.__build_constants(config.OPTION_PAC_NAME, config.OPTION_PAC_CODE),
+            config.OPTION_SEDEX_SERVICE: self.__build_constants(config.OPTION_SEDEX_NAME, config.OPTION_SEDEX_CODE)
+        }
+        self._unknown = self.__build_constants('Unknown Option', 'unknown')
+        self._offsets = (None, {})
+
+    """ Get the current time in the shipping options timezone """
+    def now(self):
+        return datetime.now(self._timezone)
+
+    """
+    Convert pairs of merchant and consumer rates of the same service to shipping options, using the same current time
+    for every option.
+    """
+    def format(self, rates, free_shipping_cart = False, now = None):
+        now = self.now() if now is None else now
+        dates = {}
+        options = []
+        for merchant_rate, consumer_rate in rates:
+            option = dict(self._services.get(merchant_rate.code, self._unknown))
+            option['price'] = float(consumer_rate.price) if not free_shipping_cart else 0.0
+            option['price_merchant'] = float(merchant_rate.price)
+
+            if merchant_rate.days not in dates:
+                dates[merchant_rate.days] = self.__get_delivery_dates(now, merchant_rate.days)
+            option['min_delivery_date'], option['max_delivery_date'] = dates[merchant_rate.days]
+            options.append(option)
+        return options
+
+    """ Get the minimum and maximum delivery dates, in the ISO format, for a deadline in business days """
+    def __get_delivery_dates(self, now, days):
+        min_offset, max_offset = self.__get_offsets(now.date(), int(days))
+        return (
+            self._timezone.normalize(now + min_offset).isoformat(timespec='seconds'),
+            self._timezone.normalize(now + max_offset).isoformat(timespec='seconds')
+        )
+
+    """ Get the calendar offsets of a deadline in business days, memoized for the current day """
+    def __get_offsets(self, today, days):
+        day, offsets = self._offsets
+        if day != today:
+            offsets = {}
+            self._offsets = (today, offsets)
+
+        if days not in offsets:
+            min_date = self._calendar.add_business_days(today, days)
+            max_date = self._calendar.add_business_days(min_date, self._margin_days)
+            offsets[days] = (min_date - today, max_date - today)
+        return offsets[days]
+
+    def __build_constants(self, label, code):
+        return {
+            'name': 'CorreiosApp - {}'.format(label),
+            'code': code,
+            'type': config.OPTION_TYPE,
+            'currency': config.OPTION_CURRENCY
+        }
 
+""" Create a shipping option formatter with the configured holidays calendar and delivery margin """
+def create_shipping_option_formatter():
+    calendar = BusinessCalendar(load_holidays(config.OPTION_HOLIDAYS_PATH))
+    return ShippingOptionFormatter(calendar, margin_days=config.OPTION_DELIVERY_MARGIN_DAYS)
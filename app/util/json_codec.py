@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+import json
+
+"""
+JSON codec of the request and response hot path.
+
+Uses orjson when it is installed, which parses and serializes several times faster than the standard library, and falls
+back to the json module otherwise. Both backends take str or bytes and return bytes, so callers do not depend on which
+one is in use.
+"""
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = 'orjson' if orjson is not None else 'json'
+
+# raised by loads on invalid documents, for both backends (orjson.JSONDecodeError is a ValueError subclass)
+DecodeError = ValueError
+
+if orjson is not None:
+
+    def loads(data):
+        return orjson.loads(data)
+
+    def dumps(obj):
+        return orjson.dumps(obj)
+
+else:
+
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+    def loads(data):
+        return json.loads(data)
+
+    def dumps(obj):
+        return _encoder.encode(obj).encode('utf-8')
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import json
+
+"""
+Save benchmark results to a baseline file.
+
+Results are a dict of benchmark name to a dict of metrics, like {'options': {'p95': 0.012, 'throughput': 850.0}}.
+"""
+def save_baseline(path, results):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+""" Load benchmark results from a baseline file """
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)
+
+"""
+Compare benchmark results with a baseline, returning the list of regressions as human readable messages.
+
+Metrics named in higher_is_better (like throughput) regress when they drop more than tolerance (a fraction), every
+other metric (like latencies) regresses when it grows more than tolerance.
+"""
+def compare_baseline(baseline, results, tolerance = 0.1, higher_is_better = ('throughput', 'ops')):
+    regressions = []
+    for name, metrics in sorted(results.items()):
+        for metric, value in sorted(metrics.items()):
+            expected = baseline.get(name, {}).get(metric)
+            if not expected:
+                continue
+
+            change = (value - expected) / expected
+            if metric in higher_is_better:
+                change = -change
+
+            if change > tolerance:
+                regressions.append('{} {}: {:.6g} against a baseline of {:.6g} ({:+.1%})'.format(name, metric, value, expected, change))
+    return regressions
+
+""" Print a comparison against a baseline and return the process exit code """
+def report_comparison(path, results, tolerance):
+    regressions = compare_baseline(load_baseline(path), results, tolerance)
+    for regression in regressions:
+        print('REGRESSION {}'.format(regression))
+
+    if regressions:
+        return 1
+
+    print('No regressions against {} (tolerance {:.0%})'.format(path, tolerance))
+    return 0
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import redirect_stdout
+
+from benchmarks.baseline import save_baseline, report_comparison
+from benchmarks.micro import build_cart
+from benchmarks.stubs import CorreiosStubHandler, TiendaNubeStubHandler, StubConnectionPool, start_stub_server
+
+"""
+End-to-end load harness of the options and install routes.
+
+The app runs in-process, served by a threaded WSGI server, with the Correios webservice, the TiendaNube API and the
+database replaced by local stubs with configurable latencies. Each route is driven by a number of concurrent clients and
+its throughput and p50/p95/p99 latencies are reported.
+
+    python -m benchmarks.load [--concurrency 16] [--requests 2000] [--correios-latency 0.1] [--compare FILE]
+"""
+
+""" Start the stubs and the app, returning the app base URL """
+def start_app(args):
+    correios_server, correios_url = start_stub_server(CorreiosStubHandler, args.correios_latency)
+    tn_server, tn_url = start_stub_server(TiendaNubeStubHandler, args.tiendanube_latency)
+
+    # app settings must be in place before the app is imported
+    from app import config
+    config.TIENDANUBE_API_URL = tn_url + '/v1/'
+    config.TIENDANUBE_AUTHORIZATION_URL = tn_url + '/apps/authorize/token'
+    config.RATE_CACHE_BACKEND = args.rate_cache
+    # provisioning jobs of the stub stores must not reach the queue of a real app running in the same host
+    config.JOB_QUEUE_BACKEND = 'memory'
+
+    from correios import Correios
+    Correios.API_SHIPPING_RATE_ENDPOINT = correios_url + '/calculador/CalcPrecoPrazo.aspx'
+
+    import app.database
+    StubConnectionPool.latency = args.db_latency
+    app.database.MySQLConnectionPool = StubConnectionPool
+
+    from werkzeug.serving import make_server
+    from app.main import create_app
+    server = make_server('127.0.0.1', 0, create_app(), threaded=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return 'http://127.0.0.1:{}'.format(server.server_port)
+
+""" Get the value at a given percentile of a sorted list """
+def percentile(values, p):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+""" Drive a route with concurrent clients, returning its metrics """
+def run_load(send, total, concurrency):
+    import requests
+
+    latencies = []
+    errors = [0]
+    counter = [0]
+    lock = threading.Lock()
+
+    def worker():
+        session = requests.Session()
+        while True:
+            with lock:
+                if counter[0] >= total:
+                    return
+                n = counter[0]
+                counter[0] += 1
+
+            start = time.perf_counter()
+            try:
+                ok = send(session, n)
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - start
+
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    errors[0] += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'throughput': len(latencies) / duration,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'errors': errors[0]
+    }
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Load harness of the options and install routes')
+    parser.add_argument('--routes', default='options,install', help='comma separated routes to drive (default options,install)')
+    parser.add_argument('--concurrency', type=int, default=16, help='concurrent clients (default 16)')
+    parser.add_argument('--requests', type=int, default=2000, help='requests per route (default 2000)')
+    parser.add_argument('--destinations', type=int, default=100, help='distinct destination postal codes (default 100)')
+    parser.add_argument('--correios-latency', type=float, default=0.1, help='Correios stub latency in seconds (default 0.1)')
+    parser.add_argument('--tiendanube-latency', type=float, default=0.05, help='TiendaNube stub latency in seconds (default 0.05)')
+    parser.add_argument('--db-latency', type=float, default=0.001, help='database stub latency in seconds (default 0.001)')
+    parser.add_argument('--rate-cache', default='none', help='rate cache backend (default none)')
+    parser.add_argument('--verbose', action='store_true', help='keep the app logs')
+    parser.add_argument('--save-baseline', metavar='FILE', help='save the results as a baseline')
+    parser.add_argument('--compare', metavar='FILE', help='compare the results with a saved baseline')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed regression, as a fraction (default 0.1)')
+    args = parser.parse_args(argv)
+
+    def send_options(session, n):
+        body = {
+            'origin': {'postal_code': '01001000'},
+            'destination': {'postal_code': '{:08d}'.format(20000000 + n % args.destinations)},
+            'items': build_cart(3)
+        }
+        return session.post(base_url + '/nuvemshop/options', json=body).status_code == 200
+
+    def send_install(session, n):
+        return session.get(base_url + '/nuvemshop/install', params={'code': 'stub-code-{}'.format(n)}, allow_redirects=False).status_code == 302
+
+    senders = {'options': send_options, 'install': send_install}
+    results = {}
+
+    with open(os.devnull, 'w') as devnull:
+        if not args.verbose:
+            logging.disable(logging.CRITICAL)
+
+        with redirect_stdout(sys.stdout if args.verbose else devnull):
+            base_url = start_app(args)
+            for route in args.routes.split(','):
+                results[route] = run_load(senders[route], args.requests, args.concurrency)
+
+    for route, metrics in sorted(results.items()):
+        print('{:<10} {:>10.1f} req/s  p50 {:>8.1f} ms  p95 {:>8.1f} ms  p99 {:>8.1f} ms  {} errors'.format(
+            route, metrics['throughput'], metrics['p50'] * 1000, metrics['p95'] * 1000, metrics['p99'] * 1000, metrics['errors']))
+
+    if args.save_baseline:
+        save_baseline(args.save_baseline, results)
+    if args.compare:
+        return report_comparison(args.compare, results, args.tolerance)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
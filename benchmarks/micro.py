@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import argparse
+import sys
+import timeit
+from functools import reduce
+
+from app.models.quote import CartItem, QuoteKey, RateQuote, pack_quotes, unpack_quotes
+from app.services.quote_warmer import QuoteHistory
+from app.util import json_codec
+from app.util.cart_schema import validate_cart
+from app.util.correios import BulkBoxPackage, item_to_package_item, create_shipping_option_formatter
+from benchmarks.baseline import save_baseline, report_comparison
+
+"""
+Micro-benchmarks of the options route building blocks over realistic cart sizes.
+
+    python -m benchmarks.micro [--save-baseline FILE] [--compare FILE] [--tolerance 0.1]
+"""
+
+CART_SIZES = (1, 5, 50, 500)
+
+""" Build a cart with a given number of line items, with 1 to 3 units each """
+def build_cart(size):
+    return [{
+        'quantity': 1 + (i % 3),
+        'grams': 100 + (i % 7) * 50,
+        'free_shipping': i % 4 == 0,
+        'dimensions': {'height': 1 + (i % 5), 'width': 11 + (i % 3), 'depth': 16 + (i % 2)}
+    } for i in range(size)]
+
+""" Run a callable and return its best mean time per call, in seconds """
+def measure(fn, repeat = 5):
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of the shipping options building blocks')
+    parser.add_argument('--save-baseline', metavar='FILE', help='save the results as a baseline')
+    parser.add_argument('--compare', metavar='FILE', help='compare the results with a saved baseline')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed regression, as a fraction (default 0.1)')
+    args = parser.parse_args(argv)
+
+    results = {}
+    merchant_rate = RateQuote('04510', 23.5, 6)
+    consumer_rate = RateQuote('04510', 18.9, 6)
+
+    for size in CART_SIZES:
+        cart = [CartItem.from_dict(item) for item in build_cart(size)]
+        results['item_to_package_item[{}]'.format(size)] = {'seconds': measure(lambda: reduce(item_to_package_item, cart, BulkBoxPackage()))}
+
+    # a small cart only, since bigger ones exceed the Correios size and weight limits
+    cart = [CartItem.from_dict(item) for item in build_cart(5)]
+    results['api_format[5]'] = {'seconds': measure(lambda: reduce(item_to_package_item, cart, BulkBoxPackage()).api_format())}
+
+    formatter = create_shipping_option_formatter()
+    results['rate_to_shipping_option'] = {'seconds': measure(lambda: formatter.format([(merchant_rate, consumer_rate)]))}
+    options = formatter.format([(merchant_rate, consumer_rate)] * 2)
+    quotes = (merchant_rate, RateQuote('04014', 41.2, 2))
+    packed = pack_quotes(quotes)
+    results['pack_quotes'] = {'seconds': measure(lambda: pack_quotes(quotes))}
+    results['unpack_quotes'] = {'seconds': measure(lambda: unpack_quotes(packed))}
+    results['json_serialization'] = {'seconds': measure(lambda: json_codec.dumps({'rates': options}))}
+
+    history = QuoteHistory()
+    key = QuoteKey.build('01001-000', '20000-000', reduce(item_to_package_item, cart, BulkBoxPackage()), ['04510', '04014'])
+    results['quote_history_record'] = {'seconds': measure(lambda: history.record(key))}
+
+    for size in (5, 50):
+        body = json_codec.dumps({'origin': {'postal_code': '01001-000'}, 'destination': {'postal_code': '20000-000'}, 'items': build_cart(size)})
+        results['parse_and_validate[{}]'.format(size)] = {'seconds': measure(lambda: validate_cart(json_codec.loads(body)))}
+
+    for name, metrics in sorted(results.items()):
+        seconds = metrics['seconds']
+        metrics['ops'] = 1 / seconds
+        print('{:<32} {:>12.2f} us/op {:>14.0f} ops/s'.format(name, seconds * 1e6, metrics['ops']))
+
+    if args.save_baseline:
+        save_baseline(args.save_baseline, results)
+    if args.compare:
+        return report_comparison(args.compare, results, args.tolerance)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from benchmarks.baseline import save_baseline, report_comparison
+
+"""
+Startup time benchmark of the sync (Flask) and async (ASGI) apps.
+
+Every run starts a fresh interpreter, like a new worker, and measures the time to import and create the app, and then
+the time until its readiness route answers, which builds the worker services. The database is replaced by a stub that
+never answers, so the startup must not depend on it.
+
+    python -m benchmarks.startup [--runs 5] [--save-baseline FILE] [--compare FILE] [--tolerance 0.1]
+"""
+
+# measured in the child interpreter, printing its timings as JSON
+CHILD = '''
+import json, time, logging
+started_at = time.perf_counter()
+
+import app.database
+from benchmarks.stubs import UnavailableConnectionPool
+app.database.MySQLConnectionPool = UnavailableConnectionPool
+logging.disable(logging.CRITICAL)
+
+if {asgi!r}:
+    import asyncio
+    from app.asgi import application, health_ready
+    created_at = time.perf_counter()
+    statuses = []
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            statuses.append(message['status'])
+    asyncio.run(health_ready(send))
+    status = statuses[0]
+else:
+    from app.main import create_app
+    flask_app = create_app()
+    created_at = time.perf_counter()
+    status = flask_app.test_client().get('/health/ready').status_code
+
+print(json.dumps({{'create': created_at - started_at, 'ready': time.perf_counter() - started_at, 'status': status}}))
+'''
+
+""" Start the app in a fresh interpreter, returning its timings """
+def measure_startup(asgi):
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD.format(asgi=asgi)], env=env, check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    ).stdout
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Startup time benchmark of the sync and async apps')
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters started per app (default 5)')
+    parser.add_argument('--save-baseline', metavar='FILE', help='save the results as a baseline')
+    parser.add_argument('--compare', metavar='FILE', help='compare the results with a saved baseline')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed regression, as a fraction (default 0.1)')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, asgi in (('flask', False), ('asgi', True)):
+        runs = [measure_startup(asgi) for n in range(args.runs)]
+        not_ready = [run['status'] for run in runs if run['status'] != 200]
+        if not_ready:
+            print('{} readiness answered {}'.format(name, not_ready[0]))
+            return 1
+
+        results[name] = {
+            'create': min(run['create'] for run in runs),
+            'ready': min(run['ready'] for run in runs)
+        }
+
+    for name, metrics in sorted(results.items()):
+        print('{:<10} create {:>8.1f} ms  ready {:>8.1f} ms'.format(name, metrics['create'] * 1000, metrics['ready'] * 1000))
+
+    if args.save_baseline:
+        save_baseline(args.save_baseline, results)
+    if args.compare:
+        return report_comparison(args.compare, results, args.tolerance)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
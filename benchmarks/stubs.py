@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+"""
+Local stub servers standing in for the Correios webservice, the TiendaNube API and the database, used by the load
+harness so the app can be measured without any external dependency.
+"""
+
+CORREIOS_SERVICE_XML = (
+    '<cServico><Codigo>{code}</Codigo><Valor>{price}</Valor><PrazoEntrega>{days}</PrazoEntrega>'
+    '<ValorMaoPropria>0,00</ValorMaoPropria><ValorAvisoRecebimento>0,00</ValorAvisoRecebimento>'
+    '<ValorValorDeclarado>0,00</ValorValorDeclarado><EntregaDomiciliar>S</EntregaDomiciliar>'
+    '<EntregaSabado>N</EntregaSabado><Erro>0</Erro><MsgErro></MsgErro><obsFim></obsFim></cServico>'
+)
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+""" Base handler of the stub servers, answering after a configurable latency and without logging """
+class StubHandler(BaseHTTPRequestHandler):
+
+    latency = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def respond(self, status, body, content_type = 'application/json'):
+        time.sleep(self.latency)
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+""" Correios webservice stub, pricing every requested service by the package weight """
+class CorreiosStubHandler(StubHandler):
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        weight = float(query.get('nVlPeso', ['1'])[0])
+        services = ''.join(CORREIOS_SERVICE_XML.format(code=code, price='{:.2f}'.format(15 + weight * 3 + i * 10).replace('.', ','), days=2 + i * 3)
+                           for i, code in enumerate(query.get('nCdServico', [''])[0].split(',')))
+        self.respond(200, '<Servicos>{}</Servicos>'.format(services), 'text/xml')
+
+""" TiendaNube API stub, answering the authorization, store and shipping carrier endpoints """
+class TiendaNubeStubHandler(StubHandler):
+
+    def do_POST(self):
+        self.read_body()
+        if self.path.endswith('/authorize/token'):
+            self.respond(200, json.dumps({'access_token': 'stub-token', 'user_id': 1000 + threading.get_ident() % 1000}))
+        elif re.search(r'/shipping_carriers/\d+/options$', self.path):
+            self.respond(201, json.dumps({'id': 2}))
+        elif self.path.endswith('/shipping_carriers'):
+            self.respond(201, json.dumps({'id': 1}))
+        else:
+            self.respond(404, '{}')
+
+    def do_GET(self):
+        if self.path.endswith('/store'):
+            self.respond(200, json.dumps({'id': 1, 'original_domain': 'stub.example.com'}))
+        elif self.path.endswith('/shipping_carriers') or self.path.endswith('/options'):
+            self.respond(200, '[]')
+        else:
+            self.respond(404, '{}')
+
+    def do_PUT(self):
+        self.read_body()
+        self.respond(200, '{}')
+
+    def do_DELETE(self):
+        self.respond(200, '{}')
+
+""" Start a stub server in a background thread, returning the server and its base URL """
+def start_stub_server(handler, latency = 0.0):
+    handler = type(handler.__name__, (handler,), {'latency': latency})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+"""
+Database stub, replacing mysql.connector's MySQLConnectionPool with an in-memory stores table that understands the
+queries issued by StoreTokenRepository.
+"""
+class StubConnectionPool(object):
+
+    stores = {}
+    lock = threading.Lock()
+    latency = 0.0
+
+    def __init__(self, **kwargs):
+        pass
+
+    def get_connection(self):
+        return StubConnection()
+
+""" Database stub of an unavailable server, failing to open any connection """
+class UnavailableConnectionPool(object):
+
+    def __init__(self, **kwargs):
+        from mysql.connector.errors import InterfaceError
+        raise InterfaceError('Can\'t connect to MySQL server (stub of an unavailable database)')
+
+class StubConnection(object):
+
+    def is_connected(self):
+        return True
+
+    def cursor(self, *args, **kwargs):
+        return StubCursor()
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+class StubCursor(object):
+
+    rowcount = 0
+    _rows = None
+
+    def execute(self, query, params = ()):
+        time.sleep(StubConnectionPool.latency)
+        with StubConnectionPool.lock:
+            if query.startswith('INSERT INTO `stores`'):
+                StubConnectionPool.stores[str(params[0])] = params[1]
+                self.rowcount = 1
+            elif query.startswith('SELECT `store_id`, `access_token` FROM `stores` WHERE `store_id`>'):
+                after, limit = params
+                self._rows = sorted((int(store), token) for store, token in StubConnectionPool.stores.items() if int(store) > after)[:limit]
+            elif query.startswith('SELECT `store_id`, `access_token` FROM `stores` WHERE'):
+                token = StubConnectionPool.stores.get(str(params[0]))
+                self._rows = [(int(params[0]), token)] if token is not None else []
+            elif query.startswith('SELECT `store_id`, `access_token` FROM `stores`'):
+                self._rows = sorted((int(store), token) for store, token in StubConnectionPool.stores.items())
+            else:
+                self._rows = []
+            self.rowcount = len(self._rows or []) or self.rowcount
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchall(self):
+        rows, self._rows = self._rows or [], []
+        return rows
+
+    def close(self):
+        pass
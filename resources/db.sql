@@ -7,14 +7,25 @@
 /*!40111 SET @OLD_SQL_NOTES=@@SQL_NOTES, SQL_NOTES=0 */;
 
 DROP TABLE IF EXISTS `stores`;
+DROP TABLE IF EXISTS `schema_migrations`;
 
 CREATE TABLE `stores` (
   `id` int(11) unsigned NOT NULL AUTO_INCREMENT,
   `store_id` int(11) NOT NULL,
   `access_token` varchar(256) NOT NULL DEFAULT '',
-  PRIMARY KEY (`id`)
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `stores_store_id_unique` (`store_id`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8;
 
+/* the schema above already includes every migration below */
+CREATE TABLE `schema_migrations` (
+  `version` varchar(32) NOT NULL,
+  `applied_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`version`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
+INSERT INTO `schema_migrations` (`version`) VALUES ('0001');
+
 /*!40111 SET SQL_NOTES=@OLD_SQL_NOTES */;
 /*!40101 SET SQL_MODE=@OLD_SQL_MODE */;
 /*!40014 SET FOREIGN_KEY_CHECKS=@OLD_FOREIGN_KEY_CHECKS */;
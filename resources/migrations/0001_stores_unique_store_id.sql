@@ -0,0 +1,6 @@
+/* keeping only the latest access token of each store */
+DELETE `older` FROM `stores` AS `older`
+INNER JOIN `stores` AS `newer` ON `newer`.`store_id` = `older`.`store_id` AND `newer`.`id` > `older`.`id`;
+
+/* one row per store, so tokens can be upserted and fetched with a point lookup */
+ALTER TABLE `stores` ADD UNIQUE INDEX `stores_store_id_unique` (`store_id`);
@@ -1,2 +1,4 @@
 # -*- coding: utf-8 -*-
-from app.main import app
+from app.main import create_app
+
+app = create_app()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import unittest
+from unittest import mock
+
+from app import asgi, config
+from app.services.batch_quotes import BatchQuotes
+from app.util import json_codec
+from tests.test_batch_quotes import StubShippingOptions, create_payload
+
+"""
+ASGI app tests, calling the application with in-memory receive and send channels and stubbed app services.
+"""
+
+""" Stubbed services container, with the batch quotes of a stubbed ShippingOptions """
+class StubContainer(object):
+
+    def __init__(self):
+        self.batch_quotes = BatchQuotes(StubShippingOptions(latency=0), concurrency=2)
+
+""" Call the ASGI application with a request body sent in chunks, returning its status, headers and body """
+def call(method, path, chunks):
+    messages = [{'type': 'http.request', 'body': chunk, 'more_body': n < len(chunks) - 1} for n, chunk in enumerate(chunks)]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': method, 'path': path, 'headers': []}
+    asyncio.run(asgi.application(scope, receive, send))
+    return sent[0]['status'], dict(sent[0]['headers']), b''.join(message.get('body', b'') for message in sent[1:])
+
+class OptionsBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.container = asgi.container
+        asgi.container = StubContainer()
+
+    def tearDown(self):
+        asgi.container = self.container
+
+    def test_batch_results_are_streamed_in_order(self):
+        body = b'\n'.join(json_codec.dumps(create_payload('cart-{}'.format(n), '2000000{}'.format(n))) for n in range(3)) + b'\nnot json\n'
+        status, headers, response = call('POST', '/nuvemshop/options/batch', [body[:50], body[50:120], body[120:]])
+
+        self.assertEqual((status, headers[b'content-type']), (200, b'application/x-ndjson'))
+        results = [json_codec.loads(line) for line in response.splitlines()]
+        self.assertEqual([result['id'] for result in results], ['cart-0', 'cart-1', 'cart-2', 3])
+        self.assertEqual(results[2]['rates'], [{'destination': '20000002'}])
+        self.assertIn('error', results[3])
+
+    def test_batch_lines_longer_than_the_limit_end_the_batch(self):
+        body = json_codec.dumps(create_payload('cart-0')) + b'\n' + b'x' * 600
+        with mock.patch.object(config, 'ASYNC_MAX_BODY_SIZE', 500):
+            status, headers, response = call('POST', '/nuvemshop/options/batch', [body[:300], body[300:]])
+
+        results = [json_codec.loads(line) for line in response.splitlines()]
+        self.assertEqual(status, 200)
+        self.assertEqual(len(results), 1)
+        self.assertIn('500 bytes', results[0]['error'])
+
+class OptionsBodyTest(unittest.TestCase):
+
+    def test_bodies_longer_than_the_limit_are_rejected(self):
+        with mock.patch.object(config, 'ASYNC_MAX_BODY_SIZE', 100):
+            status, headers, response = call('POST', '/nuvemshop/options', [b'{"items": [' + b' ' * 60, b' ' * 60 + b']}'])
+
+        self.assertEqual((status, response), (413, b'Payload Too Large'))
+
+    def test_read_body_joins_the_chunks(self):
+        messages = [{'body': b'ab', 'more_body': True}, {'body': b'', 'more_body': True}, {'body': b'cd'}]
+
+        async def receive():
+            return messages.pop(0)
+
+        self.assertEqual(asyncio.run(asgi.read_body(receive, 4)), b'abcd')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import unittest
+
+from app.services.batch_quotes import BatchQuotes
+
+"""
+Batch quotes tests, with a stubbed ShippingOptions that records how many quotes are in flight.
+"""
+
+""" Build an options body of a single item cart """
+def create_payload(id, destination = '20000000'):
+    return {
+        'id': id,
+        'origin': {'postal_code': '01001000'},
+        'destination': {'postal_code': destination},
+        'items': [{'quantity': 1, 'grams': 500, 'dimensions': {'height': 10, 'width': 12, 'depth': 15}}]
+    }
+
+""" Stubbed ShippingOptions, answering with the cart destination after latency seconds """
+class StubShippingOptions(object):
+
+    def __init__(self, latency = 0.02):
+        self.latency = latency
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def quote(self, origin, destination, items):
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.latency)
+        with self._lock:
+            self.in_flight -= 1
+        return [{'destination': destination}]
+
+class BatchQuotesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.shipping_options = StubShippingOptions()
+        self.batch_quotes = BatchQuotes(self.shipping_options, concurrency=2)
+
+    def test_results_keep_the_payload_order(self):
+        payloads = [create_payload('cart-{}'.format(n), '2000000{}'.format(n)) for n in range(5)] + [{'id': 'invalid'}]
+        results = list(self.batch_quotes.quote(payloads))
+
+        self.assertEqual([result['id'] for result in results], ['cart-0', 'cart-1', 'cart-2', 'cart-3', 'cart-4', 'invalid'])
+        self.assertEqual(results[3]['rates'], [{'destination': '20000003'}])
+        self.assertIn('error', results[5])
+
+    def test_identical_carts_are_quoted_once_beyond_the_window(self):
+        payloads = [create_payload(n, '2000000{}'.format(n % 4)) for n in range(12)]
+        results = list(self.batch_quotes.quote(payloads))
+
+        self.assertEqual(self.shipping_options.calls, 4)
+        self.assertEqual(results[9]['rates'], [{'destination': '20000001'}])
+
+    def test_concurrency_is_shared_by_every_batch(self):
+        batches = [
+            threading.Thread(target=lambda n=n: list(self.batch_quotes.quote(
+                [create_payload(m, '2{}00000{}'.format(n, m)) for m in range(6)]
+            )))
+            for n in range(3)
+        ]
+        for batch in batches:
+            batch.start()
+        for batch in batches:
+            batch.join()
+
+        self.assertEqual(self.shipping_options.calls, 18)
+        self.assertLessEqual(self.shipping_options.max_in_flight, 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+from app import carriers, config
+from app.models.store_token import StoreToken
+from app.services.carrier_sync import BulkCarrierSync, CarrierSync
+from app.services.tiendanube import TiendaNubeException
+
+"""
+Bulk carrier sync tests, against a fake TiendaNube API holding the carriers of each store and a temporary checkpoint
+file.
+"""
+
+""" Fake TiendaNube API, holding the carriers and options of each store, whose failing stores answer with errors """
+class FakeTiendaNube(object):
+
+    def __init__(self, stores):
+        self.carriers = dict((store_id, []) for store_id in stores)
+        self.options = {}
+        self.failing = set()
+        self.synced = []
+        self._lock = threading.Lock()
+
+    def for_store(self, store_id, access_token, rate_limiter = None):
+        return FakeStoreClient(self, store_id)
+
+class FakeStoreClient(object):
+
+    def __init__(self, api, store_id):
+        self.api = api
+        self.store_id = store_id
+
+    def get_shipping_carriers(self):
+        with self.api._lock:
+            self.api.synced.append(self.store_id)
+        if self.store_id in self.api.failing:
+            raise TiendaNubeException('The store {} is unavailable'.format(self.store_id))
+        return list(self.api.carriers[self.store_id])
+
+    def get_shipping_carrier_options(self, carrier_id):
+        return list(self.api.options.get(carrier_id, []))
+
+    def create_shipping_carrier(self, name, callback_url, supports):
+        carrier = {'id': self.store_id * 100, 'name': name, 'callback_url': callback_url, 'types': ','.join(supports)}
+        self.api.carriers[self.store_id].append(carrier)
+        return carrier
+
+    def update_shipping_carrier(self, carrier_id, **fields):
+        next(c for c in self.api.carriers[self.store_id] if c['id'] == carrier_id).update(fields)
+
+    def create_shipping_carrier_option(self, carrier_id, code, name):
+        with self.api._lock:
+            self.api.options.setdefault(carrier_id, []).append({'id': len(self.api.options[carrier_id]) + 1, 'code': code, 'name': name})
+
+    def delete_shipping_carrier_option(self, carrier_id, option_id):
+        self.api.options[carrier_id] = [option for option in self.api.options[carrier_id] if option['id'] != option_id]
+
+""" Fake store token repository, with a token for every store """
+class FakeRepository(object):
+
+    def __init__(self, stores):
+        self.stores = sorted(stores)
+
+    def iter_tokens(self, page_size = 500, after = None):
+        for store_id in self.stores:
+            if after is None or store_id > after:
+                yield StoreToken(store_id, 'token-{}'.format(store_id))
+
+    def get_token(self, store_id):
+        return StoreToken(store_id, 'token-{}'.format(store_id)) if store_id in self.stores else False
+
+class BulkCarrierSyncTest(unittest.TestCase):
+
+    STORES = [1, 2, 3, 4, 5]
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.checkpoint = os.path.join(directory.name, 'sync.json')
+        self.api = FakeTiendaNube(self.STORES)
+        self.repository = FakeRepository(self.STORES)
+
+    def create_bulk(self, concurrency = 2, page_size = 500):
+        return BulkCarrierSync(self.api, self.repository, CarrierSync(), concurrency=concurrency, page_size=page_size, checkpoint=self.checkpoint)
+
+    def read_checkpoint(self):
+        with open(self.checkpoint) as f:
+            return json.load(f)
+
+    def test_run_syncs_every_store_and_records_the_failed_ones(self):
+        self.api.failing.add(3)
+        results = list(self.create_bulk().run())
+
+        self.assertEqual([store_id for store_id, changes, error in results], self.STORES)
+        self.assertIsNotNone(results[2][2])
+        self.assertEqual(self.read_checkpoint(), {'after': 5, 'failed': [3]})
+        self.assertEqual([option['code'] for option in self.api.options[100]], ['pac', 'sedex'])
+
+    def test_interrupted_run_resumes_from_the_checkpoint(self):
+        run = self.create_bulk(concurrency=1, page_size=2).run()
+        self.assertEqual([next(run)[0] for n in range(3)], [1, 2, 3])
+        run.close()
+        self.assertEqual(self.read_checkpoint(), {'after': 2, 'failed': []})
+
+        self.api.synced = []
+        self.assertEqual([store_id for store_id, changes, error in self.create_bulk().run()], [3, 4, 5])
+        self.assertEqual(self.api.synced, [3, 4, 5])
+        self.assertEqual(self.read_checkpoint(), {'after': 5, 'failed': []})
+
+    def test_sync_is_idempotent(self):
+        list(self.create_bulk().run())
+        os.remove(self.checkpoint)
+
+        results = list(self.create_bulk().run())
+        self.assertEqual([changes for store_id, changes, error in results], [[]] * 5)
+        self.assertEqual(len(self.api.carriers[1]), 1)
+
+    def test_dry_run_does_not_apply_changes_nor_use_the_checkpoint(self):
+        with open(self.checkpoint, 'w') as f:
+            json.dump({'after': 4, 'failed': [2]}, f)
+
+        results = list(self.create_bulk().run(dry_run=True))
+
+        self.assertEqual([store_id for store_id, changes, error in results], self.STORES)
+        self.assertEqual([change.action for change in results[0][1]], [CarrierSync.CREATE_CARRIER, CarrierSync.CREATE_OPTION, CarrierSync.CREATE_OPTION])
+        self.assertEqual(self.api.carriers[1], [])
+        self.assertEqual(self.read_checkpoint(), {'after': 4, 'failed': [2]})
+
+class CarriersCommandTest(BulkCarrierSyncTest):
+
+    """ Run the carriers command with the fake API and repository, returning its exit code and output """
+    def run_command(self, *argv):
+        output = io.StringIO()
+        with mock.patch.object(carriers, 'TiendaNube', lambda **kwargs: self.api), \
+                mock.patch.object(carriers, 'StoreTokenRepository', lambda pool: self.repository), \
+                mock.patch.object(carriers, 'get_pool', lambda: None), redirect_stdout(output):
+            code = carriers.main(list(argv))
+        return code, output.getvalue().splitlines()
+
+    def test_retry_failed_only_syncs_the_failed_stores(self):
+        self.api.failing.update([2, 4])
+        self.assertEqual(self.run_command('--checkpoint', self.checkpoint)[0], 1)
+        self.assertEqual(self.read_checkpoint(), {'after': 5, 'failed': [2, 4]})
+
+        self.api.failing.discard(2)
+        self.api.synced = []
+        self.assertEqual(self.run_command('--checkpoint', self.checkpoint, '--retry-failed')[0], 1)
+        self.assertEqual(sorted(self.api.synced), [2, 4])
+        self.assertEqual(self.read_checkpoint(), {'after': 5, 'failed': [4]})
+
+        self.api.failing.clear()
+        self.assertEqual(self.run_command('--checkpoint', self.checkpoint, '--retry-failed')[0], 0)
+        self.assertEqual(self.read_checkpoint(), {'after': 5, 'failed': []})
+
+    def test_dry_run_prints_the_diff_of_each_store(self):
+        list(self.create_bulk().run())
+        self.api.carriers[2][0]['name'] = 'Old name'
+        self.api.options[300] = self.api.options[300][:1]
+
+        code, lines = self.run_command('--dry-run')
+
+        self.assertEqual(code, 0)
+        self.assertEqual(lines, [
+            'store 2: update_carrier 200 name={}'.format(config.CARRIER_NAME),
+            'store 3: create_option sedex name={}'.format(config.OPTION_SEDEX_NAME)
+        ])
+        self.assertEqual(self.api.carriers[2][0]['name'], 'Old name')
+
+if __name__ == '__main__':
+    unittest.main()
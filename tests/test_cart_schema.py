@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import copy
+import unittest
+from unittest import mock
+
+from app import config
+from app.util.cart_schema import CartSchemaException, validate_cart
+
+"""
+Cart schema tests, checking the cart of valid options bodies and the field reported for each rejected one.
+"""
+
+BODY = {
+    'origin': {'postal_code': '01001-000'},
+    'destination': {'postal_code': '20000000'},
+    'items': [
+        {'quantity': 2, 'grams': 500, 'dimensions': {'height': 10, 'width': 12.5, 'depth': 15}},
+        {'quantity': 1, 'grams': 0.5, 'dimensions': {'height': 1, 'width': 1, 'depth': 1}, 'free_shipping': True}
+    ]
+}
+
+""" Build a copy of the valid body with the field at a path replaced by a value, or removed when missing """
+def create_body(path = (), value = None, missing = False):
+    body = copy.deepcopy(BODY)
+    if not path:
+        return body
+
+    parent = body
+    for field in path[:-1]:
+        parent = parent[field]
+    if missing:
+        del parent[path[-1]]
+    else:
+        parent[path[-1]] = value
+    return body
+
+class ValidateCartTest(unittest.TestCase):
+
+    def assertRejected(self, body, field):
+        with self.assertRaises(CartSchemaException) as context:
+            validate_cart(body)
+        self.assertIn(field, str(context.exception))
+
+    def test_valid_body_is_converted_to_a_cart(self):
+        cart = validate_cart(create_body())
+
+        self.assertEqual((cart.origin, cart.destination), ('01001-000', '20000000'))
+        self.assertEqual(cart.items[0], (10.0, 12.5, 15.0, 500.0, 2, False))
+        self.assertEqual((cart.items[1].grams, cart.items[1].free_shipping), (0.5, True))
+
+    def test_body_must_be_an_object(self):
+        self.assertRejected([], 'JSON object')
+        self.assertRejected(None, 'JSON object')
+
+    def test_invalid_postal_codes_are_rejected(self):
+        self.assertRejected(create_body(('origin',), missing=True), 'origin.postal_code')
+        self.assertRejected(create_body(('origin',), value='01001000'), 'origin.postal_code')
+        self.assertRejected(create_body(('destination', 'postal_code'), value='2000000'), 'destination.postal_code')
+        self.assertRejected(create_body(('destination', 'postal_code'), value=20000000), 'destination.postal_code')
+
+    def test_items_must_be_a_non_empty_list(self):
+        self.assertRejected(create_body(('items',), missing=True), 'items field')
+        self.assertRejected(create_body(('items',), value=[]), 'items field')
+        self.assertRejected(create_body(('items',), value={'quantity': 1}), 'items field')
+        self.assertRejected(create_body(('items', 1), value='item'), 'items[1]')
+
+    def test_carts_over_the_items_limit_are_rejected(self):
+        body = create_body(('items',), value=BODY['items'] * 3)
+        with mock.patch.object(config, 'OPTION_MAX_ITEMS', 5):
+            self.assertRejected(body, 'more than 5 items')
+        with mock.patch.object(config, 'OPTION_MAX_ITEMS', 6):
+            self.assertEqual(len(validate_cart(body).items), 6)
+
+    def test_invalid_quantities_are_rejected(self):
+        for quantity in (-1, 1.5, '1', True, None):
+            self.assertRejected(create_body(('items', 0, 'quantity'), value=quantity), 'items[0].quantity')
+        self.assertEqual(validate_cart(create_body(('items', 0, 'quantity'), value=0)).items[0].quantity, 0)
+
+    def test_invalid_weights_are_rejected(self):
+        for grams in (0, -10, float('inf'), float('nan'), '500', False):
+            self.assertRejected(create_body(('items', 1, 'grams'), value=grams), 'items[1].grams')
+        self.assertRejected(create_body(('items', 1, 'grams'), missing=True), 'items[1].grams')
+
+    def test_invalid_dimensions_are_rejected(self):
+        self.assertRejected(create_body(('items', 0, 'dimensions'), value=[10, 12, 15]), 'items[0].dimensions field')
+        for dimension in ('height', 'width', 'depth'):
+            self.assertRejected(create_body(('items', 0, 'dimensions', dimension), value=0), 'items[0].dimensions.{}'.format(dimension))
+            self.assertRejected(create_body(('items', 0, 'dimensions', dimension), missing=True), 'items[0].dimensions.{}'.format(dimension))
+
+    def test_free_shipping_must_be_a_boolean(self):
+        self.assertRejected(create_body(('items', 1, 'free_shipping'), value='yes'), 'items[1].free_shipping')
+        self.assertFalse(validate_cart(create_body(('items', 1, 'free_shipping'), missing=True)).items[1].free_shipping)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import time
+import unittest
+
+from app.services.circuit_breaker import CircuitBreaker
+
+"""
+Circuit breaker tests, with a short recovery timeout.
+"""
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=0.05)
+
+    """ Record failures until the circuit opens """
+    def open(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+
+    def test_circuit_opens_after_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.get_state(), CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.get_state(), CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_half_open_circuit_lets_a_single_probe_through(self):
+        self.open()
+        time.sleep(0.06)
+
+        self.assertEqual(self.breaker.get_state(), CircuitBreaker.HALF_OPEN)
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+
+    def test_successful_probe_closes_the_circuit(self):
+        self.open()
+        time.sleep(0.06)
+        self.breaker.allow()
+
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.get_state(), CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.allow())
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_probe_opens_the_circuit_again(self):
+        self.open()
+        time.sleep(0.06)
+        self.breaker.allow()
+
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.get_state(), CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+
+        time.sleep(0.06)
+        self.assertTrue(self.breaker.allow())
+
+if __name__ == '__main__':
+    unittest.main()
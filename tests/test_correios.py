@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+import random
+import unittest
+from datetime import date, datetime
+
+from correios.package import BoxPackage
+from pytz import timezone
+
+from app import config
+from app.models.quote import PackageShape, RateQuote
+from app.util.business_days import BusinessCalendar, load_holidays
+from app.util.correios import BulkBoxPackage, ShippingOptionFormatter
+
+"""
+Correios utilities tests.
+"""
+
+""" Get the api format of a package, or None when the package is rejected as invalid """
+def get_api_format(package):
+    try:
+        return package.api_format()
+    except Exception:
+        return None
+
+class BulkBoxPackageTest(unittest.TestCase):
+
+    # the bulk package multiplies each line by its quantity instead of adding every unit, so sums may only differ by
+    # float rounding
+    TOLERANCE = 1e-9
+
+    """ Build a bulk package and a SDK package, with every unit added one by one, of the same lines """
+    def create_packages(self, lines):
+        bulk, package = BulkBoxPackage(), BoxPackage()
+        for height, width, depth, weight, quantity in lines:
+            bulk.add_item(height, width, depth, weight, quantity)
+            for n in range(quantity):
+                package.add_item(height, width, depth, weight)
+        return bulk, package
+
+    def assertSameApiFormat(self, lines):
+        bulk, package = self.create_packages(lines)
+        expected, actual = get_api_format(package), get_api_format(bulk)
+
+        if expected is None:
+            self.assertIsNone(actual, lines)
+            return
+
+        self.assertIsNotNone(actual, lines)
+        self.assertEqual(sorted(actual), sorted(expected))
+        self.assertEqual(actual['nCdFormato'], expected['nCdFormato'])
+        for field in ('nVlAltura', 'nVlLargura', 'nVlComprimento', 'nVlPeso'):
+            self.assertAlmostEqual(actual[field], expected[field], delta=self.TOLERANCE, msg=str(lines))
+
+        # the package shape rounds the differences away, so both packages share their quote keys
+        self.assertEqual(PackageShape.from_package(bulk), PackageShape.from_package(package))
+
+    def test_random_carts_match_the_sdk_package(self):
+        generator = random.Random(20180601)
+        for n in range(500):
+            lines = [(
+                round(generator.uniform(1, 35), generator.choice((0, 1, 2))),
+                round(generator.uniform(1, 35), generator.choice((0, 1, 2))),
+                round(generator.uniform(1, 35), generator.choice((0, 1, 2))),
+                round(generator.uniform(0.001, 4), 3),
+                generator.randint(1, 6)
+            ) for m in range(generator.randint(1, 4))]
+            self.assertSameApiFormat(lines)
+
+    def test_small_carts_get_the_minimum_dimensions_and_weight(self):
+        self.assertSameApiFormat([(1, 1, 1, 0.001, 2)])
+
+    def assertRejected(self, lines):
+        bulk, package = self.create_packages(lines)
+        self.assertRaises(Exception, package.api_format)
+        self.assertRaises(Exception, bulk.api_format)
+
+    def test_oversize_carts_are_rejected(self):
+        self.assertRejected([(10, 10, 106, 1, 1)])
+        self.assertRejected([(50, 80, 90, 1, 1)])
+        self.assertRejected([(20, 30, 40, 1, 6)])
+        self.assertSameApiFormat([(20, 30, 40, 1, 5)])
+
+    def test_overweight_carts_are_rejected(self):
+        self.assertRejected([(10, 10, 10, 10.5, 3)])
+        self.assertRejected([(10, 10, 10, 10, 2), (10, 10, 10, 0.5, 21)])
+        self.assertSameApiFormat([(10, 10, 10, 7.5, 4)])
+
+    def test_api_format_is_updated_when_items_are_added(self):
+        bulk = BulkBoxPackage()
+        bulk.add_item(10, 20, 30, 1, 1)
+        first = bulk.api_format()
+        bulk.add_item(10, 20, 30, 1, 1)
+
+        self.assertEqual((first['nVlPeso'], bulk.api_format()['nVlPeso']), (1.0, 2.0))
+
+class ShippingOptionFormatterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.formatter = ShippingOptionFormatter(BusinessCalendar(load_holidays()), margin_days=2)
+
+    """ Get the delivery dates of a PAC quote with a deadline of the given business days, quoted at a local time """
+    def get_delivery_dates(self, now, days):
+        now = timezone(config.OPTION_TIMEZONE).localize(now)
+        option = self.formatter.format([(RateQuote(config.OPTION_PAC_SERVICE, 20.5, days),) * 2], now=now)[0]
+        return option['min_delivery_date'], option['max_delivery_date']
+
+    def test_deadlines_skip_weekends(self):
+        self.assertEqual(
+            self.get_delivery_dates(datetime(2026, 10, 14, 9, 30), 2),
+            ('2026-10-16T09:30:00-03:00', '2026-10-20T09:30:00-03:00')
+        )
+        self.assertEqual(
+            self.get_delivery_dates(datetime(2026, 10, 17, 18, 0), 1),
+            ('2026-10-19T18:00:00-03:00', '2026-10-21T18:00:00-03:00')
+        )
+
+    def test_deadlines_skip_holidays(self):
+        # good friday, followed by a weekend
+        self.assertEqual(
+            self.get_delivery_dates(datetime(2026, 4, 2, 15, 0), 1),
+            ('2026-04-06T15:00:00-03:00', '2026-04-08T15:00:00-03:00')
+        )
+        # a friday deadline crossing the weekend and the monday holiday
+        self.assertEqual(
+            self.get_delivery_dates(datetime(2026, 10, 9, 10, 0), 2),
+            ('2026-10-14T10:00:00-03:00', '2026-10-16T10:00:00-03:00')
+        )
+
+    def test_zero_days_deadlines_are_delivered_today(self):
+        self.assertEqual(
+            self.get_delivery_dates(datetime(2026, 10, 16, 8, 0), 0),
+            ('2026-10-16T08:00:00-03:00', '2026-10-20T08:00:00-03:00')
+        )
+
+    def test_offsets_are_recomputed_on_another_day(self):
+        self.assertEqual(self.get_delivery_dates(datetime(2026, 4, 2, 15, 0), 1)[0], '2026-04-06T15:00:00-03:00')
+        self.assertEqual(self.get_delivery_dates(datetime(2026, 4, 6, 15, 0), 1)[0], '2026-04-07T15:00:00-03:00')
+
+    def test_options_keep_the_service_constants(self):
+        now = timezone(config.OPTION_TIMEZONE).localize(datetime(2026, 10, 14, 9, 30))
+        options = self.formatter.format([
+            (RateQuote(config.OPTION_SEDEX_SERVICE, 30, 1), RateQuote(config.OPTION_SEDEX_SERVICE, 25, 1)),
+            (RateQuote('99999', 10, 1), RateQuote('99999', 10, 1))
+        ], free_shipping_cart=True, now=now)
+
+        self.assertEqual((options[0]['code'], options[0]['price'], options[0]['price_merchant']), (config.OPTION_SEDEX_CODE, 0.0, 30.0))
+        self.assertEqual(options[1]['code'], 'unknown')
+
+class LoadHolidaysTest(unittest.TestCase):
+
+    def test_empty_path_loads_the_bundled_holidays(self):
+        holidays = load_holidays('')
+
+        self.assertEqual(holidays, load_holidays())
+        self.assertIn(date(2026, 4, 3), holidays)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import unittest
+from contextlib import contextmanager
+
+from app.database import DatabaseStatus
+
+"""
+Database status tests, with stubbed connection pools.
+"""
+
+""" Stubbed connection pool, whose check outs wait for the released event and then fail when unavailable """
+class StubPool(object):
+
+    def __init__(self, available = True):
+        self.available = available
+        self.released = threading.Event()
+        self.checkouts = 0
+
+    @contextmanager
+    def connection(self):
+        self.checkouts += 1
+        self.released.wait(5)
+        if not self.available:
+            raise Exception('Failed getting connection')
+        yield self
+
+    def is_connected(self):
+        return True
+
+""" Wait for the status to leave the given state """
+def wait_for_change(status, state):
+    deadline = time.monotonic() + 5
+    while status.get() == state and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return status.get()
+
+class DatabaseStatusTest(unittest.TestCase):
+
+    def test_status_does_not_wait_for_the_database(self):
+        pool = StubPool()
+        status = DatabaseStatus(pool, interval=60)
+
+        started_at = time.monotonic()
+        self.assertEqual((status.get(), status.get()), ('unknown', 'unknown'))
+        self.assertLess(time.monotonic() - started_at, 0.1)
+
+        pool.released.set()
+        self.assertEqual(wait_for_change(status, 'unknown'), 'ok')
+        self.assertEqual(pool.checkouts, 1)
+
+    def test_outdated_status_is_checked_again(self):
+        pool = StubPool()
+        pool.released.set()
+        status = DatabaseStatus(pool, interval=0)
+        self.assertEqual(wait_for_change(status, 'unknown'), 'ok')
+
+        pool.available = False
+        self.assertEqual(wait_for_change(status, 'ok'), 'unavailable')
+
+if __name__ == '__main__':
+    unittest.main()
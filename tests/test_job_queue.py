@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+import unittest
+
+from app.services.job_queue import Job, MemoryJobQueue, SQLiteJobQueue
+
+"""
+Job queue tests, run against both backends. Jobs are run with run_once(), without worker threads, and a zero lease
+timeout makes every running job look like one whose worker died.
+"""
+class JobQueueTestCase(object):
+
+    def test_failed_job_is_retried_up_to_max_attempts(self):
+        queue = self.create_queue(max_attempts=2, backoff_factor=0, lease_timeout=60)
+        queue.register('fail', lambda payload: 1 / 0)
+        queue.enqueue('fail', 'job', {})
+
+        self.assertTrue(queue.run_once())
+        self.assertEqual((queue.get('job').status, queue.get('job').attempts), (Job.PENDING, 1))
+        self.assertTrue(queue.run_once())
+        self.assertEqual((queue.get('job').status, queue.get('job').attempts), (Job.FAILED, 2))
+
+    def test_reclaimed_job_counts_as_an_attempt(self):
+        queue = self.create_queue(max_attempts=2, lease_timeout=0)
+        queue.register('crash', lambda payload: {})
+        queue.enqueue('crash', 'job', {})
+
+        # claiming the job as a worker that dies before finishing it
+        self.assertEqual(queue._claim(0, 0).attempts, 0)
+        self.assertEqual(queue._claim(0, 0).attempts, 1)
+
+        self.assertTrue(queue.run_once())
+        job = queue.get('job')
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+
+class MemoryJobQueueTest(JobQueueTestCase, unittest.TestCase):
+
+    def create_queue(self, **options):
+        return MemoryJobQueue(**options)
+
+class SQLiteJobQueueTest(JobQueueTestCase, unittest.TestCase):
+
+    def create_queue(self, **options):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        return SQLiteJobQueue(os.path.join(directory.name, 'jobs.db'), **options)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+import unittest
+
+from app import config
+from app.services.quote_warmer import QuoteHistory, QuoteWarmer, create_quote_warmer
+from app.services.rate_cache import SQLiteRateCache, rate_cache_key
+from app.services.shipping_rates import ShippingRates
+from tests.test_shipping_rates import SERVICES, StubCorreios, create_package
+
+"""
+Quote warm-up tests, with workers simulated by ShippingRates instances sharing a rate cache and a stubbed client.
+"""
+class QuoteWarmerTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'rates.db')
+        self.client = StubCorreios()
+        self.key = rate_cache_key('01001000', '20000000', create_package(), SERVICES)
+
+    """ Build the warmer of a worker, whose history has requested the key """
+    def create_warmer(self, budget = 60):
+        shipping_rates = ShippingRates(self.client, SQLiteRateCache(ttl=3600, path=self.path, max_entries=100))
+        history = QuoteHistory()
+        history.record(self.key)
+        return QuoteWarmer(shipping_rates, history, budget=budget, refresh_ahead=300, interval=10)
+
+    def test_workers_sharing_the_cache_refresh_a_key_once(self):
+        self.assertEqual(self.create_warmer().run_once(), 1)
+        self.assertEqual(self.create_warmer().run_once(), 0)
+        self.assertEqual(self.client.calls, 1)
+
+    def test_leased_keys_are_skipped_until_the_lease_expires(self):
+        warmer = self.create_warmer()
+        self.assertTrue(warmer._shipping_rates.lease(self.key, 10))
+
+        self.assertEqual(self.create_warmer().run_once(), 0)
+        self.assertEqual(self.client.calls, 0)
+
+    def test_budget_is_split_between_the_workers(self):
+        budget, workers = config.WARMUP_BUDGET, config.WEB_CONCURRENCY
+        self.addCleanup(setattr, config, 'WARMUP_BUDGET', budget)
+        self.addCleanup(setattr, config, 'WEB_CONCURRENCY', workers)
+        config.WARMUP_BUDGET, config.WEB_CONCURRENCY = 240, 4
+
+        warmer = create_quote_warmer(ShippingRates(self.client), QuoteHistory())
+        self.assertEqual(warmer._bucket._rate, 1.0)
+
+if __name__ == '__main__':
+    unittest.main()
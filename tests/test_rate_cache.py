@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from app.services.rate_cache import MemoryRateCache, SQLiteRateCache
+
+"""
+Rate cache tests, run against the local backends. Values are the bytes stored by ShippingRates.
+"""
+class RateCacheTestCase(object):
+
+    def test_get_returns_the_stored_bytes(self):
+        cache = self.create_cache(ttl=60)
+
+        self.assertTrue(cache.set('rate:a', b'\x00\x01quote'))
+        self.assertEqual(cache.get('rate:a'), b'\x00\x01quote')
+        self.assertIsNone(cache.get('rate:b'))
+
+    def test_expired_entries_are_misses(self):
+        cache = self.create_cache(ttl=60)
+        cache.set('rate:a', b'quote', ttl=-1)
+
+        self.assertIsNone(cache.get('rate:a'))
+
+    def test_add_only_stores_missing_or_expired_keys(self):
+        cache = self.create_cache(ttl=60)
+
+        self.assertTrue(cache.add('lease:a', b'first'))
+        self.assertFalse(cache.add('lease:a', b'second'))
+        self.assertEqual(cache.get('lease:a'), b'first')
+
+        cache.set('lease:b', b'expired', ttl=-1)
+        self.assertTrue(cache.add('lease:b', b'new'))
+        self.assertEqual(cache.get('lease:b'), b'new')
+
+class MemoryRateCacheTest(RateCacheTestCase, unittest.TestCase):
+
+    def create_cache(self, ttl):
+        return MemoryRateCache(ttl=ttl, max_bytes=1024 * 1024)
+
+class SQLiteRateCacheTest(RateCacheTestCase, unittest.TestCase):
+
+    def create_cache(self, ttl):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'rates.db')
+        return SQLiteRateCache(ttl=ttl, path=self.path, max_entries=100)
+
+    """ Get the access time of a key, read through a separate connection """
+    def get_accessed_at(self, key):
+        conn = sqlite3.connect(self.path)
+        try:
+            return conn.execute('SELECT `accessed_at` FROM `rate_cache` WHERE `key`=?', (key,)).fetchone()[0]
+        finally:
+            conn.close()
+
+    """ Count the stored rows, expired ones included, through a separate connection """
+    def count_rows(self):
+        conn = sqlite3.connect(self.path)
+        try:
+            return conn.execute('SELECT COUNT(*) FROM `rate_cache`').fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_hits_only_write_outdated_access_times(self):
+        cache = self.create_cache(ttl=60)
+        cache.set('rate:a', b'quote')
+        stored_at = self.get_accessed_at('rate:a')
+
+        cache.get('rate:a')
+        self.assertEqual(self.get_accessed_at('rate:a'), stored_at)
+
+        cache.ACCESS_RESOLUTION = -1
+        cache.get('rate:a')
+        self.assertGreater(self.get_accessed_at('rate:a'), stored_at)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = self.create_cache(ttl=60)
+        cache.ACCESS_RESOLUTION = -1
+        cache.PURGE_INTERVAL = -1
+        cache._max_entries = 2
+        cache.set('rate:a', b'a')
+        time.sleep(0.01)
+        cache.set('rate:b', b'b')
+        time.sleep(0.01)
+        cache.get('rate:a')
+        cache.set('rate:c', b'c')
+
+        self.assertEqual((cache.get('rate:a'), cache.get('rate:b'), cache.get('rate:c')), (b'a', None, b'c'))
+
+    def test_expired_entries_are_purged_once_per_interval(self):
+        cache = self.create_cache(ttl=60)
+        cache.set('rate:a', b'a')
+        cache.set('rate:b', b'b', ttl=-1)
+        cache.set('rate:c', b'c', ttl=-1)
+        self.assertEqual(self.count_rows(), 3)
+
+        cache._purged_at = 0
+        cache.set('rate:d', b'd')
+        self.assertEqual(self.count_rows(), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import threading
+import time
+import unittest
+
+from correios import ShippingRateResult
+
+from app.models.quote import RateQuote
+from app.services.circuit_breaker import CircuitBreaker
+from app.services.rate_cache import MemoryRateCache
+from app.services.shipping_rates import ShippingRates, ShippingRatesException
+from app.util.correios import BulkBoxPackage
+
+"""
+Shipping rates tests, with a stubbed Correios client answering every service with the same rate.
+"""
+
+SERVICES = ['04510', '04014']
+
+""" Build a package of a single item """
+def create_package():
+    package = BulkBoxPackage()
+    package.add_item(10, 12, 15, 1.0, 1)
+    return package
+
+"""
+Stubbed Correios client, answering after latency seconds, or after the next latency of a list of latencies, and
+raising error when set
+"""
+class StubCorreios(object):
+
+    def __init__(self, latency = 0, error = None, error_code = 0):
+        self.latency = latency
+        self.error = error
+        self.error_code = error_code
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def get_shipping_rates(self, origin, destination, package, services):
+        with self._lock:
+            self.calls += 1
+            latency = self.latency.pop(0) if isinstance(self.latency, list) else self.latency
+        time.sleep(latency)
+        if self.error is not None:
+            raise self.error
+        return ShippingRateResult(origin, destination, package, [RateQuote(service, 10.0, 3, self.error_code) for service in services])
+
+class QueueTimeoutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = StubCorreios(latency=0.3)
+        self.shipping_rates = ShippingRates(
+            self.client, max_workers=1, queue_timeout=0.05, degraded_modes=['flat'], flat_rates={'04510': (25.0, 10)}
+        )
+
+    def test_queued_quote_is_answered_in_degraded_mode_when_its_deadline_expires(self):
+        running = self.shipping_rates.submit('01001000', '20000000', create_package(), SERVICES[:1])
+        queued = self.shipping_rates.submit('01001000', '20000001', create_package(), SERVICES[:1])
+
+        started_at = time.monotonic()
+        rates = self.shipping_rates.result(queued)
+        self.assertLess(time.monotonic() - started_at, 0.2)
+        self.assertEqual([(service.code, service.price) for service in rates.services], [('04510', 25.0)])
+        self.assertTrue(queued.cancelled())
+
+        self.assertEqual(self.shipping_rates.result(running).services[0].price, 10.0)
+        self.assertEqual(self.client.calls, 1)
+
+    def test_queued_quote_without_degraded_rates_fails(self):
+        self.shipping_rates.submit('01001000', '20000000', create_package(), SERVICES)
+        queued = self.shipping_rates.submit('01001000', '20000001', create_package(), SERVICES)
+
+        with self.assertRaises(ShippingRatesException):
+            self.shipping_rates.result(queued)
+
+    def test_async_wait_has_the_same_deadline(self):
+        self.shipping_rates.submit('01001000', '20000000', create_package(), SERVICES[:1])
+        queued = self.shipping_rates.submit('01001000', '20000001', create_package(), SERVICES[:1])
+
+        rates = asyncio.run(self.shipping_rates.result_async(queued))
+        self.assertEqual(rates.services[0].price, 25.0)
+
+    def test_running_quote_is_not_cancelled(self):
+        rates = self.shipping_rates.result(self.shipping_rates.submit('01001000', '20000000', create_package(), SERVICES))
+
+        self.assertEqual([service.price for service in rates.services], [10.0, 10.0])
+
+class CoalescingTest(unittest.TestCase):
+
+    def test_concurrent_quotes_of_the_same_key_share_a_webservice_call(self):
+        client = StubCorreios(latency=0.1)
+        shipping_rates = ShippingRates(client, max_workers=4)
+
+        futures = [shipping_rates.submit('01001-000', '20000000', create_package(), SERVICES) for n in range(4)]
+        futures.append(shipping_rates.submit('01001000', '20000001', create_package(), SERVICES))
+        results = [shipping_rates.result(future) for future in futures]
+
+        self.assertEqual(client.calls, 2)
+        self.assertEqual([rates.destination for rates in results], ['20000000'] * 4 + ['20000001'])
+        self.assertEqual(results[3].services, results[0].services)
+
+    def test_failures_are_shared_by_the_waiting_quotes(self):
+        client = StubCorreios(latency=0.1, error=ValueError('down'))
+        shipping_rates = ShippingRates(client, max_workers=2)
+
+        futures = [shipping_rates.submit('01001000', '20000000', create_package(), SERVICES) for n in range(2)]
+        for future in futures:
+            with self.assertRaises(ShippingRatesException):
+                shipping_rates.result(future)
+        self.assertEqual(client.calls, 1)
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = StubCorreios(error=ValueError('down'))
+        self.breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=0.05)
+        self.shipping_rates = ShippingRates(self.client, breaker=self.breaker)
+
+    def quote(self):
+        return self.shipping_rates.get_shipping_rates('01001000', '20000000', create_package(), SERVICES)
+
+    def test_open_circuit_fails_fast_without_calling_the_webservice(self):
+        for n in range(3):
+            with self.assertRaises(ShippingRatesException):
+                self.quote()
+
+        self.assertEqual(self.client.calls, 2)
+        self.assertEqual(self.breaker.get_state(), CircuitBreaker.OPEN)
+
+    def test_unavailability_error_codes_count_as_failures(self):
+        self.client.error, self.client.error_code = None, -888
+        for n in range(2):
+            with self.assertRaises(ShippingRatesException):
+                self.quote()
+
+        self.assertEqual(self.breaker.get_state(), CircuitBreaker.OPEN)
+
+    def test_circuit_recovers_when_the_webservice_is_back(self):
+        for n in range(2):
+            with self.assertRaises(ShippingRatesException):
+                self.quote()
+        time.sleep(0.06)
+
+        self.client.error = None
+        self.assertEqual(self.quote().services[0].price, 10.0)
+        self.assertEqual(self.breaker.get_state(), CircuitBreaker.CLOSED)
+        self.assertEqual(self.client.calls, 3)
+
+class HedgingTest(unittest.TestCase):
+
+    def test_slow_call_is_hedged_and_the_first_answer_wins(self):
+        client = StubCorreios(latency=[1.0, 0])
+        shipping_rates = ShippingRates(client, max_workers=2, timeout=2, hedge_after=0.05)
+
+        started_at = time.monotonic()
+        rates = shipping_rates.get_shipping_rates('01001000', '20000000', create_package(), SERVICES)
+        self.assertLess(time.monotonic() - started_at, 0.5)
+        self.assertEqual(rates.services[0].price, 10.0)
+        self.assertEqual(client.calls, 2)
+
+    def test_fast_call_is_not_hedged(self):
+        client = StubCorreios(latency=0)
+        shipping_rates = ShippingRates(client, max_workers=2, timeout=2, hedge_after=0.2)
+
+        shipping_rates.get_shipping_rates('01001000', '20000000', create_package(), SERVICES)
+        self.assertEqual(client.calls, 1)
+
+    def test_hedged_calls_are_bounded_by_the_timeout(self):
+        client = StubCorreios(latency=[0.5, 0.5])
+        shipping_rates = ShippingRates(client, max_workers=2, timeout=0.15, hedge_after=0.05)
+
+        started_at = time.monotonic()
+        with self.assertRaises(ShippingRatesException):
+            shipping_rates.get_shipping_rates('01001000', '20000000', create_package(), SERVICES)
+        self.assertLess(time.monotonic() - started_at, 0.3)
+
+class DegradedModeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = StubCorreios()
+        self.cache = MemoryRateCache(ttl=0.05, max_bytes=1024 * 1024)
+
+    def create_shipping_rates(self, degraded_modes):
+        return ShippingRates(
+            self.client, self.cache, stale_ttl=60, degraded_modes=degraded_modes, flat_rates={'04510': (25.0, 10), '04014': (45.0, 5)}
+        )
+
+    def quote(self, shipping_rates):
+        return shipping_rates.get_shipping_rates('01001000', '20000000', create_package(), SERVICES)
+
+    def test_stale_quote_is_served_when_the_webservice_fails(self):
+        shipping_rates = self.create_shipping_rates(['stale', 'flat'])
+        self.quote(shipping_rates)
+        time.sleep(0.06)
+
+        self.client.error = ValueError('down')
+        self.assertEqual([service.price for service in self.quote(shipping_rates).services], [10.0, 10.0])
+        self.assertEqual(self.client.calls, 2)
+
+    def test_flat_rates_are_served_without_a_stale_quote(self):
+        self.client.error = ValueError('down')
+        rates = self.quote(self.create_shipping_rates(['stale', 'flat']))
+
+        self.assertEqual([(service.code, service.price, service.days) for service in rates.services], [('04510', 25.0, 10), ('04014', 45.0, 5)])
+
+    def test_modes_are_tried_in_order(self):
+        shipping_rates = self.create_shipping_rates(['flat', 'stale'])
+        self.quote(shipping_rates)
+        time.sleep(0.06)
+
+        self.client.error = ValueError('down')
+        self.assertEqual([service.price for service in self.quote(shipping_rates).services], [25.0, 45.0])
+
+    def test_quote_fails_when_no_mode_can_answer(self):
+        self.client.error = ValueError('down')
+        with self.assertRaises(ShippingRatesException):
+            self.quote(self.create_shipping_rates(['stale']))
+
+if __name__ == '__main__':
+    unittest.main()
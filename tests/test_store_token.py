@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import sqlite3
+import unittest
+from contextlib import contextmanager
+
+from app.database import ConnectionPool
+from app.migrations import Migrations, split_statements
+from app.models.store_token import StoreToken, StoreTokenCache, StoreTokenRepository
+
+"""
+Store token migration and repository tests.
+
+They run against a SQLite stand-in of the MySQL database, translating the few MySQL only statements used by the
+migrations and the repository, and also against a real MySQL (or MariaDB) server when TEST_DB_HOST is set, along with
+TEST_DB_USER, TEST_DB_PASS and TEST_DB_NAME. The test database tables are dropped and created again.
+"""
+
+DB_SQL_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'resources', 'db.sql')
+
+# the stores table as it was before the migrations, without any unique index on store_id
+LEGACY_STORES_SQL = 'CREATE TABLE `stores` (`id` int(11) unsigned NOT NULL AUTO_INCREMENT, `store_id` int(11) NOT NULL, `access_token` varchar(256) NOT NULL DEFAULT \'\', PRIMARY KEY (`id`)) ENGINE=InnoDB DEFAULT CHARSET=utf8'
+
+""" Translate a MySQL statement to SQLite """
+def to_sqlite(sql):
+    if sql.startswith('CREATE TABLE `stores`'):
+        return 'CREATE TABLE `stores` (`id` INTEGER PRIMARY KEY AUTOINCREMENT, `store_id` INTEGER NOT NULL, `access_token` TEXT NOT NULL DEFAULT \'\')'
+
+    sql = sql.replace('%s', '?')
+    sql = re.sub(r'\s*ENGINE=\w+ DEFAULT CHARSET=\w+', '', sql)
+    sql = re.sub(r'ON DUPLICATE KEY UPDATE `(\w+)`=VALUES\(`\w+`\)', r'ON CONFLICT (`store_id`) DO UPDATE SET `\1`=excluded.`\1`', sql)
+    sql = re.sub(r'^ALTER TABLE `(\w+)` ADD UNIQUE INDEX `(\w+)` \((.+)\)$', r'CREATE UNIQUE INDEX `\2` ON `\1` (\3)', sql)
+    sql = re.sub(
+        r'^DELETE `(\w+)` FROM `(\w+)` AS `\1`\s+INNER JOIN `\2` AS `(\w+)` ON (.+)$',
+        r'DELETE FROM `\2` AS `\1` WHERE EXISTS (SELECT 1 FROM `\2` AS `\3` WHERE \4)', sql, flags=re.S
+    )
+    return sql
+
+""" SQLite stand-in of the MySQL connection pool """
+class SQLiteConnectionPool(ConnectionPool):
+
+    def __init__(self):
+        ConnectionPool.__init__(self, size=1, timeout=1)
+        self.db = sqlite3.connect(':memory:', check_same_thread=False)
+
+    @contextmanager
+    def connection(self):
+        yield SQLiteConnection(self.db)
+
+class SQLiteConnection(object):
+
+    def __init__(self, db):
+        self.db = db
+
+    def is_connected(self):
+        return True
+
+    def cursor(self):
+        return SQLiteCursor(self.db.cursor())
+
+    def commit(self):
+        self.db.commit()
+
+class SQLiteCursor(object):
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, sql, args = ()):
+        self.cursor.execute(to_sqlite(sql), args)
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def close(self):
+        self.cursor.close()
+
+class StoreTokenTestCase(object):
+
+    pool = None
+
+    """ Run statements on the test database """
+    def execute(self, *statements):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            for statement in statements:
+                cursor.execute(statement)
+            conn.commit()
+            cursor.close()
+
+    """ Get the rows of the stores table """
+    def get_rows(self):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT `store_id`, `access_token` FROM `stores` ORDER BY `id`')
+            rows = [(int(store), access_token) for store, access_token in cursor.fetchall()]
+            cursor.close()
+        return rows
+
+    def setUp(self):
+        self.pool = self.create_pool()
+        self.execute('DROP TABLE IF EXISTS `stores`', 'DROP TABLE IF EXISTS `schema_migrations`', LEGACY_STORES_SQL)
+        self.execute(
+            "INSERT INTO `stores` (`store_id`,`access_token`) VALUES (1, 'old-1')",
+            "INSERT INTO `stores` (`store_id`,`access_token`) VALUES (2, 'only-2')",
+            "INSERT INTO `stores` (`store_id`,`access_token`) VALUES (1, 'new-1')"
+        )
+
+    def test_migration_keeps_the_latest_token_of_each_store(self):
+        self.assertEqual(Migrations(self.pool).run(), ['0001'])
+        self.assertEqual(self.get_rows(), [(2, 'only-2'), (1, 'new-1')])
+        self.assertEqual(Migrations(self.pool).run(), [])
+
+    def test_save_token_replaces_the_token_of_its_store(self):
+        Migrations(self.pool).run()
+        repository = StoreTokenRepository(self.pool)
+
+        repository.save_token(StoreToken(1, 'newer-1'))
+        repository.save_token(StoreToken(3, 'new-3'))
+
+        self.assertEqual(self.get_rows(), [(2, 'only-2'), (1, 'newer-1'), (3, 'new-3')])
+
+    def test_get_token_reads_the_token_of_a_store(self):
+        Migrations(self.pool).run()
+        repository = StoreTokenRepository(self.pool, StoreTokenCache(ttl=60, max_entries=10))
+
+        self.assertEqual(repository.get_token(1), StoreToken(1, 'new-1'))
+        self.assertIs(repository.get_token(4), False)
+
+        repository.save_token(StoreToken(1, 'newer-1'))
+        self.assertEqual(repository.get_token(1), StoreToken(1, 'newer-1'))
+
+class SQLiteStoreTokenTest(StoreTokenTestCase, unittest.TestCase):
+
+    def create_pool(self):
+        return SQLiteConnectionPool()
+
+@unittest.skipUnless(os.getenv('TEST_DB_HOST'), 'TEST_DB_HOST is not set')
+class MySQLStoreTokenTest(StoreTokenTestCase, unittest.TestCase):
+
+    def create_pool(self):
+        return ConnectionPool(
+            size=2, timeout=5, host=os.getenv('TEST_DB_HOST'), user=os.getenv('TEST_DB_USER', 'root'),
+            passwd=os.getenv('TEST_DB_PASS'), database=os.getenv('TEST_DB_NAME', 'sample_shipping_app_test')
+        )
+
+    def test_db_sql_schema_is_up_to_date(self):
+        with open(DB_SQL_PATH) as f:
+            self.execute(*split_statements(f.read()))
+
+        self.assertEqual(Migrations(self.pool).run(), [])
+
+        repository = StoreTokenRepository(self.pool)
+        repository.save_token(StoreToken(1, 'old-1'))
+        repository.save_token(StoreToken(1, 'new-1'))
+        self.assertEqual(self.get_rows(), [(1, 'new-1')])
+
+if __name__ == '__main__':
+    unittest.main()
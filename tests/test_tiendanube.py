@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import unittest
+from unittest import mock
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+
+from app.services.tiendanube import TiendaNube, TiendaNubeException, create_session
+
+"""
+TiendaNube client retry tests, sending the requests to a stub adapter that answers with scripted responses and errors.
+"""
+
+""" Build a connection error raised while connecting, so the request surely did not reach the API """
+def connect_error():
+    return requests.ConnectionError(MaxRetryError(None, '/', reason=NewConnectionError(None, 'Connection refused')))
+
+""" Build a connection error raised after the request was sent """
+def reset_error():
+    return requests.ConnectionError(ProtocolError('Connection aborted.', ConnectionResetError('Connection reset by peer')))
+
+""" Stub adapter, answering each request with the next scripted (status, headers) response or raising the next error """
+class StubAdapter(BaseAdapter):
+
+    def __init__(self, script):
+        BaseAdapter.__init__(self)
+        self.script = list(script)
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        self.requests.append(request.method)
+        answer = self.script.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+
+        status, headers = answer if isinstance(answer, tuple) else (answer, {})
+        response = requests.Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict(headers)
+        response._content = b'{"id": 1}'
+        response.request = request
+        response.url = request.url
+        return response
+
+    def close(self):
+        pass
+
+class RetryTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('app.services.tiendanube.time.sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    """ Build a store client sending its requests to a stub adapter with the given script """
+    def create_client(self, *script):
+        self.adapter = StubAdapter(script)
+        session = create_session()
+        session.mount('https://', self.adapter)
+        return TiendaNube('app', 'secret', access_token='token', store_id=1, session=session, max_retries=3, backoff_factor=0.5, max_backoff=30)
+
+    def test_429_is_retried_for_every_method(self):
+        self.assertEqual(self.create_client(429, 201).create_shipping_carrier('Correios', 'https://app/options', ['ship']), {'id': 1})
+        self.assertEqual(self.adapter.requests, ['POST', 'POST'])
+
+        self.create_client(429, 429, 200).get_store()
+        self.assertEqual(self.adapter.requests, ['GET'] * 3)
+
+    def test_5xx_is_only_retried_for_idempotent_methods(self):
+        self.create_client(503, 502, 200).get_store()
+        self.assertEqual(self.adapter.requests, ['GET'] * 3)
+
+        self.assertTrue(self.create_client(500, 200).delete_shipping_carrier(7))
+        self.assertEqual(self.adapter.requests, ['DELETE'] * 2)
+
+        with self.assertRaises(TiendaNubeException):
+            self.create_client(503, 201).create_shipping_carrier('Correios', 'https://app/options', ['ship'])
+        self.assertEqual(self.adapter.requests, ['POST'])
+
+    def test_retries_stop_after_max_retries(self):
+        with self.assertRaises(TiendaNubeException):
+            self.create_client(503, 503, 503, 503, 200).get_store()
+        self.assertEqual(len(self.adapter.requests), 4)
+
+    def test_post_is_only_retried_on_connect_errors(self):
+        self.create_client(connect_error(), connect_error(), 201).create_shipping_carrier('Correios', 'https://app/options', ['ship'])
+        self.assertEqual(self.adapter.requests, ['POST'] * 3)
+
+        with self.assertRaises(TiendaNubeException):
+            self.create_client(reset_error(), 201).create_shipping_carrier('Correios', 'https://app/options', ['ship'])
+        self.assertEqual(self.adapter.requests, ['POST'])
+
+        with self.assertRaises(TiendaNubeException):
+            self.create_client(requests.ReadTimeout('Read timed out'), 201).create_shipping_carrier('Correios', 'https://app/options', ['ship'])
+        self.assertEqual(self.adapter.requests, ['POST'])
+
+    def test_idempotent_methods_are_retried_on_any_connection_error(self):
+        self.create_client(reset_error(), requests.ReadTimeout('Read timed out'), 200).get_store()
+        self.assertEqual(self.adapter.requests, ['GET'] * 3)
+
+    def test_retry_waits_honor_the_rate_limit_headers(self):
+        self.create_client((429, {'Retry-After': '2'}), (429, {'x-rate-limit-reset': '1500'}), (429, {'Retry-After': '120'}), 200).get_store()
+
+        self.assertEqual([call[0][0] for call in self.sleep.call_args_list], [2.0, 1.5, 30])
+
+    def test_retry_waits_grow_exponentially_without_headers(self):
+        self.create_client(503, 503, 503, 200).get_store()
+
+        delays = [call[0][0] for call in self.sleep.call_args_list]
+        self.assertEqual(len(delays), 3)
+        for attempt, delay in enumerate(delays):
+            self.assertTrue(0 <= delay <= 0.5 * 2 ** attempt)
+
+if __name__ == '__main__':
+    unittest.main()